@@ -1,7 +1,7 @@
 import uuid
 from typing import Any, List, Optional
 
-import requests
+from app.general.httpclient import http_client
 from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, UploadFile
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
@@ -81,9 +81,9 @@ async def list_assets_catalogue(
     return await crud.asset.get_multi(db, task=task)
 
 
-def check_interlinker(id, token):
+async def check_interlinker(id, token):
     url = f"http://{settings.CATALOGUE_SERVICE}/api/v1/interlinkers/{id}"
-    response = requests.get(url, headers={"Authorization": f"Bearer {token}"})
+    response = await http_client.get(url, headers={"Authorization": f"Bearer {token}"})
     assert response.status_code == 200
     return response.json()
 
@@ -108,15 +108,15 @@ async def create_asset(
 
     #  check that interlinker exists
     if type(asset_in) == schemas.InternalAssetCreate and asset_in.softwareinterlinker_id:
-        softwareinterlinker = check_interlinker(asset_in.softwareinterlinker_id, token)
+        softwareinterlinker = await check_interlinker(asset_in.softwareinterlinker_id, token)
 
         if asset_in.knowledgeinterlinker_id:
-            knowledgeinterlinker = check_interlinker(
+            knowledgeinterlinker = await check_interlinker(
                 asset_in.knowledgeinterlinker_id, token)
 
     elif type(asset_in) == schemas.ExternalAssetCreate:
         if asset_in.externalinterlinker_id:
-            interlinker = check_interlinker(asset_in.externalinterlinker_id, token)
+            interlinker = await check_interlinker(asset_in.externalinterlinker_id, token)
 
     return await crud.asset.create(
         db=db, task=task, asset=asset_in, creator=current_user)
@@ -147,7 +147,7 @@ async def instantiate_asset_from_knowledgeinterlinker(
         raise HTTPException(status_code=403, detail="Not enough permissions")
 
     # Gets the knowledge interlinker
-    response = requests.get(f"http://{settings.CATALOGUE_SERVICE}/api/v1/interlinkers/{asset_in.knowledgeinterlinker_id}", headers={
+    response = await http_client.get(f"http://{settings.CATALOGUE_SERVICE}/api/v1/interlinkers/{asset_in.knowledgeinterlinker_id}", headers={
         "Authorization": "Bearer " + token,
         "Accept-Language": asset_in.language
     })
@@ -158,13 +158,13 @@ async def instantiate_asset_from_knowledgeinterlinker(
 
     # Clones the genesis asset of the knowledge interlinker by calling the software interlinker's (used by the knowledge) /clone method
     try:
-        data_from_interlinker: dict = requests.post(interlinker.get("internal_link") + "/clone", headers={
+        data_from_interlinker: dict = (await http_client.post(interlinker.get("internal_link") + "/clone", headers={
             "Authorization": "Bearer " + token
-        }).json()
+        })).json()
     except:
-        data_from_interlinker: dict = requests.post(interlinker.get("link") + "/clone", headers={
+        data_from_interlinker: dict = (await http_client.post(interlinker.get("link") + "/clone", headers={
             "Authorization": "Bearer " + token
-        }).json()
+        })).json()
 
     external_asset_id = data_from_interlinker["id"] if "id" in data_from_interlinker else data_from_interlinker["_id"]
     # Creates an InternalAsset object with reference to the software interlinker that manages the asset, the knowledge interlinker that contained the genesis asset id and the id of the external resource
@@ -205,13 +205,13 @@ async def clone_asset(
     # TODO: check that the software interlinker of the original asset has the clone capability
     if asset.type == "internalasset":
         try:
-            data_from_interlinker = requests.post(asset.internal_link + "/clone", headers={
+            data_from_interlinker = (await http_client.post(asset.internal_link + "/clone", headers={
                 "Authorization": "Bearer " + token
-            }).json()
+            })).json()
         except:
-            data_from_interlinker = requests.post(asset.link + "/clone", headers={
+            data_from_interlinker = (await http_client.post(asset.link + "/clone", headers={
                 "Authorization": "Bearer " + token
-            }).json()
+            })).json()
 
         external_asset_id = data_from_interlinker["id"] if "id" in data_from_interlinker else data_from_interlinker["_id"]
 
@@ -418,13 +418,13 @@ async def read_internal_asset(
                 "action": "GET"
             }))
             try:
-                return requests.get(asset.internal_link, headers={
+                return (await http_client.get(asset.internal_link, headers={
                     "Authorization": "Bearer " + token
-                }).json()
+                })).json()
             except:
-                return requests.get(asset.link, headers={
+                return (await http_client.get(asset.link, headers={
                     "Authorization": "Bearer " + token
-                }).json()
+                })).json()
         raise HTTPException(status_code=400, detail="Asset is not internal")
     raise HTTPException(status_code=404, detail="Asset not found")
 
@@ -451,13 +451,13 @@ async def read_internal_asset_catalogue(
                 "action": "GET"
             }))
             try:
-                return requests.get(asset.internal_link, headers={
+                return (await http_client.get(asset.internal_link, headers={
                     "Authorization": "Bearer " + token
-                }).json()
+                })).json()
             except:
-                return requests.get(asset.link, headers={
+                return (await http_client.get(asset.link, headers={
                     "Authorization": "Bearer " + token
-                }).json()
+                })).json()
         raise HTTPException(status_code=400, detail="Asset is not internal")
     raise HTTPException(status_code=404, detail="Asset not found")
 
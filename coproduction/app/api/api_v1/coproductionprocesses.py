@@ -5,8 +5,8 @@ from typing import Any, Dict, List, Optional
 from fastapi_pagination import Page
 
 import aiofiles
-import requests
-from fastapi import WebSocket, WebSocketDisconnect, APIRouter, Depends, File, HTTPException, Query, UploadFile
+from app.general.httpclient import http_client
+from fastapi import WebSocket, WebSocketDisconnect, APIRouter, Depends, File, HTTPException, Query, Request, Response, UploadFile
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 
@@ -15,31 +15,47 @@ from app.general import deps
 from app.sockets import socket_manager 
 from app.locales import get_language
 from app.general.emails import send_email
-from fastapi.responses import FileResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from app.models import UserNotification
 from app.models import ParticipationRequest
+from app.coproductionprocesses.crud import encode_cursor
+from app.coproductionprocesses.bulk import export_lines, import_lines
+from app.coproductionprocesses.export import export_zip, load_export
+from app.config import settings
 import os
-import zipfile
 import json
 import html
+from slugify import slugify
 
 router = APIRouter()
 
 
 @router.get("", response_model=List[schemas.CoproductionProcessOutFull])
 async def list_coproductionprocesses(
+    response: Response,
     db: Session = Depends(deps.get_db),
     skip: int = 0,
-    limit: int = 100,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = Query(None),
+    count: bool = False,
     current_user: Optional[models.User] = Depends(deps.get_current_active_user),
     search: str = Query(None)
 ) -> Any:
     """
     Retrieve coproductionprocesses.
+
+    Without limit all of them are returned. With limit, the X-Next-Cursor header gives the
+    cursor of the next page, and count=true adds the total in X-Total-Count.
     """
     if not crud.coproductionprocess.can_list(current_user):
         raise HTTPException(status_code=403, detail="Not enough permissions")
-    return await crud.coproductionprocess.get_multi_by_user(db, user=current_user, search=search)
+    coproductionprocesses = await crud.coproductionprocess.get_multi_by_user(db, user=current_user, search=search, cursor=cursor, limit=limit)
+    if limit and len(coproductionprocesses) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(coproductionprocesses[-1])
+    if count:
+        response.headers["X-Total-Count"] = str(await crud.coproductionprocess.count_by_user(db, user=current_user, search=search))
+    return coproductionprocesses
 
 @router.get("/public", response_model=Page[Any])
 async def list_coproductionprocesses(
@@ -301,35 +317,10 @@ async def get_coproductionprocess_tree(
         raise HTTPException(status_code=404, detail="CoproductionProcess not found")
     if not crud.coproductionprocess.can_read(db=db, user=current_user, object=coproductionprocess):
         raise HTTPException(status_code=403, detail="Not enough permissions")
-    return coproductionprocess.children
-
-
+    return await crud.coproductionprocess.get_tree(db=db, coproductionprocess=coproductionprocess)
 
-# Order the phases by the order of the tasks
-def topological_sort(tasks):
-    visited = set()
-    stack = []
-    mapping = {task.name: task for task in tasks}
 
-    def visit(task):
-        if task.name not in visited:
-            visited.add(task.name)
-            for prereq_name in task.prerequisites:
-                if prereq_name.name in mapping:
-                    visit(mapping[prereq_name.name])
-            stack.append(task)
 
-    # Visit tasks without prerequisites first
-    for task in tasks:
-        if not task.prerequisites:
-            visit(task)
-
-    # Then visit the rest
-    for task in tasks:
-        if task.name not in visited:
-            visit(task)
-
-    return stack
 
 
 
@@ -341,132 +332,121 @@ async def download_zip(
     *,
     db: Session = Depends(deps.get_db),
     id: uuid.UUID,
+    background: bool = False,
     current_user: models.User = Depends(deps.get_current_active_user),
     token: str = Depends(deps.get_current_active_token)
 ):
-
-    #Get the coproductionprocess tree:
+    """
+    Zip of the coproductionprocess (tree, assets and the content of the ones that can be
+    downloaded), streamed while it is made. With more than EXPORT_STREAM_MAX_ASSETS assets to
+    download (or background=true) it is made by an export job instead: the answer is the job
+    (202), and the zip is in /exportjobs/{job_id}/download once it is finished.
+    """
+    from app.worker import export_coproductionprocess
     coproductionprocess = await crud.coproductionprocess.get(db=db, id=id)
-    #Phases:
-    #Order the phases using the topological sort:
-    ordered_phases = topological_sort(coproductionprocess.children)
-    phase_dict_list = [phase.to_dict() for phase in ordered_phases]
-
-    cont_phases=0
-    for phase in ordered_phases:
-        ordered_objectives=topological_sort(phase.children)
-        objectives_dict_list = [obj.to_dict() for obj in ordered_objectives]
-        phase_dict_list[cont_phases]["objectives"]=objectives_dict_list
-        
-        cont_objectives=0
-        for objective in ordered_objectives:
- 
-            ordered_tasks=topological_sort(objective.children)
-            tasks_dict_list = [task.to_dict() for task in ordered_tasks]
-            phase_dict_list[cont_phases]["objectives"][cont_objectives]["tasks"]=tasks_dict_list
-
-
-            cont_objectives=cont_objectives+1
-
-        cont_phases=cont_phases+1
-    #print(phase_dict_list)
-
-   
-    phases_json = json.dumps(phase_dict_list, indent=2)
-    print(phases_json)
-
-
-    # Define the directory name
-    dir_root = 'processes_exported'
-    dir_name = dir_root+'/'+coproductionprocess.name.replace(' ', '_')
-
-    # Create the directory if it does not exist
-    if not os.path.exists(dir_name):
-        os.makedirs(dir_name)
-
-    # Now write the JSON string to a file in the new directory
-    with open(os.path.join(dir_name, 'schema.json'), 'w') as f:
-        f.write(phases_json)
-
-
-    # To do a process to download the process information in a file.
-    # Convert the CoproductionProcess object to a dictionary
-    coproduction_dict = coproductionprocess.to_dict()
-
-    # Specify the directory and filename
-    directory = dir_name
-    filename = "coproduction.json"
-
-    # Create the full file path
-    file_path = os.path.join(directory, filename)
-
-    # Convert the dictionary to JSON
-    json_data = json.dumps(coproduction_dict)
-
-    # Write the JSON data to the specified file
-    with open(file_path, "w") as json_file:
-        json_file.write(json_data)
-
-
-    # Go through the tasks and download all the files:
-    print("-----------------------------------------------------------------")
-    for phase in ordered_phases:
-        ordered_objectives=topological_sort(phase.children)
-        for objective in ordered_objectives:
-            ordered_tasks=topological_sort(objective.children)  
-            for task in ordered_tasks:
-                #Get the assets of this task:
-                print("The task is: "+str(task.id))
-
-                assets=await crud.asset.get_multi_withIntData(db, task=task, token=token)
-      
-                for asset in assets:
-                    print("The asset id: "+str(asset.id))
-                    print("The asset type: "+str(asset.type))
-                    if asset.type=="internalasset":
-                        print("The info del internal asset: "+json.dumps(asset.internalData))
-                        
-                           
-
-                    print(asset)
-                    break
-                break
-            break
-        break
-    print("-----------------------------------------------------------------")
-
-
-
+    if not coproductionprocess:
+        raise HTTPException(status_code=404, detail="CoproductionProcess not found")
+    if not crud.coproductionprocess.can_read(db=db, user=current_user, object=coproductionprocess):
+        raise HTTPException(status_code=403, detail="Not enough permissions")
 
-    # I need to create a json file with the coproduction process
-    # specify your directory
-    directory = dir_name
+    export = await load_export(db=db, coproductionprocess=coproductionprocess)
+    if background or export.downloads > settings.EXPORT_STREAM_MAX_ASSETS:
+        job = await crud.exportjob.create(db=db, coproductionprocess=coproductionprocess, creator=current_user, filename=export.filename)
+        export_coproductionprocess.delay(str(job.id))
+        return JSONResponse(status_code=202, content=jsonable_encoder(schemas.ExportJobOut.from_orm(job)))
 
-    # specify the directory where the zip file will be stored
-    zip_directory = 'zipfiles'
+    await export.add_internal_data(token)
+    return StreamingResponse(
+        export_zip(export, token),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{export.filename}"'},
+    )
 
-    # Check if directory exists. If not, create it.
-    if not os.path.exists(zip_directory):
-        os.makedirs(zip_directory)
 
-    # specify the name of your zip file
-    file_name = coproductionprocess.name.replace(' ', '_')+'.zip'
+@router.get("/exportjobs/{job_id}", response_model=schemas.ExportJobOut)
+async def get_export_job(
+    *,
+    db: Session = Depends(deps.get_db),
+    job_id: uuid.UUID,
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    Status of an export job.
+    """
+    if not (job := await crud.exportjob.get(db=db, id=job_id)):
+        raise HTTPException(status_code=404, detail="Export job not found")
+    if not crud.exportjob.can_read(user=current_user, object=job):
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    return job
 
-    # create the full zip file path
-    zip_path = os.path.join(zip_directory, file_name)
 
-    zipf = zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED)
+@router.get("/exportjobs/{job_id}/download")
+async def download_export_job(
+    *,
+    db: Session = Depends(deps.get_db),
+    job_id: uuid.UUID,
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    Zip made by a finished export job.
+    """
+    if not (job := await crud.exportjob.get(db=db, id=job_id)):
+        raise HTTPException(status_code=404, detail="Export job not found")
+    if not crud.exportjob.can_read(user=current_user, object=job):
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    if job.status != models.ExportJobStatus.finished or not os.path.exists(job.path):
+        raise HTTPException(status_code=404, detail="The zip is not available")
+    return FileResponse(job.path, media_type="application/zip", filename=job.filename)
 
-    # compress all files in the directory
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            zipf.write(os.path.join(root, file))
+@router.get("/{id}/export")
+async def export_coproductionprocess(
+    *,
+    db: Session = Depends(deps.get_db),
+    id: uuid.UUID,
+    current_user: models.User = Depends(deps.get_current_active_user),
+):
+    """
+    The whole coproductionprocess (tree, prerequisites, permissions, assets, claims, assignments,
+    notifications and stories) as JSON lines, streamed, to be loaded by /import in this or
+    another instance.
+    """
+    coproductionprocess = await crud.coproductionprocess.get(db=db, id=id)
+    if not coproductionprocess:
+        raise HTTPException(status_code=404, detail="CoproductionProcess not found")
+    if not crud.coproductionprocess.can_update(user=current_user, object=coproductionprocess):
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    filename = (slugify(coproductionprocess.name or "") or "coproductionprocess") + ".jsonl"
+    return StreamingResponse(
+        export_lines(coproductionprocess.id),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
-    zipf.close()
 
+@router.post("/import", response_model=schemas.CoproductionProcessOutFull)
+async def import_coproductionprocess(
+    *,
+    request: Request,
+    keep_members: bool = False,
+    db: Session = Depends(deps.get_db),
+    current_user: models.User = Depends(deps.get_current_active_user),
+    token: str = Depends(deps.get_current_active_token),
+) -> Any:
+    """
+    Creates a coproductionprocess from the body, an export of /{id}/export, imported while it is
+    read. The user is added to its administrators; the other users and the teams of the export
+    (permissions, administrators, assignments...) are only kept with keep_members, by a superuser.
+    """
+    if not crud.coproductionprocess.can_create(current_user):
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    if keep_members and not current_user.is_superuser:
+        raise HTTPException(status_code=403, detail="Not superuser")
+    id = await import_lines(db=db, chunks=request.stream(), user=current_user, token=token, keep_members=keep_members)
+    coproductionprocess = await crud.coproductionprocess.get(db=db, id=id)
+    if current_user not in coproductionprocess.administrators:
+        await crud.coproductionprocess.add_administrator(db=db, db_obj=coproductionprocess, user=current_user, notifyAfterAdded=False)
+    return coproductionprocess
 
-    print("The zip file is: "+zip_path)
-    return FileResponse(zip_path, media_type='application/zip', filename=file_name)
 
 @router.get("/{id}/tree/catalogue", response_model=Optional[List[schemas.PhaseOutFull]])
 async def get_coproductionprocess_tree_catalogue(
@@ -482,7 +462,7 @@ async def get_coproductionprocess_tree_catalogue(
     if not coproductionprocess:
         raise HTTPException(status_code=404, detail="CoproductionProcess not found")
    
-    return coproductionprocess.children
+    return await crud.coproductionprocess.get_tree(db=db, coproductionprocess=coproductionprocess)
 
 
 # specific
@@ -500,7 +480,7 @@ async def get_activity(
     coproductionprocess = await crud.coproductionprocess.get(db=db, id=id)
     if not coproductionprocess:
         raise HTTPException(status_code=404, detail="CoproductionProcess not found")
-    return requests.get(f"http://logging/api/v1/log?coproductionprocess_ids={id}&size=20").json()
+    return (await http_client.get(f"http://logging/api/v1/log?coproductionprocess_ids={id}&size=20")).json()
 
 
 @router.get("/{id}/assets")
@@ -650,10 +630,13 @@ async def copy_coproductionprocess(
     token: str = Depends(deps.get_current_active_token),
     label_name: str = '',
     from_view:str='',
+    response: Response,
 ) -> Any:
     """
-    Copy a coproductionprocess.
+    Copy a coproductionprocess. The copy is created right away, and filled in the background
+    by a clone job (its id is in the X-Clone-Job-Id header, see /clonejobs/{job_id}).
     """
+    from app.worker import clone_coproductionprocess
     coproductionprocess = await crud.coproductionprocess.get(db=db, id=id)
     if not coproductionprocess:
         raise HTTPException(status_code=404, detail="CoproductionProcess not found")
@@ -662,7 +645,8 @@ async def copy_coproductionprocess(
         if not crud.coproductionprocess.can_remove(user=current_user, object=coproductionprocess):
             raise HTTPException(status_code=403, detail="Not enough permissions")
 
-    new_coprod = await crud.coproductionprocess.copy(db=db, coproductionprocess=coproductionprocess, user=current_user, token=token, label_name=label_name,from_view=from_view)
+    job = await crud.coproductionprocess.copy(db=db, coproductionprocess=coproductionprocess, user=current_user, label_name=label_name,from_view=from_view)
+    new_coprod = job.coproductionprocess
     #print("new_coprod", new_coprod)
     if coproductionprocess.logotype:
         filename, extension = os.path.splitext(coproductionprocess.logotype.split('/')[-1])
@@ -682,9 +666,67 @@ async def copy_coproductionprocess(
     
         await crud.coproductionprocess.set_logotype(db=db, coproductionprocess=new_coprod,logotype_path=out_file_path)
     #print("POSTUPDATE")
+    clone_coproductionprocess.delay(str(job.id))
+    response.headers["X-Clone-Job-Id"] = str(job.id)
     # If new_coprod is returned it raises an error regarding recursion with Python
     return new_coprod.id
 
+
+@router.get("/clonejobs/{job_id}", response_model=schemas.CloneJobOut)
+async def get_clone_job(
+    *,
+    db: Session = Depends(deps.get_db),
+    job_id: uuid.UUID,
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    Status of a clone job.
+    """
+    if not (job := await crud.clonejob.get(db=db, id=job_id)):
+        raise HTTPException(status_code=404, detail="Clone job not found")
+    if not crud.clonejob.can_read(user=current_user, object=job):
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    return job
+
+
+@router.post("/clonejobs/{job_id}/retry", response_model=schemas.CloneJobOut)
+async def retry_clone_job(
+    *,
+    db: Session = Depends(deps.get_db),
+    job_id: uuid.UUID,
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    Runs a failed clone job again, from the last step it finished.
+    """
+    from app.worker import clone_coproductionprocess
+    if not (job := await crud.clonejob.get(db=db, id=job_id)):
+        raise HTTPException(status_code=404, detail="Clone job not found")
+    if not crud.clonejob.can_read(user=current_user, object=job):
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    if job.status != models.CloneJobStatus.failed:
+        raise HTTPException(status_code=400, detail="Only the failed jobs can be retried")
+    job = await crud.clonejob.progress(db, job, status=models.CloneJobStatus.pending, error=None)
+    clone_coproductionprocess.delay(str(job.id))
+    return job
+
+
+@router.get("/{id}/clonejob", response_model=schemas.CloneJobOut)
+async def get_coproductionprocess_clone_job(
+    *,
+    db: Session = Depends(deps.get_db),
+    id: uuid.UUID,
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    Last clone job of a copy of a coproductionprocess.
+    """
+    if not (job := await crud.clonejob.get_last_by_coproductionprocess(db=db, coproductionprocess_id=id)):
+        raise HTTPException(status_code=404, detail="Clone job not found")
+    if not crud.clonejob.can_read(user=current_user, object=job):
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    return job
+
 @router.post("/{id}/addTag")
 async def add_tag(
     *,
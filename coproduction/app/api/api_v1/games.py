@@ -5,7 +5,7 @@ import uuid
 from typing import Any, Dict, List, Optional
 
 import aiofiles
-import requests
+from app.general.httpclient import http_client
 from fastapi import WebSocket, WebSocketDisconnect, APIRouter, Depends, File, HTTPException, Query, UploadFile
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
@@ -25,7 +25,7 @@ async def list_games() -> Any:
     """
     Retrieve games.
     """
-    response = requests.get(f"http://{serviceName}{PATH}")
+    response = await http_client.get(f"http://{serviceName}{PATH}")
     
     return json.loads(response.text)
 
@@ -38,7 +38,7 @@ async def get_game(
     """
     Retrieve game by process_id.
     """
-    response = requests.get(f"http://{serviceName}{PATH}/processId/{process_id}")
+    response = await http_client.get(f"http://{serviceName}{PATH}/processId/{process_id}")
     
     return response.json()
 
@@ -72,7 +72,7 @@ async def set_game(
         "taskList": taskList['taskList']
 
     }
-    response = requests.post(f"http://{serviceName}{PATH}/processId/{process_id}",
+    response = await http_client.post(f"http://{serviceName}{PATH}/processId/{process_id}",
                              json=data,
                              headers={
                                  'Content-type': 'application/json',
@@ -135,7 +135,7 @@ async def update_game(
 
     }
 
-    response = requests.put(f"http://{serviceName}{PATH}",
+    response = await http_client.put(f"http://{serviceName}{PATH}",
                             json=data,
                             headers={
                                 'Content-type': 'application/json',
@@ -163,7 +163,7 @@ async def delete_game(
     if not crud.coproductionprocess.can_update(user=current_user, object=coproductionprocess):
         raise HTTPException(status_code=403, detail="Not enough permissions")
 
-    response = requests.delete(f"http://{serviceName}{PATH}/{coproductionprocess.game_id}",
+    response = await http_client.delete(f"http://{serviceName}{PATH}/{coproductionprocess.game_id}",
                                headers={
                                    'Content-type': 'application/json',
                                    'Accept': '*/*'
@@ -189,7 +189,7 @@ async def get_leaderboard(
     if not coproductionprocess.game_id:
         raise HTTPException(status_code=404, detail="Game not found")
 
-    response = requests.get(f"http://{serviceName}{PATH}/{coproductionprocess.game_id}/player/search",
+    response = await http_client.get(f"http://{serviceName}{PATH}/{coproductionprocess.game_id}/player/search",
                             params={
                                 "period": "global",
                                 "activityType": "development",
@@ -218,7 +218,7 @@ async def get_task(
     if not coproductionprocess.game_id:
         raise HTTPException(status_code=404, detail="Game not found")
 
-    response = requests.get(f"http://{serviceName}{PATH}/{coproductionprocess.game_id}/task/{task_id}",
+    response = await http_client.get(f"http://{serviceName}{PATH}/{coproductionprocess.game_id}/task/{task_id}",
                             headers={
                                 'Content-type': 'application/json',
                                 'Accept': '*/*'
@@ -252,7 +252,7 @@ async def update_task(
     data['id'] = str(task_id)
     data['subtaskList'] = []
 
-    response = requests.put(f"http://{serviceName}{PATH}/{coproductionprocess.game_id}/task",
+    response = await http_client.put(f"http://{serviceName}{PATH}/{coproductionprocess.game_id}/task",
                             json=data,
                             headers={
                                 'Content-type': 'application/json',
@@ -291,7 +291,7 @@ async def add_claim(
     if not await crud.user.get(db=db, id=data['id']):
         raise HTTPException(status_code=404, detail="User not found")
 
-    response = requests.put(f"http://{serviceName}{PATH}/{coproductionprocess.game_id}/task/{task_id}/claim",
+    response = await http_client.put(f"http://{serviceName}{PATH}/{coproductionprocess.game_id}/task/{task_id}/claim",
                             json=data,
                             headers={
                                 'Content-type': 'application/json',
@@ -320,7 +320,7 @@ async def complete_task(
     if not crud.coproductionprocess.can_update(user=current_user, object=coproductionprocess):
         raise HTTPException(status_code=403, detail="Not enough permissions")
 
-    response = requests.put(f"http://{serviceName}{PATH}/{coproductionprocess.game_id}/task/{task_id}/complete",
+    response = await http_client.put(f"http://{serviceName}{PATH}/{coproductionprocess.game_id}/task/{task_id}/complete",
                             headers={
                                 'Content-type': 'application/json',
                                 'Accept': '*/*'
@@ -349,14 +349,14 @@ async def revert_task(
         raise HTTPException(status_code=403, detail="Not enough permissions")
 
     # Revert claim
-    response = requests.put(f"http://{serviceName}{PATH}/{coproductionprocess.game_id}/task/{task_id}/revert",
+    response = await http_client.put(f"http://{serviceName}{PATH}/{coproductionprocess.game_id}/task/{task_id}/revert",
                             headers={
                                 'Content-type': 'application/json',
                                 'Accept': '*/*'
                             })
 
     # Get task
-    task = requests.get(f"http://{serviceName}{PATH}/{coproductionprocess.game_id}/task/{task_id}",
+    task = await http_client.get(f"http://{serviceName}{PATH}/{coproductionprocess.game_id}/task/{task_id}",
                         headers={
                             'Content-type': 'application/json',
                             'Accept': '*/*'
@@ -371,7 +371,7 @@ async def revert_task(
             "management": 0,
             "name": "string"
         }
-        requests.delete(f"http://{serviceName}{PATH}/{coproductionprocess.game_id}/task/{task_id}/removePlayer",
+        await http_client.delete(f"http://{serviceName}{PATH}/{coproductionprocess.game_id}/task/{task_id}/removePlayer",
                         json=data,
                         headers={
                             'Content-type': 'application/json',
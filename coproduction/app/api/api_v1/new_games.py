@@ -5,7 +5,7 @@ import uuid
 from typing import Any, Dict, List, Optional
 
 import aiofiles
-import requests
+from app.general.httpclient import http_client
 from fastapi import (
     WebSocket,
     WebSocketDisconnect,
@@ -36,7 +36,7 @@ async def list_games() -> Any:
     Retrieve games.
     """
 
-    response = requests.get(
+    response = await http_client.get(
         f"http://{service_name}games", headers={"X-API-Key": api_key}
     )
     return json.loads(response.text)
@@ -54,9 +54,9 @@ async def game_exists(
     coproductionprocess = await crud.coproductionprocess.get(db=db, id=process_id)
     if not coproductionprocess:
         raise HTTPException(status_code=404, detail="CoproductionProcess not found")
-    response = requests.get(
+    response = (await http_client.get(
         f"http://{service_name}games?page_size=all", headers={"X-API-Key": api_key}
-    ).json()
+    )).json()
 
     items = response.get("items", [])
 
@@ -81,7 +81,7 @@ async def delete_game(
     """
     Delete game by gameId in gamification engine.
     """
-    response = requests.delete(
+    response = await http_client.delete(
         f"http://{service_name}games/{game_id}",
         headers={"X-API-Key": api_key},
     )
@@ -100,7 +100,7 @@ async def get_game(
     coproductionprocess = await crud.coproductionprocess.get(db=db, id=process_id)
     if not coproductionprocess:
         raise HTTPException(status_code=404, detail="CoproductionProcess not found")
-    response = requests.get(f"http://{serviceName}{PATH}/processId/{process_id}").json()
+    response = (await http_client.get(f"http://{serviceName}{PATH}/processId/{process_id}")).json()
 
     return response
 
@@ -135,7 +135,7 @@ async def set_game(
     }
     external_gameId = None
     try:
-        response = requests.post(
+        response = await http_client.post(
             f"http://{service_name}games",
             json=create_game_body,
             headers={"X-API-Key": api_key},
@@ -182,7 +182,7 @@ async def set_game(
 
     tasks_created = None
     try:
-        tasks_created = requests.post(
+        tasks_created = await http_client.post(
             f"http://{service_name}games/{external_gameId}/tasks/bulk",
             json={"tasks": create_task_body},
             headers={"X-API-Key": api_key},
@@ -222,10 +222,10 @@ async def get_leaderboard(
         raise HTTPException(status_code=404, detail="Game not found")
 
     try:
-        response = requests.get(
+        response = (await http_client.get(
             f"http://{service_name}games/{coproductionprocess.game_id}/points",
             headers={"X-API-Key": api_key},
-        ).json()
+        )).json()
 
         array_externalTaskId = []
         array_externalUserId = []
@@ -304,7 +304,7 @@ async def reward_points(
             status_code=400,
             detail="contribution must have at least 3 characters",
         )
-    response = requests.post(
+    response = await http_client.post(
         f"http://{service_name}games/{game_id}/tasks/{task_id}/points",
         json={
             "externalUserId": str(user_id),
@@ -363,7 +363,7 @@ async def action(
         }
     )
     print('----------------------------END DEBUG------------------------------------')
-    response = requests.post(
+    response = await http_client.post(
         f"http://{service_name}users/{ str(user_id)}/actions",
         json={
             "typeAction": "new_contribution",
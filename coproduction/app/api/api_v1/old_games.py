@@ -5,7 +5,7 @@ import uuid
 from typing import Any, Dict, List, Optional
 
 import aiofiles
-import requests
+from app.general.httpclient import http_client
 from fastapi import (
     WebSocket,
     WebSocketDisconnect,
@@ -63,7 +63,7 @@ async def list_games() -> Any:
     """
     Retrieve games.
     """
-    response = requests.get(f"http://{serviceName}{PATH}")
+    response = await http_client.get(f"http://{serviceName}{PATH}")
     return json.loads(response.text)
 
 
@@ -79,7 +79,7 @@ async def get_game(
     coproductionprocess = await crud.coproductionprocess.get(db=db, id=process_id)
     if not coproductionprocess:
         raise HTTPException(status_code=404, detail="CoproductionProcess not found")
-    response = requests.get(f"http://{serviceName}{PATH}/processId/{process_id}").json()
+    response = (await http_client.get(f"http://{serviceName}{PATH}/processId/{process_id}")).json()
 
     response[0] = get_game_config(response[0], coproductionprocess)
 
@@ -114,7 +114,7 @@ async def set_game(
         "tagList": ["process1", "process3"],
         "taskList": taskList["taskList"],
     }
-    response = requests.post(
+    response = await http_client.post(
         f"http://{serviceName}{PATH}/processId/{process_id}",
         json=data,
         headers={"Content-type": "application/json", "Accept": "*/*"},
@@ -177,7 +177,7 @@ async def update_game(
         "taskList": taskList,
     }
 
-    response = requests.put(
+    response = await http_client.put(
         f"http://{serviceName}{PATH}",
         json=data,
         headers={"Content-type": "application/json", "Accept": "*/*"},
@@ -206,7 +206,7 @@ async def delete_game(
     ):
         raise HTTPException(status_code=403, detail="Not enough permissions")
 
-    response = requests.delete(
+    response = await http_client.delete(
         f"http://{serviceName}{PATH}/{coproductionprocess.game_id}",
         headers={"Content-type": "application/json", "Accept": "*/*"},
     )
@@ -231,14 +231,14 @@ async def get_leaderboard(
     if not coproductionprocess.game_id:
         raise HTTPException(status_code=404, detail="Game not found")
 
-    response = requests.get(
+    response = (await http_client.get(
         f"http://{serviceName}{PATH}/{coproductionprocess.game_id}/player/search",
         params={
             "period": "global",
             "activityType": "development",
         },
         headers={"Content-type": "application/json", "Accept": "*/*"},
-    ).json()
+    )).json()
 
     return response
 
@@ -259,10 +259,10 @@ async def get_task(
     if not coproductionprocess.game_id:
         raise HTTPException(status_code=404, detail="Game not found")
 
-    response = requests.get(
+    response = (await http_client.get(
         f"http://{serviceName}{PATH}/{coproductionprocess.game_id}/task/{task_id}",
         headers={"Content-type": "application/json", "Accept": "*/*"},
-    ).json()
+    )).json()
 
     response = get_game_config(response, coproductionprocess)
     return response
@@ -296,7 +296,7 @@ async def update_task(
     data["id"] = str(task_id)
     data["subtaskList"] = []
 
-    response = requests.put(
+    response = await http_client.put(
         f"http://{serviceName}{PATH}/{coproductionprocess.game_id}/task",
         json=data,
         headers={"Content-type": "application/json", "Accept": "*/*"},
@@ -334,11 +334,11 @@ async def add_claim(
     if not await crud.user.get(db=db, id=data["id"]):
         raise HTTPException(status_code=404, detail="User not found")
 
-    response = requests.put(
+    response = (await http_client.put(
         f"http://{serviceName}{PATH}/{coproductionprocess.game_id}/task/{task_id}/claim",
         json=data,
         headers={"Content-type": "application/json", "Accept": "*/*"},
-    ).json()
+    )).json()
     response = get_game_config(response, coproductionprocess)
     return response
 
@@ -364,10 +364,10 @@ async def complete_task(
     ):
         raise HTTPException(status_code=403, detail="Not enough permissions")
 
-    response = requests.put(
+    response = (await http_client.put(
         f"http://{serviceName}{PATH}/{coproductionprocess.game_id}/task/{task_id}/complete",
         headers={"Content-type": "application/json", "Accept": "*/*"},
-    ).json()
+    )).json()
     response = get_game_config(response, coproductionprocess)
     return response
 
@@ -394,13 +394,13 @@ async def revert_task(
         raise HTTPException(status_code=403, detail="Not enough permissions")
 
     # Revert claim
-    response = requests.put(
+    response = await http_client.put(
         f"http://{serviceName}{PATH}/{coproductionprocess.game_id}/task/{task_id}/revert",
         headers={"Content-type": "application/json", "Accept": "*/*"},
     )
 
     # Get task
-    task = requests.get(
+    task = await http_client.get(
         f"http://{serviceName}{PATH}/{coproductionprocess.game_id}/task/{task_id}",
         headers={"Content-type": "application/json", "Accept": "*/*"},
     )
@@ -414,7 +414,7 @@ async def revert_task(
             "management": 0,
             "name": "string",
         }
-        requests.delete(
+        await http_client.delete(
             f"http://{serviceName}{PATH}/{coproductionprocess.game_id}/task/{task_id}/removePlayer",
             json=data,
             headers={"Content-type": "application/json", "Accept": "*/*"},
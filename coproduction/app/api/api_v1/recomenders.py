@@ -1,7 +1,6 @@
 import uuid
 from typing import Any, List, Optional
 
-import requests
 from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, UploadFile
 from app.messages import log
 from app.assets.schemas import *
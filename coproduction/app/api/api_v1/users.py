@@ -1,11 +1,15 @@
 from typing import Any, List, Optional
 import uuid
 from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
+from uuid_by_string import generate_uuid
 
 from app import crud, models, schemas
 from app.general import deps
-import requests
+from app.general.authentication import decode_token
+from app.general.db.session import SessionLocal
+from app.general.httpclient import http_client
 from app.sockets import socket_manager 
 
 
@@ -21,7 +25,7 @@ async def me(
     Get or create user.
     """
     cookies = {'auth_token': token}
-    response = requests.get(f"http://auth/auth/api/v1/users/me", cookies=cookies, timeout=3)
+    response = await http_client.get(f"http://auth/auth/api/v1/users/me", cookies=cookies, timeout=3)
     return await crud.user.update_or_create(db=db, data=response.json())
 
 @router.get("/search", response_model=List[schemas.UserOutFull])
@@ -46,13 +50,29 @@ async def send_message(
     await socket_manager.send_to_id(id=id, data={"data": message})
 
 
+def get_socket_topics(token: Optional[str], id: str) -> List[str]:
+    # the topics are only given to the owner of the personal socket
+    try:
+        user_id = decode_token(token)["sub"] if token else None
+    except Exception:
+        return []
+    if not user_id or generate_uuid(user_id) != id:
+        return []
+    db = SessionLocal()
+    try:
+        return crud.user.get_socket_topics(db=db, id=user_id)
+    finally:
+        db.close()
+
+
 @router.websocket("/{id}/ws")
 async def websocket_endpoint(
     *,
     id: str,
     websocket: WebSocket
 ):
-    await socket_manager.connect(websocket, id)
+    topics = await run_in_threadpool(get_socket_topics, deps.get_token_in_cookie(websocket), id)
+    await socket_manager.connect(websocket, id, topics=topics)
     try:
         while True:
             data = await websocket.receive_text()
@@ -6,8 +6,13 @@ from pydantic.networks import EmailStr
 
 from app import models
 from app.celery_app import celery_app
+from app.general.db.pool import async_pool_metrics, pool_metrics
+from app.general.db.session import async_engine, engine
 from app.general.deps import get_current_active_superuser
-from app.general.emails import send_test_email
+from app.general.emails import email_dispatcher, send_test_email
+from app.general.httpclient import http_client
+from app.messages import log_shipper
+from app.sockets import socket_manager
 
 
 class Msg(BaseModel):
@@ -39,3 +44,20 @@ def test_email(
     """
     send_test_email(email_to=email_to)
     return {"msg": "Test email sent"}
+
+
+@router.get("/metrics")
+def metrics(
+    current_user: models.User = Depends(get_current_active_superuser),
+) -> Any:
+    """
+    Runtime metrics of this process.
+    """
+    return {
+        "db_pool": pool_metrics.snapshot(engine.pool),
+        "async_db_pool": async_pool_metrics.snapshot(async_engine.sync_engine.pool),
+        "log_shipper": log_shipper.snapshot(),
+        "upstreams": http_client.snapshot(),
+        "sockets": socket_manager.snapshot(),
+        "emails": email_dispatcher.snapshot(),
+    }
@@ -1,9 +1,11 @@
 from fastapi import HTTPException
-import requests
+from app.general.httpclient import http_client
+from app.assets.metadata import add_internal_data
+from app.assets.interlinkers import interlinker_cache
 import os.path
 from app.config import settings
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from app.models import Asset, InternalAsset, ExternalAsset, CoproductionProcessNotification
 from app.tasks.crud import exportCrud as tasksCrud
 from app.schemas import AssetCreate, AssetPatch, ExternalAssetCreate, InternalAssetCreate
@@ -12,6 +14,7 @@ from app import models
 import uuid
 from app.messages import log
 from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
 import favicon
 from app.tasks.crud import update_status_and_progress
 from app.permissions.crud import exportCrud as permissionsCrud
@@ -32,7 +35,9 @@ class CRUDAsset(CRUDBase[Asset, AssetCreate, AssetPatch]):
         queries = []
         if task:
             queries.append(Asset.task_id == task.id)
-        return db.query(Asset).filter(*queries).offset(skip).limit(limit).all()
+        assets = db.query(Asset).filter(*queries).offset(skip).limit(limit).all()
+        await interlinker_cache.prefetch_assets(assets)
+        return assets
 
     async def get_multi_withIntData(
         self, db: Session, task: models.Task, skip: int = 0, limit: int = 100, token: str = ''
@@ -44,83 +49,7 @@ class CRUDAsset(CRUDBase[Asset, AssetCreate, AssetPatch]):
         listAssets = db.query(Asset).filter(
             *queries).offset(skip).limit(limit).all()
 
-        # print('Entra en multi_withIntData')
-
-        for asset in listAssets:
-            if asset.type == "internalasset":
-
-                serverName = settings.SERVER_NAME
-                # print("ServerName")
-                # print(serverName)
-
-                if ('loomio' in asset.link):
-
-                    print("Es un loomio")
-                    asset_name = "Loomio File"
-                    import traceback
-
-                    try:
-
-                        print('Asset id is:'+str(asset.external_asset_id))
-                        print('The request is:')
-
-                        cookies = {'auth_token': token}
-                        requestUrl = f"https://loomio/api/v1/assets/{str(asset.external_asset_id)}"
-                        print(requestUrl)
-
-                        response = requests.get(requestUrl, headers={
-                            "Authorization": "Bearer " + token
-                        }, cookies=cookies)
-
-                        responseDataJson = response.json()
-
-                        print('Response:')
-                        print(responseDataJson)
-                        print('--------')
-
-                        asset_name = responseDataJson.name
-                        print(asset_name)
-                    except Exception:
-                        traceback.print_exc()
-                        pass
-
-                    print("loomio")
-                    asset.internalData = {
-                        'icon': 'https://'+serverName+'/catalogue/static/loomio/logotype.png', 'name': asset_name, 'link': asset.link}
-                else:
-
-                    if ('servicepedia' in asset.link):
-                        # print("Servicepedia")
-                        # print('Es servicepedia')
-
-                        requestlink = f"http://augmenterservice/assets/{asset.external_asset_id}"
-                        response = requests.get(requestlink)
-                        datosAsset = response.json()
-                        # print(datosAsset)
-
-                        asset_uri = asset.link+'/view'
-                        asset.internalData = {
-                            'icon': 'https://'+serverName+'/catalogue/static/augmenter/logotype.png', 'name': datosAsset['name'], 'link': asset_uri}
-
-                    else:
-                        # print("Internal Asset")
-                        serviceName = os.path.split(
-                            asset.link)[0].split('/')[3]
-                        requestlink = f"http://{serviceName}/assets/{asset.external_asset_id}"
-
-                        # print(requestlink)
-                        response = requests.get(requestlink)
-
-                        # print(response)
-                        datosAsset = response.json()
-                        asset.internalData = datosAsset
-
-            if asset.type == "externalasset":
-                # print("External Asset")
-                asset.internalData = {'icon': asset.icon,
-                                      'name': asset.name, 'link': asset.uri}
-
-        return listAssets
+        return await add_internal_data(listAssets, token=token)
 
     def shortName(self, s):
         # split the string into a list
@@ -215,14 +144,13 @@ class CRUDAsset(CRUDBase[Asset, AssetCreate, AssetPatch]):
 
             # try to get favicon
             try:
-                icons = favicon.get(asset.uri)
+                icons = await run_in_threadpool(favicon.get, asset.uri)
                 if len(icons) > 0 and (icon := icons[0]) and icon.format:
-                    response = requests.get(icon.url, stream=True)
+                    response = await http_client.get(icon.url)
 
                     icon_path = f'/app/static/assets/{uuid.uuid4()}.{icon.format}'
                     with open(icon_path, 'wb') as image:
-                        for chunk in response.iter_content(1024):
-                            image.write(chunk)
+                        image.write(response.content)
                     icon_path = icon_path.replace("/app", "")
 
                     data["icon_path"] = icon_path
@@ -319,7 +247,7 @@ class CRUDAsset(CRUDBase[Asset, AssetCreate, AssetPatch]):
         await socket_manager.send_to_id(db_obj.coproductionprocess_id, {"event": "asset_created", "extra": {"task_id": jsonable_encoder(db_obj.task_id)}})
         return db_obj
 
-    async def copy(self, db: Session, asset: AssetCreate, creator: models.User, task: models.Task, token, justRead=False) -> Asset:
+    async def copy(self, db: Session, asset: AssetCreate, creator: models.User, task: models.Task, token, justRead=False, idempotency_key: Optional[str] = None) -> Optional[Asset]:
         # print('Start to copy the assets')
         # print(asset.id)
         # print(asset.type)
@@ -329,22 +257,25 @@ class CRUDAsset(CRUDBase[Asset, AssetCreate, AssetPatch]):
 
             methodCloneCall = "/clone"
             params = {'justRead': justRead}
+            headers = {"Authorization": "Bearer " + token}
+            # with a key the clone can be sent again: the interlinkers that support it return the
+            # same copy instead of making another one
+            retries = None
+            if idempotency_key:
+                headers["Idempotency-Key"] = idempotency_key
+                retries = settings.CLONE_ASSET_RETRIES
 
             # print(methodCloneCall)
             data_from_interlinker = None
             try:
                 # print('The request is:')
                 # print(asset.internal_link + methodCloneCall)
-                data_from_interlinker = requests.post(asset.internal_link + methodCloneCall, params=params, headers={
-                    "Authorization": "Bearer " + token
-                }).json()
+                data_from_interlinker = (await http_client.post(asset.internal_link + methodCloneCall, params=params, headers=headers, retries=retries)).json()
             except:
                 try:
                     # print('The request try again with:')
                     # print(asset.link + methodCloneCall)
-                    data_from_interlinker = requests.post(asset.link + methodCloneCall, params=params, headers={
-                        "Authorization": "Bearer " + token
-                    }).json()
+                    data_from_interlinker = (await http_client.post(asset.link + methodCloneCall, params=params, headers=headers, retries=retries)).json()
                 except:
                     pass
             if (data_from_interlinker):
@@ -356,7 +287,7 @@ class CRUDAsset(CRUDBase[Asset, AssetCreate, AssetPatch]):
                                                 softwareinterlinker_id=asset.softwareinterlinker_id,
                                                 knowledgeinterlinker_id=asset.knowledgeinterlinker_id,
                                                 external_asset_id=external_asset_id)
-                await self.create(db=db, asset=new_asset, creator=creator, task=task)
+                return await self.create(db=db, asset=new_asset, creator=creator, task=task)
 
         elif asset.type == 'externalasset':
             # print('Copying external asset')
@@ -364,7 +295,7 @@ class CRUDAsset(CRUDBase[Asset, AssetCreate, AssetPatch]):
                                             externalinterlinker_id=asset.externalinterlinker_id,
                                             name=asset.name,
                                             uri=asset.uri)
-            await self.create(db=db, asset=new_asset, creator=creator, task=task)
+            return await self.create(db=db, asset=new_asset, creator=creator, task=task)
 
         return None
 
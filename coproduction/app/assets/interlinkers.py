@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterable, Optional, Tuple
+
+from app.config import settings
+from app.general.httpclient import http_client
+
+logger = logging.getLogger(__name__)
+
+
+class InterlinkerCache:
+    """
+    Interlinkers of the catalogue, shared by all the requests of the process (and by all the
+    workers with the "redis" backend). An entry is fresh for ttl seconds. After that it is
+    still served for stale_ttl seconds while it is refreshed in the background, and it is
+    only waited for when it is older than that (or when the catalogue fails).
+    """
+
+    def __init__(self, url: str, maxsize: int, ttl: int, stale_ttl: int, redis_url: Optional[str] = None,
+                 prefix: str = "coproduction:interlinkers:"):
+        self.url = url
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.prefix = prefix
+        self.redis = None
+        if redis_url:
+            import redis
+            self.redis = redis.Redis.from_url(redis_url, socket_timeout=1)
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="interlinkers")
+
+    def _url(self, id) -> str:
+        return f"{self.url}/{id}"
+
+    def _lookup(self, id: str) -> Optional[Tuple[float, Any]]:
+        with self._lock:
+            if (entry := self._entries.get(id)) is not None:
+                self._entries.move_to_end(id)
+                return entry
+        if self.redis:
+            try:
+                if value := self.redis.get(self.prefix + id):
+                    entry = tuple(json.loads(value))
+                    self._store(id, entry, shared=False)
+                    return entry
+            except Exception as e:
+                logger.warning(f"Interlinker cache unavailable: {e}")
+        return None
+
+    def _store(self, id: str, entry: Tuple[float, Any], shared: bool = True) -> None:
+        with self._lock:
+            self._entries[id] = entry
+            self._entries.move_to_end(id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        if self.redis and shared:
+            try:
+                self.redis.set(self.prefix + id, json.dumps(entry), ex=self.ttl + self.stale_ttl)
+            except Exception as e:
+                logger.warning(f"Interlinker cache unavailable: {e}")
+
+    def _age(self, entry: Tuple[float, Any]) -> float:
+        # wall clock, the entries of redis were stored by other processes
+        return time.time() - entry[0]
+
+    def _fetched(self, id: str, response) -> Any:
+        data = response.json()
+        # errors (404 of a removed interlinker...) are returned as before, but not kept
+        if response.status_code == 200:
+            self._store(id, (time.time(), data))
+        return data
+
+    def _refresh(self, id: str) -> None:
+        try:
+            self._fetched(id, http_client.get_sync(self._url(id)))
+        except Exception as e:
+            logger.warning(f"Could not refresh interlinker {id}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(id)
+
+    def _refresh_in_background(self, id: str) -> None:
+        with self._lock:
+            if id in self._refreshing:
+                return
+            self._refreshing.add(id)
+        self._executor.submit(self._refresh, id)
+
+    def get(self, id) -> Any:
+        id = str(id)
+        entry = self._lookup(id)
+        if entry is not None:
+            age = self._age(entry)
+            if age < self.ttl:
+                return entry[1]
+            if age < self.ttl + self.stale_ttl:
+                self._refresh_in_background(id)
+                return entry[1]
+        try:
+            return self._fetched(id, http_client.get_sync(self._url(id)))
+        except Exception:
+            if entry is not None:
+                # better an old version than no interlinker at all
+                return entry[1]
+            raise
+
+    async def prefetch(self, ids: Iterable) -> None:
+        """
+        Loads the interlinkers that are not cached yet (or are too old), concurrently, so the
+        serialization of a list of assets does not ask the catalogue one asset at a time.
+        """
+        missing = set()
+        for id in {str(id) for id in ids if id}:
+            entry = self._lookup(id)
+            if entry is None or self._age(entry) >= self.ttl + self.stale_ttl:
+                missing.add(id)
+            elif self._age(entry) >= self.ttl:
+                self._refresh_in_background(id)
+
+        semaphore = asyncio.Semaphore(settings.INTERLINKER_CACHE_CONCURRENCY)
+
+        async def fetch(id):
+            async with semaphore:
+                try:
+                    self._fetched(id, await http_client.get(self._url(id)))
+                except Exception as e:
+                    logger.warning(f"Could not prefetch interlinker {id}: {e}")
+
+        await asyncio.gather(*[fetch(id) for id in missing])
+
+    async def prefetch_assets(self, assets: Iterable) -> None:
+        ids = []
+        for asset in assets:
+            ids += [getattr(asset, attribute, None) for attribute in ("softwareinterlinker_id", "knowledgeinterlinker_id", "externalinterlinker_id")]
+        await self.prefetch(ids)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        if self.redis:
+            for key in self.redis.scan_iter(self.prefix + "*"):
+                self.redis.delete(key)
+
+
+interlinker_cache = InterlinkerCache(
+    url=f"http://{settings.CATALOGUE_SERVICE}/api/v1/interlinkers",
+    maxsize=settings.INTERLINKER_CACHE_SIZE,
+    ttl=settings.INTERLINKER_CACHE_TTL,
+    stale_ttl=settings.INTERLINKER_CACHE_STALE_TTL,
+    redis_url=settings.REDIS_URL if settings.INTERLINKER_CACHE_BACKEND == "redis" else None,
+)
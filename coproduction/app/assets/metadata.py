@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import os.path
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+from app.config import settings
+from app.assets.interlinkers import interlinker_cache
+from app.general.httpclient import http_client
+
+logger = logging.getLogger(__name__)
+
+
+class AssetMetadataCache:
+    """
+    Per process LRU of the metadata returned by the interlinkers for their assets, keyed by
+    (service, external_asset_id). Entries expire after ttl seconds and are removed when the
+    asset is updated or deleted (see app.signals).
+    """
+
+    def __init__(self, maxsize: int, ttl: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str]) -> Optional[Any]:
+        with self._lock:
+            if entry := self._entries.get(key):
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    return entry[1]
+                del self._entries[key]
+        return None
+
+    def set(self, key: Tuple[str, str], value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, external_asset_id) -> None:
+        # the service is not known without asking the catalogue, so every service is checked
+        with self._lock:
+            for key in [key for key in self._entries if key[1] == str(external_asset_id)]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+asset_metadata_cache = AssetMetadataCache(settings.ASSET_METADATA_CACHE_SIZE, ttl=settings.ASSET_METADATA_CACHE_TTL)
+
+
+async def fetch_metadata(service: str, external_asset_id, url: str, **kwargs) -> Optional[dict]:
+    key = (service, str(external_asset_id))
+    if (data := asset_metadata_cache.get(key)) is not None:
+        return data
+    try:
+        response = await http_client.get(url, **kwargs)
+        response.raise_for_status()
+        data = response.json()
+    except Exception as e:
+        # not cached, the interlinker is asked again by the next listing
+        logger.warning(f"Could not get the metadata of asset {external_asset_id} from {service}: {e}")
+        return None
+    asset_metadata_cache.set(key, data)
+    return data
+
+
+async def get_internal_data(asset, token: str) -> dict:
+    server_name = settings.SERVER_NAME
+    link = asset.link
+    if "loomio" in link:
+        data = await fetch_metadata(
+            "loomio", asset.external_asset_id, f"https://loomio/api/v1/assets/{asset.external_asset_id}",
+            headers={"Authorization": "Bearer " + token}, cookies={"auth_token": token}
+        ) or {}
+        return {"icon": f"https://{server_name}/catalogue/static/loomio/logotype.png", "name": data.get("name", "Loomio File"), "link": link}
+
+    if "servicepedia" in link:
+        data = await fetch_metadata(
+            "augmenterservice", asset.external_asset_id, f"http://augmenterservice/assets/{asset.external_asset_id}"
+        ) or {}
+        return {"icon": f"https://{server_name}/catalogue/static/augmenter/logotype.png", "name": data.get("name"), "link": link + "/view"}
+
+    service = os.path.split(link)[0].split("/")[3]
+    data = await fetch_metadata(service, asset.external_asset_id, f"http://{service}/assets/{asset.external_asset_id}")
+    if data is None:
+        # the interlinker is down, the asset is listed anyway
+        return {"id": str(asset.external_asset_id), "name": None, "icon": None, "link": link}
+    return dict(data)
+
+
+async def add_internal_data(assets: List, token: str = "") -> List:
+    """
+    Sets the internalData of every asset, asking the interlinkers concurrently (at most
+    ASSET_METADATA_CONCURRENCY requests at a time).
+    """
+    # the links of the assets come from their interlinkers
+    await interlinker_cache.prefetch_assets(assets)
+    semaphore = asyncio.Semaphore(settings.ASSET_METADATA_CONCURRENCY)
+
+    async def add(asset):
+        async with semaphore:
+            try:
+                asset.internalData = await get_internal_data(asset, token)
+            except Exception as e:
+                logger.warning(f"Could not get the metadata of asset {asset.id}: {e}")
+                asset.internalData = {"id": str(asset.external_asset_id), "name": None, "icon": None, "link": None}
+
+    for asset in assets:
+        if asset.type == "externalasset":
+            asset.internalData = {"icon": asset.icon, "name": asset.name, "link": asset.uri}
+    await asyncio.gather(*[add(asset) for asset in assets if asset.type == "internalasset"])
+    return assets
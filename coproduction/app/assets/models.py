@@ -1,7 +1,7 @@
 import json
 import uuid
 from typing import TypedDict
-import requests
+from app.assets.interlinkers import interlinker_cache
 from sqlalchemy import (
     Boolean,
     Column,
@@ -95,14 +95,12 @@ class InternalAsset(Asset):
 
     @cached_property
     def software_response(self):
-        return requests.get(
-            f"http://{settings.CATALOGUE_SERVICE}/api/v1/interlinkers/{self.softwareinterlinker_id}").json()
+        return interlinker_cache.get(self.softwareinterlinker_id)
 
     @cached_property
     def knowledge_response(self):
         if self.knowledgeinterlinker_id:
-            return requests.get(
-                f"http://{settings.CATALOGUE_SERVICE}/api/v1/interlinkers/{self.knowledgeinterlinker_id}").json()
+            return interlinker_cache.get(self.knowledgeinterlinker_id)
         return
 
     @property
@@ -168,7 +166,7 @@ class ExternalAsset(Asset):
     @cached_property
     def external_response(self):
         if self.externalinterlinker_id:
-            return requests.get(f"http://{settings.CATALOGUE_SERVICE}/api/v1/interlinkers/{self.externalinterlinker_id}").json()
+            return interlinker_cache.get(self.externalinterlinker_id)
         return
 
     @property
@@ -0,0 +1,88 @@
+import uuid
+from datetime import timedelta
+from typing import Optional
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Session
+
+from app import models
+from app.clonejobs.models import CloneJob, CloneJobStatus
+from app.config import settings
+from app.schemas import CloneJobOut
+from app.general.utils.CRUDBase import CRUDBase
+from app.sockets import socket_manager, user_topic
+
+
+class CRUDCloneJob(CRUDBase[CloneJob, CloneJobOut, CloneJobOut]):
+    async def create(self, db: Session, coproductionprocess: models.CoproductionProcess, cloned_from: models.CoproductionProcess, creator: models.User, from_view: str) -> CloneJob:
+        db_obj = CloneJob(
+            coproductionprocess=coproductionprocess,
+            cloned_from=cloned_from,
+            creator=creator,
+            from_view=from_view,
+            status=CloneJobStatus.pending,
+            state={},
+        )
+        db.add(db_obj)
+        db.commit()
+        db.refresh(db_obj)
+        return db_obj
+
+    async def get_last_by_coproductionprocess(self, db: Session, coproductionprocess_id: uuid.UUID) -> Optional[CloneJob]:
+        return db.query(CloneJob).filter(
+            CloneJob.coproductionprocess_id == coproductionprocess_id
+        ).order_by(CloneJob.created_at.desc()).first()
+
+    def claim(self, db: Session, job: CloneJob) -> bool:
+        # a job is only run by one worker at a time: the pending and failed ones, and the running
+        # ones whose worker died (celery delivers them again, the tasks are acked late), once
+        # their lease has expired
+        claimed = db.query(CloneJob).filter(
+            CloneJob.id == job.id,
+            or_(
+                CloneJob.status.in_([CloneJobStatus.pending, CloneJobStatus.failed]),
+                and_(
+                    CloneJob.status == CloneJobStatus.running,
+                    or_(CloneJob.lease_until == None, CloneJob.lease_until < func.now()),
+                ),
+            ),
+        ).update({
+            CloneJob.status: CloneJobStatus.running,
+            CloneJob.error: None,
+            CloneJob.lease_until: func.now() + timedelta(seconds=settings.JOB_LEASE),
+        }, synchronize_session=False)
+        db.commit()
+        db.refresh(job)
+        return bool(claimed)
+
+    async def progress(self, db: Session, job: CloneJob, **values) -> CloneJob:
+        for field, value in values.items():
+            setattr(job, field, value)
+        db.add(job)
+        db.commit()
+        event = {"event": "clone_progress", "extra": {
+            "job_id": str(job.id),
+            "status": job.status.value,
+            "step": job.step,
+            "done": job.done,
+            "total": job.total,
+        }}
+        await socket_manager.send_to_id(job.coproductionprocess_id, event)
+        if job.creator_id:
+            await socket_manager.send_to_id(user_topic(job.creator_id), event)
+        return job
+
+    def save_state(self, db: Session, job: CloneJob, **values) -> None:
+        # a new dict, so the JSONB column is flagged as modified
+        job.state = {**(job.state or {}), **values}
+        db.add(job)
+        db.commit()
+
+    # CRUD Permissions
+    def can_read(self, user: models.User, object: CloneJob) -> bool:
+        if user.id == object.creator_id:
+            return True
+        return bool(object.coproductionprocess) and user in object.coproductionprocess.administrators
+
+
+exportCrud = CRUDCloneJob(CloneJob)
@@ -0,0 +1,41 @@
+import enum
+import uuid
+
+from sqlalchemy import Column, DateTime, Enum, ForeignKey, Integer, String, Text
+from sqlalchemy.dialects.postgresql import JSONB, UUID
+from sqlalchemy.orm import relationship
+
+from app.general.db.base_class import Base as BaseModel
+
+
+class CloneJobStatus(str, enum.Enum):
+    pending = "pending"
+    running = "running"
+    finished = "finished"
+    failed = "failed"
+
+
+class CloneJob(BaseModel):
+    """
+    Copy of a coproduction process made in the background (app.worker.clone_coproductionprocess).
+    state is where the copy is: the ids of the copied tree items and assets, so a job that is
+    run again (after a failure or a restart of the worker) goes on from there.
+    """
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    # the copy, created when the job is
+    coproductionprocess_id = Column(UUID(as_uuid=True), ForeignKey("coproductionprocess.id", ondelete="CASCADE"), index=True)
+    coproductionprocess = relationship("CoproductionProcess", foreign_keys=[coproductionprocess_id])
+    cloned_from_id = Column(UUID(as_uuid=True), ForeignKey("coproductionprocess.id", ondelete="SET NULL"))
+    cloned_from = relationship("CoproductionProcess", foreign_keys=[cloned_from_id])
+    creator_id = Column(String, ForeignKey("user.id", ondelete="SET NULL"))
+    creator = relationship("User", foreign_keys=[creator_id])
+    from_view = Column(String, nullable=True)
+
+    status = Column(Enum(CloneJobStatus, create_constraint=False, native_enum=False), default=CloneJobStatus.pending)
+    step = Column(String, nullable=True)
+    done = Column(Integer, default=0)
+    total = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
+    state = Column(JSONB, default=dict)
+    # a running job belongs to its worker until then (renewed while the worker is alive)
+    lease_until = Column(DateTime, nullable=True)
@@ -0,0 +1,23 @@
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class CloneJobOut(BaseModel):
+    id: uuid.UUID
+    created_at: datetime
+    updated_at: Optional[datetime]
+    coproductionprocess_id: Optional[uuid.UUID]
+    cloned_from_id: Optional[uuid.UUID]
+    creator_id: Optional[str]
+    from_view: Optional[str]
+    status: str
+    step: Optional[str]
+    done: int
+    total: int
+    error: Optional[str]
+
+    class Config:
+        orm_mode = True
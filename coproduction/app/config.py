@@ -33,6 +33,21 @@ class Settings(BaseSettings):
     POSTGRES_PASSWORD: str
     POSTGRES_DB: str
     SQLALCHEMY_DATABASE_URI: Optional[PostgresDsn] = None
+    # "queue" keeps a pool of connections per process, "null" opens one per checkout
+    DB_POOL_CLASS: str = "queue"
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    SQLALCHEMY_ASYNC_DATABASE_URI: Optional[str] = None
+
+    @validator("SQLALCHEMY_ASYNC_DATABASE_URI", pre=True)
+    def assemble_async_db_connection(cls, v: Optional[str], values: Dict[str, Any]) -> Any:
+        if isinstance(v, str):
+            return v
+        # same database, reached through asyncpg
+        return str(values.get("SQLALCHEMY_DATABASE_URI")).replace("postgresql://", "postgresql+asyncpg://", 1)
 
     @validator("SQLALCHEMY_DATABASE_URI", pre=True)
     def assemble_db_connection(cls, v: Optional[str], values: Dict[str, Any]) -> Any:
@@ -72,11 +87,92 @@ class Settings(BaseSettings):
     EMAIL_RESET_TOKEN_EXPIRE_HOURS: int = 48
     EMAIL_TEMPLATES_DIR: str = "/app/email-templates/build"
     EMAILS_ENABLED: bool = True
+    # attempts of the /clone of every asset of a process being copied (the job can also be retried)
+    CLONE_ASSET_RETRIES: int = 3
+    # seconds a running clone or export job belongs to its worker, renewed every third of it
+    JOB_LEASE: int = 300
+
+    # zips of the processes (/download): assets downloaded at a time, bytes of each one kept in
+    # memory (the rest goes to a temporary file), and from how many assets the zip is made by the worker
+    EXPORT_CONCURRENCY: int = 4
+    EXPORT_SPOOL_SIZE: int = 1024 * 1024
+    EXPORT_STREAM_MAX_ASSETS: int = 50
+    # where the worker leaves the zips, and seconds they are kept
+    EXPORTS_DIR: str = "/app/exports"
+    EXPORT_TTL: int = 24 * 3600
+
+    # rows read or inserted at a time by the line-delimited export and import of the processes,
+    # and resources of the imported assets cloned at a time
+    BULK_BATCH_SIZE: int = 1000
+    BULK_CLONE_CONCURRENCY: int = 4
+
+    # threads (with an SMTP connection each) sending the emails, and jobs waiting for them
+    EMAIL_WORKERS: int = 2
+    EMAIL_QUEUE_SIZE: int = 1000
+    EMAIL_SMTP_IDLE_TIMEOUT: float = 30
 
     KEYCLOAK_CLIENT_ID: str
     KEYCLOAK_CLIENT_SECRET: str
     KEYCLOAK_REALM: str
     KEYCLOAK_URL_REALM: str
+    # seconds the realm public key is cached / minimum seconds between forced refetches
+    KEYCLOAK_PUBLIC_KEY_TTL: int = 3600
+    KEYCLOAK_PUBLIC_KEY_MIN_REFETCH_INTERVAL: int = 10
+    KEYCLOAK_EXECUTOR_WORKERS: int = 4
+
+    REDIS_URL: str = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379")
+
+    # calls to the other services (app.general.httpclient), seconds
+    HTTP_TIMEOUT: float = 30
+    HTTP_CONNECT_TIMEOUT: float = 3
+    HTTP_POOL_MAX_CONNECTIONS: int = 50
+    HTTP_POOL_MAX_KEEPALIVE: int = 10
+    HTTP_POOL_KEEPALIVE_EXPIRY: float = 30
+    HTTP_RETRIES: int = 2
+    HTTP_RETRY_BACKOFF: float = 0.2
+    HTTP_BREAKER_THRESHOLD: int = 5
+    HTTP_BREAKER_RESET_TIMEOUT: float = 30
+
+    # metadata of the internal assets, asked to the interlinkers when listing assets
+    ASSET_METADATA_CACHE_SIZE: int = 5000
+    ASSET_METADATA_CACHE_TTL: int = 300
+    ASSET_METADATA_CONCURRENCY: int = 10
+
+    # interlinkers of the catalogue: "memory" (per worker) or "redis" (shared by the workers)
+    INTERLINKER_CACHE_BACKEND: str = "memory"
+    INTERLINKER_CACHE_SIZE: int = 5000
+    INTERLINKER_CACHE_TTL: int = 300
+    INTERLINKER_CACHE_STALE_TTL: int = 3600
+    INTERLINKER_CACHE_CONCURRENCY: int = 10
+
+    # websockets: "redis" (pub/sub between the workers, also the progress of the celery jobs) or
+    # "memory" (only the clients of the same worker: nothing sent by celery reaches them)
+    SOCKETS_BACKEND: str = "redis"
+    # outgoing messages waiting for a client before it is disconnected as too slow
+    SOCKETS_SEND_QUEUE_SIZE: int = 100
+    SOCKETS_SEND_TIMEOUT: float = 10
+    # the changes of the tree of a process during this time are sent as one tree_changed event
+    SOCKETS_TREE_DEBOUNCE: float = 0.25
+
+    LOGGING_URL: str = "http://logging/api/v1/log"
+    # endpoint that takes a list of messages; if not set they are posted one by one
+    LOGGING_BATCH_URL: Optional[str] = None
+    LOGGING_BATCH_SIZE: int = 100
+    LOGGING_FLUSH_INTERVAL: float = 1.0
+    LOGGING_QUEUE_SIZE: int = 10000
+    LOGGING_SPOOL_DIR: str = "/tmp/coproduction-log-spool"
+    LOGGING_SPOOL_MAX_BYTES: int = 50 * 1024 * 1024
+    LOGGING_TIMEOUT: int = 2
+
+    # "redis" (shared by the workers), "memory" (only with one worker: the invalidations are
+    # not seen by the other ones) or "none"
+    PERMISSION_CACHE_BACKEND: str = "redis"
+    PERMISSION_CACHE_SIZE: int = 20000
+    PERMISSION_CACHE_TTL: int = 600
+
+    # prerequisite graphs of the processes, by version of their tree (per worker)
+    PREREQUISITE_GRAPH_CACHE_SIZE: int = 1000
+    PREREQUISITE_GRAPH_CACHE_TTL: int = 3600
 
     @validator("EMAILS_ENABLED", pre=True)
     def get_emails_enabled(cls, v: bool, values: Dict[str, Any]) -> bool:
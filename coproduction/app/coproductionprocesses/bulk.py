@@ -0,0 +1,333 @@
+import asyncio
+import json
+import logging
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import ARRAY, Date, DateTime, Float, Numeric, String, Table, func, select, tuple_
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import Session
+
+from app import models
+from app.assets.interlinkers import interlinker_cache
+from app.config import settings
+from app.general.db.session import SessionLocal
+from app.general.httpclient import http_client
+from app.tables import coproductionprocess_administrators_association_table, coproductionprocess_tags_association_table
+from app.treeitems.models import prerequisites
+
+logger = logging.getLogger(__name__)
+
+FORMAT = "coproductionprocess"
+VERSION = 1
+
+# the notifications are shared by all the processes: the ones of the export are matched with the
+# ones of this instance by these columns, and only inserted if they are not here
+MATCH_BY = {"notification": ("event", "language")}
+# rows skipped when all these columns are empty after the import (a permission of nobody)
+ONE_OF = {"permission": ("team_id", "user_id"), "assignment": ("user_id",), "claim": ("user_id",)}
+# the references to them are only kept, if they exist, when asked by a superuser: otherwise the
+# importer could give anyone (or any team) a role in the process
+MEMBERS = ("user", "team")
+
+
+def selections(coproductionprocess_id: uuid.UUID) -> List[Tuple[Table, object, list]]:
+    """
+    Tables of the export, with the condition of the rows of the process and their order. A row
+    only refers to rows written before it, so the importer can remap it as soon as it reads it.
+    """
+    treeitem = models.TreeItem.__table__
+    asset = models.Asset.__table__
+    treeitem_ids = select(treeitem.c.id).where(treeitem.c.path.contains([coproductionprocess_id]))
+    asset_ids = select(asset.c.id).where(asset.c.task_id.in_(treeitem_ids))
+    coproductionprocessnotification = models.CoproductionProcessNotification.__table__
+    return [
+        (models.CoproductionProcess.__table__, models.CoproductionProcess.__table__.c.id == coproductionprocess_id, []),
+        (coproductionprocess_administrators_association_table, coproductionprocess_administrators_association_table.c.coproductionprocess_id == coproductionprocess_id, []),
+        (coproductionprocess_tags_association_table, coproductionprocess_tags_association_table.c.coproductionprocess_id == coproductionprocess_id, []),
+        # the parents before their children (their ids are in the paths)
+        (treeitem, treeitem.c.id.in_(treeitem_ids), [func.cardinality(treeitem.c.path), treeitem.c.created_at]),
+        (models.Phase.__table__, models.Phase.__table__.c.id.in_(treeitem_ids), []),
+        (models.Objective.__table__, models.Objective.__table__.c.id.in_(treeitem_ids), []),
+        (models.Task.__table__, models.Task.__table__.c.id.in_(treeitem_ids), []),
+        (prerequisites, prerequisites.c.treeitem_a_id.in_(treeitem_ids), []),
+        (models.Permission.__table__, models.Permission.__table__.c.coproductionprocess_id == coproductionprocess_id, []),
+        (asset, asset.c.id.in_(asset_ids), [asset.c.created_at]),
+        (models.InternalAsset.__table__, models.InternalAsset.__table__.c.id.in_(asset_ids), []),
+        (models.ExternalAsset.__table__, models.ExternalAsset.__table__.c.id.in_(asset_ids), []),
+        (models.Assignment.__table__, models.Assignment.__table__.c.asset_id.in_(asset_ids), [models.Assignment.__table__.c.created_at]),
+        (models.Claim.__table__, models.Claim.__table__.c.asset_id.in_(asset_ids), [models.Claim.__table__.c.created_at]),
+        (models.Notification.__table__, models.Notification.__table__.c.id.in_(
+            select(coproductionprocessnotification.c.notification_id).where(coproductionprocessnotification.c.coproductionprocess_id == coproductionprocess_id).union(
+                select(models.UserNotification.__table__.c.notification_id).where(models.UserNotification.__table__.c.coproductionprocess_id == coproductionprocess_id))
+        ), []),
+        (coproductionprocessnotification, coproductionprocessnotification.c.coproductionprocess_id == coproductionprocess_id, [coproductionprocessnotification.c.created_at]),
+        (models.UserNotification.__table__, models.UserNotification.__table__.c.coproductionprocess_id == coproductionprocess_id, [models.UserNotification.__table__.c.created_at]),
+        (models.Story.__table__, models.Story.__table__.c.coproductionprocess_id == coproductionprocess_id, [models.Story.__table__.c.created_at]),
+        (models.Story.keywords.property.secondary, models.Story.keywords.property.secondary.c.story_id.in_(
+            select(models.Story.__table__.c.id).where(models.Story.__table__.c.coproductionprocess_id == coproductionprocess_id)
+        ), []),
+    ]
+
+
+def encode(value):
+    if isinstance(value, (uuid.UUID, Decimal)):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if hasattr(value, "value"):
+        # enums
+        return value.value
+    raise TypeError(f"{type(value).__name__} is not serializable")
+
+
+def decode(type_, value):
+    if value is None:
+        return None
+    if isinstance(type_, ARRAY):
+        return [decode(type_.item_type, item) for item in value]
+    if isinstance(type_, UUID) and type_.as_uuid:
+        return uuid.UUID(value)
+    if isinstance(type_, DateTime):
+        return datetime.fromisoformat(value)
+    if isinstance(type_, Date):
+        return date.fromisoformat(value)
+    if isinstance(type_, Numeric) and not isinstance(type_, Float):
+        return Decimal(value)
+    return value
+
+
+def export_lines(coproductionprocess_id: uuid.UUID) -> Iterator[bytes]:
+    """
+    The process as JSON lines: a header, then a {"table", "row"} line for every row. The rows are
+    read with server side cursors, BULK_BATCH_SIZE at a time, from a snapshot of the database.
+    """
+    db = SessionLocal()
+    try:
+        # all the tables as they were when the export started
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        yield (json.dumps({
+            "format": FORMAT,
+            "version": VERSION,
+            "coproductionprocess_id": str(coproductionprocess_id),
+            "exported_at": datetime.now().isoformat(),
+        }) + "\n").encode()
+        for table, condition, order_by in selections(coproductionprocess_id):
+            result = db.execute(select(table).where(condition).order_by(*order_by).execution_options(stream_results=True))
+            for rows in result.partitions(settings.BULK_BATCH_SIZE):
+                yield "".join(
+                    json.dumps({"table": table.name, "row": dict(row._mapping)}, default=encode) + "\n" for row in rows
+                ).encode()
+    finally:
+        db.close()
+
+
+class ProcessImporter:
+    """
+    Loads an export as a new process. Every row gets a new id and the references to the rows
+    of the export are remapped (ids_dict of the copy, for every table). The references to rows
+    that are not exported (organizations, tags...) are kept if they exist in this instance; if
+    they do not, they are emptied, or the row is skipped when they can not be. The users and the
+    teams are only kept with keep_members, the importer always. The resources of the internal
+    assets are cloned in their interlinkers, with the token of the importer, and the assets that
+    can not be cloned are skipped. The rows are inserted in batches of BULK_BATCH_SIZE, and
+    committed together at the end.
+    """
+
+    def __init__(self, db: Session, user: models.User, token: str, keep_members: bool = False):
+        self.db = db
+        self.user = user
+        self.token = token
+        self.keep_members = keep_members
+        self.tables: Dict[str, Table] = {}
+        for table, _, _ in selections(uuid.uuid4()):
+            self.tables[table.name] = table
+        self.header: Optional[dict] = None
+        # old id => new id
+        self.ids: Dict[uuid.UUID, uuid.UUID] = {}
+        # (table, column) => {value: exists}, of the rows of this instance that are referred to
+        self.existing: Dict[Tuple[str, str], Dict[object, bool]] = {}
+        self.table: Optional[Table] = None
+        self.rows: List[dict] = []
+        self.counts: Dict[str, int] = {}
+        self.skipped = 0
+
+    async def feed(self, line: bytes) -> None:
+        if not line.strip():
+            return
+        try:
+            data = json.loads(line)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid line in the export")
+        if self.header is None:
+            if data.get("format") != FORMAT or data.get("version") != VERSION:
+                raise HTTPException(status_code=400, detail="Unknown export format")
+            self.header = data
+            return
+        if (table := self.tables.get(data.get("table"))) is None:
+            raise HTTPException(status_code=400, detail=f"Unknown table {data.get('table')}")
+        if table is not self.table or len(self.rows) >= settings.BULK_BATCH_SIZE:
+            await self.flush()
+            self.table = table
+        row = data.get("row") or {}
+        self.rows.append({column.name: decode(column.type, row[column.name]) for column in table.columns if column.name in row})
+
+    async def flush(self) -> None:
+        table, rows = self.table, self.rows
+        self.rows = []
+        if not rows:
+            return
+        if table.name in MATCH_BY:
+            rows = self.match(table, rows)
+        else:
+            for row in rows:
+                if (id := row.get("id")) is not None and not table.c.id.foreign_keys:
+                    row["id"] = self.ids[id] = uuid.uuid4()
+        self.check_existing(table, rows)
+        rows = [row for row in rows if self.remap(table, row)]
+        if table.name == "internalasset":
+            rows = await self.clone(rows)
+        if rows:
+            self.db.execute(table.insert(), rows)
+            self.counts[table.name] = self.counts.get(table.name, 0) + len(rows)
+
+    def match(self, table: Table, rows: List[dict]) -> List[dict]:
+        columns = [table.c[name] for name in MATCH_BY[table.name]]
+        keys = {tuple(row.get(column.name) for column in columns) for row in rows}
+        found = dict(
+            (tuple(key), id) for *key, id in self.db.execute(
+                select(*columns, table.c.id).where(tuple_(*columns).in_(list(keys)))
+            )
+        )
+        new = []
+        for row in rows:
+            key = tuple(row.get(column.name) for column in columns)
+            if key in found:
+                self.ids[row["id"]] = found[key]
+            else:
+                row["id"] = self.ids[row["id"]] = found[key] = uuid.uuid4()
+                new.append(row)
+        return new
+
+    def check_existing(self, table: Table, rows: List[dict]) -> None:
+        # the rows of this instance referred to by the batch, one query per referred column
+        for column in table.columns:
+            for foreign_key in column.foreign_keys:
+                target = foreign_key.column
+                if target.table.name in self.tables:
+                    continue
+                known = self.existing.setdefault((target.table.name, target.name), {})
+                unknown = {row[column.name] for row in rows if row.get(column.name) is not None} - set(known)
+                if unknown:
+                    found = {value for value, in self.db.execute(select(target).where(target.in_(list(unknown))))}
+                    for value in unknown:
+                        known[value] = value in found
+
+    def remap(self, table: Table, row: dict) -> bool:
+        for column in table.columns:
+            if (value := row.get(column.name)) is None or (column.name == "id" and not column.foreign_keys):
+                continue
+            if column.foreign_keys:
+                foreign_key = next(iter(column.foreign_keys))
+                target = foreign_key.column
+                if target.table.name in self.tables:
+                    found = value in self.ids
+                    value = self.ids.get(value)
+                    # a row of the export that was skipped: the rows that would be removed with
+                    # it are skipped too
+                    if not found and foreign_key.ondelete == "CASCADE":
+                        self.skipped += 1
+                        return False
+                elif target.table.name in MEMBERS and not self.keep_members:
+                    found = target.table.name == "user" and value == self.user.id
+                else:
+                    found = self.existing[(target.table.name, target.name)][value]
+                if not found:
+                    if not column.nullable or column.primary_key:
+                        self.skipped += 1
+                        return False
+                    value = None
+                row[column.name] = value
+            elif isinstance(column.type, ARRAY):
+                row[column.name] = [self.ids.get(item, item) for item in value]
+            elif isinstance(column.type, UUID):
+                row[column.name] = self.ids.get(value, value)
+            elif isinstance(column.type, String) and column.name.endswith("_id"):
+                # ids stored as strings (asset_id of the notifications)
+                try:
+                    if (new := self.ids.get(uuid.UUID(value))) is not None:
+                        row[column.name] = str(new)
+                except ValueError:
+                    pass
+        if table.name in ONE_OF and all(row.get(name) is None for name in ONE_OF[table.name]):
+            self.skipped += 1
+            return False
+        return True
+
+    async def clone(self, rows: List[dict]) -> List[dict]:
+        # the resources of the export belong to the process it comes from: removing this one
+        # would remove them
+        await interlinker_cache.prefetch(row.get("softwareinterlinker_id") for row in rows)
+        semaphore = asyncio.Semaphore(settings.BULK_CLONE_CONCURRENCY)
+
+        async def clone(row) -> bool:
+            asset = models.InternalAsset(softwareinterlinker_id=row.get("softwareinterlinker_id"), external_asset_id=row.get("external_asset_id"))
+            # the same copy if the import is sent again, for the interlinkers that support it
+            headers = {"Authorization": "Bearer " + self.token, "Idempotency-Key": f"import:{row['id']}"}
+            error = None
+            async with semaphore:
+                for link in ("internal_link", "link"):
+                    try:
+                        response = await http_client.post(getattr(asset, link) + "/clone", params={"justRead": False}, headers=headers, retries=settings.CLONE_ASSET_RETRIES)
+                        response.raise_for_status()
+                        data = response.json()
+                        row["external_asset_id"] = data["id"] if "id" in data else data["_id"]
+                        return True
+                    except Exception as e:
+                        error = e
+            logger.warning(f"Could not clone the resource of the asset {row['id']}: {error}")
+            return False
+
+        cloned = await asyncio.gather(*[clone(row) for row in rows])
+        if failed := {row["id"] for row, ok in zip(rows, cloned) if not ok}:
+            # their asset rows are already inserted, and the rows that refer to them are skipped
+            asset = self.tables["asset"]
+            self.db.execute(asset.delete().where(asset.c.id.in_(list(failed))))
+            self.counts["asset"] -= len(failed)
+            self.skipped += 2 * len(failed)
+            for old, new in list(self.ids.items()):
+                if new in failed:
+                    del self.ids[old]
+        return [row for row, ok in zip(rows, cloned) if ok]
+
+    async def finish(self) -> uuid.UUID:
+        await self.flush()
+        if self.header is None:
+            raise HTTPException(status_code=400, detail="Empty export")
+        if (coproductionprocess_id := self.ids.get(uuid.UUID(self.header["coproductionprocess_id"]))) is None:
+            raise HTTPException(status_code=400, detail="The export has no coproductionprocess")
+        logger.info(f"Imported {coproductionprocess_id}: {self.counts}, {self.skipped} rows skipped")
+        return coproductionprocess_id
+
+
+async def import_lines(db: Session, chunks: AsyncIterator[bytes], user: models.User, token: str, keep_members: bool = False) -> uuid.UUID:
+    """
+    Imports an export read in chunks (the body of the request), in one transaction, for user.
+    """
+    importer = ProcessImporter(db, user, token, keep_members)
+    buffer = b""
+    try:
+        async for chunk in chunks:
+            *lines, buffer = (buffer + chunk).split(b"\n")
+            for line in lines:
+                await importer.feed(line)
+        await importer.feed(buffer)
+        coproductionprocess_id = await importer.finish()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return coproductionprocess_id
@@ -1,63 +1,104 @@
+import base64
+import json
+import logging
 import uuid
 import os.path
+from datetime import datetime
 
-import requests
+from app.assets.metadata import add_internal_data
 from typing import List, Optional
 
 from slugify import slugify
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, func, or_
+from sqlalchemy import and_, exists, func, or_, select, tuple_
 from app import crud, models
 from app.general.utils.CRUDBase import CRUDBase
+from app.general.search import document, full_text_search
 from app.models import CoproductionProcess, Permission, User, Permission, TreeItem, Asset
+from app.tables import coproductionprocess_administrators_association_table, user_team_association_table
 from app.schemas import CoproductionProcessCreate, CoproductionProcessPatch, PermissionCreate
 from fastapi.encoders import jsonable_encoder
 from app.messages import log
-from app.treeitems.crud import exportCrud as treeitemsCrud
+from app.treeitems.crud import date_range, exportCrud as treeitemsCrud
+from app.treeitems.graph import prerequisite_graph
 from app.sockets import socket_manager
-from app.utils import check_prerequistes
+from app.general.outbox import hold_outbox, tree_changed
 from app.config import settings
 from fastapi import HTTPException
 from fastapi_pagination.ext.sqlalchemy import paginate
-from sqlalchemy.orm import Query, subqueryload
+from sqlalchemy.orm import Query, selectinload, subqueryload
+from sqlalchemy.orm.attributes import set_committed_value
+from app.treeitems.models import prerequisites
 from sqlalchemy import func
 
+logger = logging.getLogger(__name__)
 
 
+def tree_nodes(phases: List[models.Phase]) -> dict:
+    # the phases, objectives and tasks of a loaded tree, by id
+    nodes = {}
+    for phase in phases:
+        nodes[phase.id] = phase
+        for objective in phase.children:
+            nodes[objective.id] = objective
+            for task in objective.children:
+                nodes[task.id] = task
+    return nodes
+
+
+def encode_cursor(coproductionprocess: CoproductionProcess) -> str:
+    value = json.dumps([coproductionprocess.created_at.isoformat(), str(coproductionprocess.id)])
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), uuid.UUID(id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 
 class CRUDCoproductionProcess(CRUDBase[CoproductionProcess, CoproductionProcessCreate, CoproductionProcessPatch]):
-    async def get_multi_by_user(self, db: Session, user: User, search: str = None) -> Optional[List[CoproductionProcess]]:
-        # await log({
-        #     "model": self.modelName,
-        #     "action": "LIST",
-        # })
-        admins = db.query(
-            CoproductionProcess
-        ).join(
-            CoproductionProcess.administrators
-        ).filter(
-            User.id.in_([user.id])
+    def query_by_user(self, db: Session, user: User, search: str = None) -> Query:
+        # processes administered by the user or where the user (or one of the user's teams) has a permission
+        administered = exists().where(
+            coproductionprocess_administrators_association_table.c.coproductionprocess_id == CoproductionProcess.id,
+            coproductionprocess_administrators_association_table.c.user_id == user.id,
         )
-
-        user_permissions = db.query(
-            CoproductionProcess
-        ).join(
-            CoproductionProcess.permissions
-        ).filter(
+        teams_ids = select(user_team_association_table.c.team_id).where(user_team_association_table.c.user_id == user.id)
+        permitted = exists().where(
+            Permission.coproductionprocess_id == CoproductionProcess.id,
             or_(
                 Permission.user_id == user.id,
-                Permission.team_id.in_(user.teams_ids)
+                Permission.team_id.in_(teams_ids)
             ),
         )
 
-        query = admins.union(user_permissions)
+        query = db.query(CoproductionProcess).filter(or_(administered, permitted))
         if search:
+            # uses the trigram index of the name
+            query = query.filter(CoproductionProcess.name.ilike(f"%{search}%"))
+        return query
+
+    async def get_multi_by_user(self, db: Session, user: User, search: str = None, cursor: str = None, limit: int = None) -> Optional[List[CoproductionProcess]]:
+        # await log({
+        #     "model": self.modelName,
+        #     "action": "LIST",
+        # })
+        query = self.query_by_user(db=db, user=user, search=search)
+        if cursor:
+            created_at, id = decode_cursor(cursor)
             query = query.filter(
-                CoproductionProcess.name.contains(search),
+                tuple_(CoproductionProcess.created_at, CoproductionProcess.id) > tuple_(created_at, id)
             )
+        query = query.order_by(CoproductionProcess.created_at.asc(), CoproductionProcess.id.asc())
+        if limit:
+            query = query.limit(limit)
+        return query.all()
 
-        return query.order_by(CoproductionProcess.created_at.asc()).all()
+    async def count_by_user(self, db: Session, user: User, search: str = None) -> int:
+        return self.query_by_user(db=db, user=user, search=search).count()
 
     async def get_multi_public(self, db: Session, exclude: list = [], search: str = "", rating: int = 0, language: str = "en", tag: list = []
                                ) -> Optional[List[CoproductionProcess]]:
@@ -69,18 +110,15 @@ class CRUDCoproductionProcess(CRUDBase[CoproductionProcess, CoproductionProcessC
         if rating:
                 queries.append(CoproductionProcess.rating >= rating)
 
-        if search!="":
-            if search:
-                search = search.lower()
-                queries.append(or_(
-                        # func.lower(Story.keywords_translations[language]).contains(
-                        #     search),
-                        func.lower(CoproductionProcess.name).contains(func.lower(
-                            search)),
-                        func.lower(
-                            CoproductionProcess.description).contains(func.lower(search))
-                    ))
-            
+        rank = None
+        if search:
+            # served by the full text search indexes of every language
+            condition, rank = full_text_search(
+                CoproductionProcess.language,
+                document(CoproductionProcess.name, CoproductionProcess.description),
+                search
+            )
+            queries.append(condition)
         
         if tag and any(tag):
             subq = (
@@ -102,6 +140,8 @@ class CRUDCoproductionProcess(CRUDBase[CoproductionProcess, CoproductionProcessC
         query = query.options(subqueryload(CoproductionProcess.tags))
 
         query = query.filter(*queries, CoproductionProcess.id.not_in(exclude))
+        if rank is not None:
+            query = query.order_by(rank.desc(), CoproductionProcess.created_at.desc())
 
         return paginate(query)
 
@@ -110,72 +150,6 @@ class CRUDCoproductionProcess(CRUDBase[CoproductionProcess, CoproductionProcessC
 
     async def get_assets(self, db: Session, coproductionprocess: CoproductionProcess, user: models.User,token:str):
 
-        # Query and add public info to the asset
-        def obtainpublicData(listOfAssets):
-
-            for asset in listOfAssets:
-                if asset.type == "internalasset":
-
-                    serverName=settings.SERVER_NAME
-                    #print("ServerName")
-                    #print(serverName)
-
-                    if('loomio' in asset.link):
-                        print("Es un loomio")
-                        asset_name="Loomio File"
-                        import traceback
-
-                        try:
-                            
-                            print('Asset id is:'+str(asset.external_asset_id))
-                            print('The request is:')
-
-                            cookies = {'auth_token': token}
-                            requestUrl=f"https://loomio/api/v1/assets/{str(asset.external_asset_id)}"
-                            print(requestUrl)
-                            
-                            response = requests.get(requestUrl, headers={
-                            "Authorization": "Bearer " + token
-                            }, cookies=cookies)
-
-                            responseDataJson=response.json()
-
-                            asset_name=responseDataJson.name
-                            print(asset_name)
-                        except  Exception:
-                            traceback.print_exc()
-                            pass
-
-
-
-                        asset.internalData={'icon':'https://'+serverName+'/catalogue/static/loomio/logotype.png','name':asset_name,'link':asset.link}
-                    else:
-
-                        if ('servicepedia' in asset.link):
-                            requestlink = f"http://augmenterservice/assets/{asset.external_asset_id}"
-                            response = requests.get(requestlink)
-                            datosAsset = response.json()
-                            asset_uri = asset.link+'/view'
-                            asset.internalData = {
-                                'icon': 'https://'+serverName+'/catalogue/static/augmenter/logotype.png', 'name': datosAsset['name'], 'link': asset_uri}
-
-                        else:
-                            serviceName = os.path.split(asset.link)[0].split('/')[3]
-                            requestlink = f"http://{serviceName}/assets/{asset.external_asset_id}"
-                            response = requests.get(requestlink)
-                            datosAsset = response.json()
-                            asset.internalData = datosAsset
-
-                if asset.type == "externalasset":
-                    queries = []
-                    queries.append(Asset.id == asset.id)
-                    datosAsset = db.query(Asset).filter(*queries).first()
-                    asset.internalData = {'icon': datosAsset.icon,
-                                          'name': datosAsset.name, 'link': datosAsset.uri}
-
-            return listOfAssets
-
-
         # or self.can_read(db, user, coproductionprocess):
         if user in coproductionprocess.administrators:
             listOfAssets = db.query(
@@ -185,7 +159,7 @@ class CRUDCoproductionProcess(CRUDBase[CoproductionProcess, CoproductionProcessC
             ).order_by(models.Asset.created_at.desc()).all()
 
             # Agrego informacion del asset interno
-            listOfAssets = obtainpublicData(listOfAssets)
+            listOfAssets = await add_internal_data(listOfAssets, token=token)
 
             return listOfAssets
 
@@ -203,7 +177,7 @@ class CRUDCoproductionProcess(CRUDBase[CoproductionProcess, CoproductionProcessC
             ).order_by(models.Asset.created_at.desc()).all()
 
             # Agrego informacion del asset interno
-            listOfAssets = obtainpublicData(listOfAssets)
+            listOfAssets = await add_internal_data(listOfAssets, token=token)
 
             return listOfAssets
 
@@ -222,18 +196,73 @@ class CRUDCoproductionProcess(CRUDBase[CoproductionProcess, CoproductionProcessC
         ).order_by(models.Asset.created_at.desc()).all()
 
         # Check if the user has the permissions to see the asset.
-        for asset in listOfAssets:
-            #print(asset)
-            tienePermisosListado = crud.asset.can_list(
-                db=db, user=user, task=asset.task)
-            if not tienePermisosListado:
-                listOfAssets.remove(asset)
+        permissions = crud.permission.get_matrix(db=db, user=user, coproductionprocess_id=coproductionprocess.id)
+
+        def can_list(asset):
+            if (asset_permissions := permissions.get(asset.task_id)) is not None:
+                return asset_permissions["access_assets_permission"]
+            return crud.asset.can_list(db=db, user=user, task=asset.task)
+
+        listOfAssets = [asset for asset in listOfAssets if can_list(asset)]
 
         # Agrego informacion del asset interno
-        listOfAssets = obtainpublicData(listOfAssets)
+        listOfAssets = await add_internal_data(listOfAssets, token=token)
 
         return listOfAssets
 
+    def load_tree(self, db: Session, coproductionprocess: models.CoproductionProcess) -> List[models.Phase]:
+        # Loads the phases, objectives, tasks and prerequisites of the process in a fixed number
+        # of queries, so the tree can be walked without lazy loading every node
+        phases = db.query(
+            models.Phase
+        ).filter(
+            models.Phase.coproductionprocess_id == coproductionprocess.id
+        ).options(
+            selectinload(models.Phase.children).selectinload(models.Objective.children)
+        ).all()
+
+        nodes = tree_nodes(phases)
+        if not nodes:
+            return phases
+
+        prerequisites_of = {id: [] for id in nodes}
+        outside = set()
+        for treeitem_id, prerequisite_id in db.query(prerequisites).filter(prerequisites.c.treeitem_a_id.in_(list(nodes))).all():
+            if prerequisite_id in nodes:
+                prerequisites_of[treeitem_id].append(nodes[prerequisite_id])
+            else:
+                outside.add(treeitem_id)
+        for id, node in nodes.items():
+            # prerequisites out of the tree (should not happen) are left to the lazy loader
+            if id not in outside:
+                set_committed_value(node, "prerequisites", prerequisites_of[id])
+        return phases
+
+    async def get_tree(self, db: Session, coproductionprocess: models.CoproductionProcess) -> List[models.Phase]:
+        # the tree with the permissions of every node
+        phases = self.load_tree(db=db, coproductionprocess=coproductionprocess)
+        nodes = tree_nodes(phases)
+        if not nodes:
+            return phases
+
+        team = selectinload(Permission.team)
+        permissions = db.query(
+            Permission
+        ).filter(
+            Permission.coproductionprocess_id == coproductionprocess.id
+        ).options(
+            team.selectinload(models.Team.users).selectinload(models.User.teams),
+            team.selectinload(models.Team.administrators),
+            team.selectinload(models.Team.applies),
+        ).all()
+        for node in nodes.values():
+            path = set(node.path_ids)
+            # same permissions as TreeItem.permissions, stored in its cache
+            node.__dict__["permissions"] = [permission for permission in permissions if permission.treeitem_id is None or permission.treeitem_id in path]
+
+        return phases
+
+    @hold_outbox
     async def clear_schema(self, db: Session, coproductionprocess: models.CoproductionProcess):
         schema = coproductionprocess.schema_used
         for phase in coproductionprocess.children:
@@ -245,7 +274,7 @@ class CRUDCoproductionProcess(CRUDBase[CoproductionProcess, CoproductionProcessC
         })
         await log(enriched)
         db.refresh(coproductionprocess)
-        await socket_manager.send_to_id(coproductionprocess.id, {"event": "schema_cleared"})
+        tree_changed(db, coproductionprocess.id, event="schema_cleared")
         return coproductionprocess
 
     async def set_logotype(self, db: Session, coproductionprocess: models.CoproductionProcess, logotype_path: str):
@@ -259,71 +288,16 @@ class CRUDCoproductionProcess(CRUDBase[CoproductionProcess, CoproductionProcessC
 
         return coproductionprocess
 
+    @hold_outbox
     async def set_schema(self, db: Session, coproductionprocess: models.CoproductionProcess, coproductionschema: dict):
-        total = {}
-        schema_id = coproductionschema.get("id")
-        for phasemetadata in coproductionschema.get("children", []):
-            phasemetadata: dict
-            db_phase = await crud.phase.create_from_metadata(
-                db=db,
-                phasemetadata=phasemetadata,
-                coproductionprocess=coproductionprocess,
-                schema_id=schema_id
-            )
-
-            #  Add new phase object and the prerequisites for later loop
-            total[phasemetadata["id"]] = {
-                "type": "phase",
-                "prerequisites_ids": phasemetadata["prerequisites_ids"] or [],
-                "newObj": db_phase,
-            }
-
-            for objectivemetadata in phasemetadata.get("children", []):
-                objectivemetadata: dict
-                db_obj = await crud.objective.create_from_metadata(
-                    db=db,
-                    objectivemetadata=objectivemetadata,
-                    phase=db_phase,
-                    schema_id=schema_id
-                )
-                #  Add new objective object and the prerequisites for later loop
-                total[objectivemetadata["id"]] = {
-                    "type": "objective",
-                    "prerequisites_ids": objectivemetadata["prerequisites_ids"] or [],
-                    "newObj": db_obj,
-                }
-                for taskmetadata in objectivemetadata.get("children", []):
-                    if 'management' not in taskmetadata:
-                        taskmetadata['management'] = 0
-                    if 'development' not in taskmetadata:
-                        taskmetadata['development'] = 0
-                    if 'exploitation' not in taskmetadata:
-                        taskmetadata['exploitation'] = 0
-
-                    db_task = await crud.task.create_from_metadata(
-                        db=db,
-                        taskmetadata=taskmetadata,
-                        objective=db_obj,
-                        schema_id=schema_id
-                    )
-                    total[taskmetadata["id"]] = {
-                        "type": "task",
-                        "prerequisites_ids": taskmetadata["prerequisites_ids"] or [],
-                        "newObj": db_task,
-                    }
-        db.commit()
-
-        for key, element in total.items():
-            for pre_id in element["prerequisites_ids"]:
-
-                if element["type"] == "phase":
-                    await crud.phase.add_prerequisite(db=db, phase=element["newObj"], prerequisite=total[pre_id]["newObj"], commit=False)
-                if element["type"] == "objective":
-                    await crud.objective.add_prerequisite(db=db, objective=element["newObj"], prerequisite=total[pre_id]["newObj"], commit=False)
-                if element["type"] == "task":
-                    await crud.task.add_prerequisite(db=db, task=element["newObj"], prerequisite=total[pre_id]["newObj"], commit=False)
-
         schema_id = coproductionschema.get("id")
+        phases = treeitemsCrud.insert_schema(db=db, coproductionprocess_id=coproductionprocess.id, coproductionschema=coproductionschema)
+        # what the aggregated start_date and end_date would be with the ORM, also with the
+        # phases the process already had
+        coproductionprocess.start_date, coproductionprocess.end_date = date_range(phases + [{
+            "start_date": coproductionprocess.start_date,
+            "end_date": coproductionprocess.end_date,
+        }])
         coproductionprocess.schema_used = schema_id
         db.commit()
         enriched: dict = self.enrich_log_data(coproductionprocess, {
@@ -333,11 +307,13 @@ class CRUDCoproductionProcess(CRUDBase[CoproductionProcess, CoproductionProcessC
         })
         await log(enriched)
         db.refresh(coproductionprocess)
-        await socket_manager.send_to_id(coproductionprocess.id, {"event": "schema_set"})
+        tree_changed(db, coproductionprocess.id, event="schema_set")
         return coproductionprocess
 
-    async def copy(self, db: Session, coproductionprocess: CoproductionProcessCreate, user: models.User, token, label_name, from_view):
-
+    async def copy(self, db: Session, coproductionprocess: CoproductionProcess, user: models.User, label_name, from_view) -> models.CloneJob:
+        """
+        Creates the copy (still empty) and the job that fills it, see run_clone_job.
+        """
         if (label_name == ""):
             label_name = "Copy of "
 
@@ -368,86 +344,104 @@ class CRUDCoproductionProcess(CRUDBase[CoproductionProcess, CoproductionProcessC
             for admin in administrators:
                 await self.add_administrator(db=db, db_obj=db_obj, user=admin, notifyAfterAdded=False)
 
-        #print("STARTING TREEITEMS")
-        phases_temp = coproductionprocess.children.copy()
-        phases = []
-        indexes = []
-
-        for id, phase in enumerate(phases_temp):
-            if not len(phase.prerequisites_ids):
-               # if not phase.is_disabled:
-                phases.append(phase)
-                indexes.append(str(phase.id))
-                phases_temp.pop(id)
-
-        while phases_temp:
-            for id, phase in enumerate(phases_temp):
-                if check_prerequistes(phase.prerequisites_ids, indexes):
-                    # if not phase.is_disabled:
-                    phases.append(phase)
-                    indexes.append(str(phase.id))
-                    phases_temp.pop(id)
-
-        #  Create a dict with the old ids and the new ids
-        ids_dict = {}
-        for phase in phases:
-            tmp_phase, phase_id_updates = await crud.phase.copy(db=db, obj_in=phase, coproductionprocess=db_obj, extra=ids_dict)
-            ids_dict['Phase_'+str(phase.id)] = tmp_phase.id
-            ids_dict.update(phase_id_updates)
-        #print("TREEITEMS COPIED")
-
-        #print("STARTING ASSET")
-        #print(from_view)
-        # Copy the assets of the project
-        assets = await self.get_assets(db, coproductionprocess, user,token=token)
-        contador_assets = 0
-        for asset in assets:
-            #print('El numero de assets es:')
-            contador_assets = contador_assets+1
-            #print(str(contador_assets)+'/'+str(len(assets)))
-
-            task = await crud.task.get(db, ids_dict['Task_' + str(asset.task_id)])
-
-            if (from_view == 'for_publication'):
-                # In the case of publcation in the catalogue copy of assets as readonly:
-                await crud.asset.copy(db, asset, user, task, token, True)
-            else:
-                await crud.asset.copy(db, asset, user, task, token)
-            #print('termino el copiado de '+str(asset.id))
-            #print('')
-
-        #print("ASSETS COPIED")
+        return await crud.clonejob.create(db=db, coproductionprocess=db_obj, cloned_from=coproductionprocess, creator=user, from_view=from_view)
+
+    @hold_outbox
+    async def run_clone_job(self, db: Session, job: models.CloneJob, token: str) -> models.CloneJob:
+        """
+        Copies the tree, the assets and the permissions of the process. Every step is saved in
+        the state of the job, so running it again (retry, or a worker that died) goes on from
+        the last step done: the tree is copied again from the start if it was left halfway, only
+        the assets that were not copied yet are cloned, and the permissions are committed all at
+        once with their step.
+        """
+        if not crud.clonejob.claim(db, job):
+            return job
+        coproductionprocess = job.cloned_from
+        db_obj = job.coproductionprocess
+        user = job.creator
+        from_view = job.from_view
+        try:
+            if coproductionprocess is None or db_obj is None:
+                raise Exception("The process or its copy has been removed")
+
+            if "ids" not in job.state:
+                await crud.clonejob.progress(db, job, step="treeitems")
+                for phase in list(db_obj.children):
+                    await crud.phase.remove(db=db, id=phase.id, remove_definitely=True, withNotifications=False)
+
+                #print("STARTING TREEITEMS")
+                # the prerequisites of a phase are copied before it
+                phases = prerequisite_graph(db, coproductionprocess.id).sort(coproductionprocess.children)
+
+                #  Create a dict with the old ids and the new ids
+                ids_dict = {}
+                for phase in phases:
+                    tmp_phase, phase_id_updates = await crud.phase.copy(db=db, obj_in=phase, coproductionprocess=db_obj, extra=ids_dict)
+                    ids_dict['Phase_'+str(phase.id)] = tmp_phase.id
+                    ids_dict.update(phase_id_updates)
+                crud.clonejob.save_state(db, job, ids={key: str(value) for key, value in ids_dict.items()})
+                #print("TREEITEMS COPIED")
+            ids_dict = {key: uuid.UUID(value) for key, value in job.state["ids"].items()}
+
+            # Copy the assets of the project
+            assets = await self.get_assets(db, coproductionprocess, user, token=token)
+            copied = dict(job.state.get("assets", {}))
+            failed = []
+            await crud.clonejob.progress(db, job, step="assets", done=len(copied), total=len(assets))
+            for asset in assets:
+                if str(asset.id) in copied:
+                    continue
+                task = await crud.task.get(db, ids_dict['Task_' + str(asset.task_id)])
+
+                # In the case of publcation in the catalogue copy of assets as readonly
+                new_asset = await crud.asset.copy(db, asset, user, task, token, from_view == 'for_publication', idempotency_key=f"{job.id}:{asset.id}")
+                if new_asset is None:
+                    failed.append(str(asset.id))
+                    continue
+                copied[str(asset.id)] = str(new_asset.id)
+                crud.clonejob.save_state(db, job, assets=copied)
+                await crud.clonejob.progress(db, job, done=len(copied))
+
+            # Copy the permissions of the project (THE NEW CREATOR IS THE CREATOR OF THE COPY)
+            if (from_view == 'story'):
+                # If the copy is made from the story then the dont need to create permissions
+                pass
+            elif not job.state.get("permissions"):
+                await crud.clonejob.progress(db, job, step="permissions")
+                for permission in coproductionprocess.permissions:
+                    treeitem = None
+                    if permission.treeitem:
+                        treeitem = await treeitemsCrud.get(db, ids_dict[permission.treeitem.__class__.__name__ + '_' + str(permission.treeitem.id)])
+                    #print("New permission")
+                    new_permission = PermissionCreate(
+                        creator_id=user.id,
+                        creator=user,
+                        team_id=permission.team_id,
+                        team=permission.team,
+                        coproductionprocess_id=db_obj.id if permission.coproductionprocess else None,
+                        coproductionprocess=db_obj if permission.coproductionprocess else None,
+                        treeitem_id=treeitem.id if treeitem else None,
+                        treeitem=treeitem,
+                        access_assets_permission=permission.access_assets_permission,
+                        create_assets_permission=permission.create_assets_permission,
+                        delete_assets_permission=permission.delete_assets_permission)
+
+                    await crud.permission.create(db=db, obj_in=new_permission, creator=user, notifyAfterAdded=False, commit=False)
+                # in the same transaction as the permissions
+                crud.clonejob.save_state(db, job, permissions=True)
+
+            if failed:
+                # retrying the job only clones these
+                return await crud.clonejob.progress(db, job, status=models.CloneJobStatus.failed, error=f"{len(failed)} assets could not be cloned: {', '.join(failed)}")
+
+            await log({"action": "CLONE","model":"COPRODUCTIONPROCESS","object_id":db_obj.id,"cloned_from_id":db_obj.cloned_from_id,"from_view":from_view})
+            return await crud.clonejob.progress(db, job, status=models.CloneJobStatus.finished, step=None)
+        except Exception as e:
+            logger.exception(f"Clone job {job.id} failed")
+            db.rollback()
+            return await crud.clonejob.progress(db, job, status=models.CloneJobStatus.failed, error=str(e))
 
-        #print("STARTING PERMISSIONS")
-        # Copy the permissions of the project (THE NEW CREATOR IS THE CREATOR OF THE COPY)
-        if (from_view == 'story'):
-            # If the copy is made from the story then the dont need to create permissions
-            pass
-        else:
-            for permission in coproductionprocess.permissions:
-                treeitem = None
-                if permission.treeitem:
-                    treeitem = await treeitemsCrud.get(db, ids_dict[permission.treeitem.__class__.__name__ + '_' + str(permission.treeitem.id)])
-                #print("New permission")
-                new_permission = PermissionCreate(
-                    creator_id=user.id,
-                    creator=user,
-                    team_id=permission.team_id,
-                    team=permission.team,
-                    coproductionprocess_id=db_obj.id if permission.coproductionprocess else None,
-                    coproductionprocess=db_obj if permission.coproductionprocess else None,
-                    treeitem_id=treeitem.id if treeitem else None,
-                    treeitem=treeitem,
-                    access_assets_permission=permission.access_assets_permission,
-                    create_assets_permission=permission.create_assets_permission,
-                    delete_assets_permission=permission.delete_assets_permission)
-
-                await crud.permission.create(db=db, obj_in=new_permission, creator=user, notifyAfterAdded=False)
-
-        await log({"action": "CLONE","model":"COPRODUCTIONPROCESS","object_id":db_obj.id,"cloned_from_id":db_obj.cloned_from_id,"from_view":from_view})
-
-        return db_obj
-    
     async def add_tag(self, db: Session, db_obj: CoproductionProcess, tag_id: uuid.UUID):
         if (tag := await crud.tag.get(db=db, id=tag_id)):
             if tag not in db_obj.tags:
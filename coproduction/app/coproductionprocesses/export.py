@@ -0,0 +1,188 @@
+import asyncio
+import json
+import logging
+import os.path
+import re
+import tempfile
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, List, Optional
+from urllib.parse import unquote
+
+from slugify import slugify
+from sqlalchemy.orm import Session, with_polymorphic
+from starlette.concurrency import run_in_threadpool
+
+from app import crud, models
+from app.assets.interlinkers import interlinker_cache
+from app.assets.metadata import add_internal_data
+from app.config import settings
+from app.general.httpclient import http_client
+from app.general.zipstream import ZipStream
+from app.treeitems.graph import PrerequisiteGraph, prerequisite_graph
+
+logger = logging.getLogger(__name__)
+
+# the zip is handed to the response (or the file) in chunks of this size. The compression and
+# the reads and writes of the temporary files are done in the threadpool, a chunk at a time,
+# so a large asset does not block the event loop
+CHUNK_SIZE = 64 * 1024
+
+
+def tree_to_dicts(phases: List[models.Phase], graph: PrerequisiteGraph) -> List[dict]:
+    # the treeitems in a cycle (made before they were checked) are kept, after the others
+    tree = []
+    for phase in graph.sort(phases, strict=False):
+        objectives = []
+        for objective in graph.sort(phase.children, strict=False):
+            tasks = [task.to_dict() for task in graph.sort(objective.children, strict=False)]
+            objectives.append({**objective.to_dict(), "tasks": tasks})
+        tree.append({**phase.to_dict(), "objectives": objectives})
+    return tree
+
+
+def asset_to_dict(asset: models.Asset) -> dict:
+    data = {**asset.to_dict(), "internalData": None, "download_url": None, "file": None, "error": None}
+    try:
+        if asset.type == "internalasset" and asset.capabilities.get("download"):
+            data["download_url"] = asset.internal_link + "/download"
+    except AttributeError:
+        # interlinker not in the catalogue
+        pass
+    return data
+
+
+class ProcessExport:
+    """
+    What goes in the zip of a process, read from the database before the zip is made (it is
+    streamed after the session is gone).
+    """
+
+    def __init__(self, coproductionprocess: models.CoproductionProcess, phases: List[models.Phase], graph: PrerequisiteGraph, assets: List[models.Asset]):
+        self.coproductionprocess = coproductionprocess.to_dict()
+        self.filename = (slugify(coproductionprocess.name or "") or "coproductionprocess") + ".zip"
+        self.tree = tree_to_dicts(phases, graph)
+        self._assets = assets
+        self.assets = [asset_to_dict(asset) for asset in assets]
+
+    @property
+    def downloads(self) -> int:
+        return len([asset for asset in self.assets if asset["download_url"]])
+
+    async def add_internal_data(self, token: str) -> None:
+        await add_internal_data(self._assets, token=token)
+        for data, asset in zip(self.assets, self._assets):
+            data["internalData"] = asset.internalData
+
+
+async def load_export(db: Session, coproductionprocess: models.CoproductionProcess) -> ProcessExport:
+    phases = crud.coproductionprocess.load_tree(db=db, coproductionprocess=coproductionprocess)
+    task_ids = [task.id for phase in phases for objective in phase.children for task in objective.children]
+    assets = []
+    if task_ids:
+        polymorphic = with_polymorphic(models.Asset, "*")
+        assets = db.query(polymorphic).filter(polymorphic.task_id.in_(task_ids)).order_by(polymorphic.created_at).all()
+        await interlinker_cache.prefetch_assets(assets)
+    return ProcessExport(coproductionprocess, phases, prerequisite_graph(db, coproductionprocess.id), assets)
+
+
+def attachment_name(content_disposition: str) -> Optional[str]:
+    if match := re.search(r"filename\*?=(?:UTF-8'')?\"?([^\";]+)\"?", content_disposition, re.IGNORECASE):
+        name = os.path.basename(unquote(match.group(1)).replace("\\", "/"))
+        if name not in ("", ".", ".."):
+            return name
+    return None
+
+
+async def fetch_asset(asset: dict, token: str):
+    # the content is kept in memory up to EXPORT_SPOOL_SIZE bytes, and in an (unlinked)
+    # temporary file past that
+    spool = tempfile.SpooledTemporaryFile(max_size=settings.EXPORT_SPOOL_SIZE)
+    try:
+        async with http_client.stream("GET", asset["download_url"], headers={"Authorization": "Bearer " + token}) as response:
+            response.raise_for_status()
+            name = attachment_name(response.headers.get("content-disposition", "")) or "content"
+            buffer = bytearray()
+            async for chunk in response.aiter_bytes():
+                buffer += chunk
+                if len(buffer) >= CHUNK_SIZE:
+                    await run_in_threadpool(spool.write, buffer)
+                    buffer = bytearray()
+            await run_in_threadpool(spool.write, buffer)
+    except BaseException:
+        spool.close()
+        raise
+    size = spool.tell()
+    await run_in_threadpool(spool.seek, 0)
+    return name, size, spool
+
+
+def copy_chunk(source, member) -> int:
+    # in the threadpool: a chunk of the temporary file to the (compressed) member of the zip
+    if data := source.read(CHUNK_SIZE):
+        member.write(data)
+    return len(data)
+
+
+async def export_zip(export: ProcessExport, token: str, on_asset: Optional[Callable[[int], Awaitable]] = None) -> AsyncIterator[bytes]:
+    """
+    The zip of a process: coproduction.json, schema.json (the tree), the content of the assets
+    whose interlinker can download it (assets/<id>/<name>, EXPORT_CONCURRENCY of them fetched at
+    a time while the previous ones are written) and assets.json with all the assets, and the
+    file or the error of each one.
+    """
+    archive = ZipStream()
+    encoder = json.JSONEncoder(indent=2, default=str)
+    for name, data in (("coproduction.json", export.coproductionprocess), ("schema.json", export.tree)):
+        with archive.open(name) as f:
+            buffer = []
+            size = 0
+            for chunk in encoder.iterencode(data):
+                buffer.append(chunk)
+                size += len(chunk)
+                if size >= CHUNK_SIZE:
+                    await run_in_threadpool(f.write, "".join(buffer).encode())
+                    buffer, size = [], 0
+                    if archive.pending >= CHUNK_SIZE:
+                        yield archive.read()
+            await run_in_threadpool(f.write, "".join(buffer).encode())
+
+    downloads = iter([asset for asset in export.assets if asset["download_url"]])
+    fetches = deque()
+
+    def start():
+        if (asset := next(downloads, None)) is not None:
+            fetches.append((asset, asyncio.ensure_future(fetch_asset(asset, token))))
+
+    try:
+        for _ in range(settings.EXPORT_CONCURRENCY):
+            start()
+        done = 0
+        while fetches:
+            asset, fetch = fetches.popleft()
+            try:
+                name, size, spool = await fetch
+            except Exception as e:
+                logger.warning(f"Could not download asset {asset['id']}: {e!r}")
+                asset["error"] = str(e) or repr(e)
+                spool = None
+            start()
+            if spool is not None:
+                with spool:
+                    asset["file"] = f"assets/{asset['id']}/{name}"
+                    with archive.open(asset["file"], size=size) as f:
+                        while await run_in_threadpool(copy_chunk, spool, f):
+                            if archive.pending >= CHUNK_SIZE:
+                                yield archive.read()
+            done += 1
+            if on_asset:
+                await on_asset(done)
+    finally:
+        # the client went away
+        for _, fetch in fetches:
+            if fetch.done() and not fetch.cancelled() and not fetch.exception():
+                fetch.result()[2].close()
+            else:
+                fetch.cancel()
+
+    await run_in_threadpool(archive.write, "assets.json", json.dumps(export.assets, indent=2, default=str).encode())
+    yield await run_in_threadpool(archive.close)
@@ -4,6 +4,7 @@ from sqlalchemy import (
     Column,
     Enum,
     ForeignKey,
+    Index,
     Integer,
     Numeric,
     String,
@@ -61,6 +62,9 @@ class CoproductionProcess(BaseModel):
     rating = Column(Numeric(2, 1), default=0)
     ratings_count = Column(Integer, default=0)
 
+    # incremented when treeitems or prerequisites of the process change (see app/treeitems/graph.py)
+    tree_version = Column(Integer, nullable=False, default=0, server_default="0")
+
     creator_id = Column(
         String, ForeignKey("user.id", use_alter=True, ondelete="SET NULL")
     )
@@ -216,3 +220,8 @@ class CoproductionProcess(BaseModel):
             "start_date": self.start_date.isoformat() if self.start_date else None,
             "logotype_link": self.logotype_link,
         }
+
+
+# keyset pagination of the workspace and search by name (pg_trgm)
+Index("ix_coproductionprocess_created_at_id", CoproductionProcess.created_at, CoproductionProcess.id)
+Index("ix_coproductionprocess_name_trgm", CoproductionProcess.name, postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"})
@@ -1,4 +1,3 @@
-from app.messages import log
 from typing import Any, Dict, Optional, List
 
 from sqlalchemy.orm import Session
@@ -13,12 +12,11 @@ from app.treeitems.crud import exportCrud as treeitems_crud
 
 from sqlalchemy import or_, and_
 from fastapi.encoders import jsonable_encoder
-from app.sockets import socket_manager
+from app.general.outbox import hold_outbox, log, send_to_id
 from uuid_by_string import generate_uuid
 from app import crud, models, schemas
 import json
 import html
-from app.messages import log
 
 
 class CRUDCoproductionProcessNotification(CRUDBase[CoproductionProcessNotification, CoproductionProcessNotificationCreate, CoproductionProcessNotificationPatch]):
@@ -80,19 +78,18 @@ class CRUDCoproductionProcessNotification(CRUDBase[CoproductionProcessNotificati
 
         selectTreeItemId = json.loads(db_obj.parameters)[
             'treeitem_id']
-        await socket_manager.broadcast({"event": "contribution_created", "extra": {"task_id": selectTreeItemId}})
-
-        # await socket_manager.send_to_id(db_obj.coproductionprocess_id, {"event": "contribution_created", "extra": {"task_id": jsonable_encoder(parametros['treeitem_id'])}})
+        send_to_id(db, db_obj.coproductionprocess_id, {"event": "contribution_created", "extra": {"task_id": selectTreeItemId}})
 
         if( db_obj.claim_type is None ):
-            await self.log_on_create(db_obj)
+            await self.log_on_create(db_obj, db=db)
         else:
             #When the notification is a claim, we need to create a log
-            await log({"action": "CREATE","model":"CLAIM","object_id":db_obj.id,"asset_id":db_obj.asset_id,"task_id":selectTreeItemId,"coproductionprocess_id":db_obj.coproductionprocess_id})
+            await log(db, {"action": "CREATE","model":"CLAIM","object_id":db_obj.id,"asset_id":db_obj.asset_id,"task_id":selectTreeItemId,"coproductionprocess_id":db_obj.coproductionprocess_id})
 
 
         return db_obj
 
+    @hold_outbox
     async def createList(self, db: Session, registros: List[CoproductionProcessNotificationCreate]) -> Any:
         try:
             # Iniciar una transacción
@@ -126,17 +123,16 @@ class CRUDCoproductionProcessNotification(CRUDBase[CoproductionProcessNotificati
                     db.refresh(notification_model)
 
                     if( notification_model.claim_type is None ):
-                        await self.log_on_create(notification_model)
+                        await self.log_on_create(notification_model, db=db)
                     else:
                         #When the notification is a claim, we need to create a log
-                        await log({"action": "CREATE","model":"CLAIM","object_id":notification_model.id,"asset_id":notification_model.asset_id,"task_id":selectTreeItemId,"coproductionprocess_id":notification_model.coproductionprocess_id})
+                        await log(db, {"action": "CREATE","model":"CLAIM","object_id":notification_model.id,"asset_id":notification_model.asset_id,"task_id":selectTreeItemId,"coproductionprocess_id":notification_model.coproductionprocess_id})
 
                 
 
                 # Envio la notificacion al socket
 
-                await socket_manager.broadcast({"event": "contribution_created", "extra": {"task_id": selectTreeItemId}})
-               # await socket_manager.send_to_id(coproductionProcessId, {"event": "contribution_created", "extra": {"task_id": selectTreeItemId}})
+                send_to_id(db, coproductionProcessId, {"event": "contribution_created", "extra": {"task_id": selectTreeItemId}})
 
             return True
         except Exception as e:
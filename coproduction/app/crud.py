@@ -17,4 +17,6 @@ from app.tags.crud import exportCrud as tag
 from app.ratings.crud import exportCrud as rating
 from app.keywords.crud import exportCrud as keyword
 from app.claims.crud import exportCrud as claim
-from app.assignments.crud import exportCrud as assignment
\ No newline at end of file
+from app.assignments.crud import exportCrud as assignment
+from app.clonejobs.crud import exportCrud as clonejob
+from app.exportjobs.crud import exportCrud as exportjob
\ No newline at end of file
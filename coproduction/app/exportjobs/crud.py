@@ -0,0 +1,118 @@
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Session
+
+from app import models
+from app.config import settings
+from app.coproductionprocesses.export import export_zip, load_export
+from app.exportjobs.models import ExportJob, ExportJobStatus
+from app.schemas import ExportJobOut
+from app.general.utils.CRUDBase import CRUDBase
+from app.sockets import socket_manager, user_topic
+
+logger = logging.getLogger(__name__)
+
+
+class CRUDExportJob(CRUDBase[ExportJob, ExportJobOut, ExportJobOut]):
+    async def create(self, db: Session, coproductionprocess: models.CoproductionProcess, creator: models.User, filename: str) -> ExportJob:
+        self.remove_expired(db)
+        db_obj = ExportJob(
+            coproductionprocess=coproductionprocess,
+            creator=creator,
+            filename=filename,
+            status=ExportJobStatus.pending,
+        )
+        db.add(db_obj)
+        db.commit()
+        db.refresh(db_obj)
+        return db_obj
+
+    def remove_expired(self, db: Session) -> None:
+        # the zips are removed when somebody asks for another one
+        expired = db.query(ExportJob).filter(
+            ExportJob.status == ExportJobStatus.finished,
+            ExportJob.expires_at < datetime.now(),
+        ).all()
+        for job in expired:
+            try:
+                os.remove(job.path)
+            except FileNotFoundError:
+                pass
+            job.status = ExportJobStatus.expired
+        if expired:
+            db.commit()
+
+    def claim(self, db: Session, job: ExportJob) -> bool:
+        # the pending ones, and the running ones whose worker died (celery delivers them again,
+        # the tasks are acked late) once their lease has expired
+        claimed = db.query(ExportJob).filter(
+            ExportJob.id == job.id,
+            or_(
+                ExportJob.status == ExportJobStatus.pending,
+                and_(
+                    ExportJob.status == ExportJobStatus.running,
+                    or_(ExportJob.lease_until == None, ExportJob.lease_until < func.now()),
+                ),
+            ),
+        ).update({
+            ExportJob.status: ExportJobStatus.running,
+            ExportJob.lease_until: func.now() + timedelta(seconds=settings.JOB_LEASE),
+        }, synchronize_session=False)
+        db.commit()
+        db.refresh(job)
+        return bool(claimed)
+
+    async def progress(self, db: Session, job: ExportJob, **values) -> ExportJob:
+        for field, value in values.items():
+            setattr(job, field, value)
+        db.add(job)
+        db.commit()
+        if job.creator_id:
+            await socket_manager.send_to_id(user_topic(job.creator_id), {"event": "export_progress", "extra": {
+                "job_id": str(job.id),
+                "coproductionprocess_id": str(job.coproductionprocess_id),
+                "status": job.status.value,
+                "done": job.done,
+                "total": job.total,
+            }})
+        return job
+
+    async def run(self, db: Session, job: ExportJob, token: str) -> ExportJob:
+        if not self.claim(db, job):
+            return job
+        partial = job.path + ".part"
+        try:
+            export = await load_export(db=db, coproductionprocess=job.coproductionprocess)
+            await export.add_internal_data(token)
+            await self.progress(db, job, done=0, total=export.downloads)
+
+            async def on_asset(done: int):
+                await self.progress(db, job, done=done)
+
+            os.makedirs(settings.EXPORTS_DIR, exist_ok=True)
+            with open(partial, "wb") as f:
+                async for chunk in export_zip(export, token, on_asset=on_asset):
+                    f.write(chunk)
+            # only complete zips are downloaded
+            os.replace(partial, job.path)
+        except Exception as e:
+            logger.exception(f"Export job {job.id} failed")
+            if os.path.exists(partial):
+                os.remove(partial)
+            return await self.progress(db, job, status=ExportJobStatus.failed, error=str(e) or repr(e))
+        return await self.progress(
+            db, job,
+            status=ExportJobStatus.finished,
+            size=os.path.getsize(job.path),
+            expires_at=datetime.now() + timedelta(seconds=settings.EXPORT_TTL),
+        )
+
+    # CRUD Permissions
+    def can_read(self, user: models.User, object: ExportJob) -> bool:
+        return user.id == object.creator_id
+
+
+exportCrud = CRUDExportJob(ExportJob)
@@ -0,0 +1,46 @@
+import enum
+import os.path
+import uuid
+
+from sqlalchemy import BigInteger, Column, DateTime, Enum, ForeignKey, Integer, String, Text
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import relationship
+
+from app.config import settings
+from app.general.db.base_class import Base as BaseModel
+
+
+class ExportJobStatus(str, enum.Enum):
+    pending = "pending"
+    running = "running"
+    finished = "finished"
+    failed = "failed"
+    expired = "expired"
+
+
+class ExportJob(BaseModel):
+    """
+    Zip of a coproduction process made in the background (app.worker.export_coproductionprocess),
+    for the ones too large to be streamed. The zip is kept in EXPORTS_DIR until expires_at.
+    """
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    coproductionprocess_id = Column(UUID(as_uuid=True), ForeignKey("coproductionprocess.id", ondelete="CASCADE"), index=True)
+    coproductionprocess = relationship("CoproductionProcess", foreign_keys=[coproductionprocess_id])
+    creator_id = Column(String, ForeignKey("user.id", ondelete="SET NULL"))
+    creator = relationship("User", foreign_keys=[creator_id])
+
+    status = Column(Enum(ExportJobStatus, create_constraint=False, native_enum=False), default=ExportJobStatus.pending)
+    # assets downloaded
+    done = Column(Integer, default=0)
+    total = Column(Integer, default=0)
+    # name of the download and bytes of the zip
+    filename = Column(String)
+    size = Column(BigInteger, nullable=True)
+    error = Column(Text, nullable=True)
+    expires_at = Column(DateTime, nullable=True)
+    # a running job belongs to its worker until then (renewed while the worker is alive)
+    lease_until = Column(DateTime, nullable=True)
+
+    @property
+    def path(self) -> str:
+        return os.path.join(settings.EXPORTS_DIR, f"{self.id}.zip")
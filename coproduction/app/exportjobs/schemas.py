@@ -0,0 +1,23 @@
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class ExportJobOut(BaseModel):
+    id: uuid.UUID
+    created_at: datetime
+    updated_at: Optional[datetime]
+    coproductionprocess_id: Optional[uuid.UUID]
+    creator_id: Optional[str]
+    status: str
+    done: int
+    total: int
+    filename: Optional[str]
+    size: Optional[int]
+    error: Optional[str]
+    expires_at: Optional[datetime]
+
+    class Config:
+        orm_mode = True
@@ -1,17 +1,232 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from base64 import b64decode
+from typing import Any, Dict, Optional
+
 import jwt
 import requests
-from base64 import b64decode
 from app.config import settings
 from cryptography.hazmat.primitives import serialization
+from jwt.algorithms import RSAAlgorithm
+from starlette_context import context
+
+logger = logging.getLogger(__name__)
 
 url = settings.KEYCLOAK_URL_REALM
+certs_url = f"{url}/protocol/openid-connect/certs"
+token_url = f"{url}/protocol/openid-connect/token"
+
+
+class RealmKeyCache:
+    """
+    Process wide cache of the Keycloak realm signing keys, indexed by "kid" (the realm
+    "public_key", which has no kid, is stored under None). Keys are refreshed in the
+    background before the ttl expires, and refetched when a token comes with an unknown
+    kid or an invalid signature (key rotation).
+    """
+
+    def __init__(self, url: str, certs_url: str, ttl: int, min_refetch_interval: int, refresh_ahead: float = 0.8, timeout: int = 5):
+        self.url = url
+        self.certs_url = certs_url
+        self.ttl = ttl
+        self.min_refetch_interval = min_refetch_interval
+        self.refresh_ahead = refresh_ahead
+        self.timeout = timeout
+
+        self._keys: Dict[Optional[str], Any] = {}
+        self._fetched_at: float = 0
+        self._retry_after: float = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _download(self) -> Dict[Optional[str], Any]:
+        keys = {}
+        keycloak_realm = requests.get(self.url, timeout=self.timeout)
+        keycloak_realm.raise_for_status()
+        key_der_base64 = keycloak_realm.json()["public_key"]
+        key_der = b64decode(key_der_base64.encode())
+        keys[None] = serialization.load_der_public_key(key_der)
+
+        # The certs endpoint gives us the kid of every active key of the realm
+        try:
+            certs = requests.get(self.certs_url, timeout=self.timeout)
+            certs.raise_for_status()
+            for jwk in certs.json().get("keys", []):
+                if jwk.get("kty") == "RSA" and jwk.get("use", "sig") == "sig" and jwk.get("kid"):
+                    keys[jwk["kid"]] = RSAAlgorithm.from_jwk(jwk)
+        except Exception as e:
+            logger.warning(f"Could not retrieve realm certs: {e}")
+        return keys
+
+    def _refresh(self) -> None:
+        try:
+            keys = self._download()
+        except Exception as e:
+            if not self._keys:
+                raise e
+            # Keep serving the cached keys and do not retry before min_refetch_interval
+            logger.error(f"Could not refresh the realm public key, using the cached one: {e}")
+            self._retry_after = time.monotonic() + self.min_refetch_interval
+            return
+        self._keys = keys
+        self._fetched_at = time.monotonic()
+
+    def _background_refresh(self) -> None:
+        try:
+            with self._lock:
+                self._refresh()
+        finally:
+            self._refreshing = False
+
+    def _needs_refresh(self, kid: Optional[str], force: bool) -> bool:
+        if not self._keys:
+            return True
+        if time.monotonic() < self._retry_after:
+            return False
+        age = time.monotonic() - self._fetched_at
+        if age > self.ttl:
+            return True
+        return (force or kid not in self._keys) and age > self.min_refetch_interval
+
+    def _refresh_in_background_if_stale(self) -> None:
+        if not self._refreshing and time.monotonic() >= self._retry_after \
+                and time.monotonic() - self._fetched_at > self.ttl * self.refresh_ahead:
+            self._refreshing = True
+            threading.Thread(target=self._background_refresh, daemon=True).start()
+
+    def get(self, kid: Optional[str] = None, force: bool = False):
+        if self._needs_refresh(kid, force):
+            with self._lock:
+                # another request may have refreshed the keys while we were waiting
+                if self._needs_refresh(kid, force):
+                    self._refresh()
+        else:
+            self._refresh_in_background_if_stale()
+
+        return self._keys.get(kid, self._keys.get(None))
+
+    def peek(self, kid: Optional[str] = None):
+        # Non blocking version of get: returns None when the keys have to be downloaded first
+        if self._needs_refresh(kid, False):
+            return None
+        self._refresh_in_background_if_stale()
+        return self._keys.get(kid, self._keys.get(None))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._keys = {}
+            self._fetched_at = 0
+            self._retry_after = 0
+
+
+key_cache = RealmKeyCache(
+    url=url,
+    certs_url=certs_url,
+    ttl=settings.KEYCLOAK_PUBLIC_KEY_TTL,
+    min_refetch_interval=settings.KEYCLOAK_PUBLIC_KEY_MIN_REFETCH_INTERVAL,
+)
+
+
+def _decode(jwtoken, public_key):
+    return jwt.decode(jwtoken, public_key, algorithms=["RS256"],
+                      audience=settings.KEYCLOAK_CLIENT_ID)
+
 
 def decode_token(jwtoken):
-    keycloak_realm = requests.get(url)
-    keycloak_realm.raise_for_status()
-    key_der_base64 = keycloak_realm.json()["public_key"]
-    key_der = b64decode(key_der_base64.encode())
-    public_key = serialization.load_der_public_key(key_der)
-    payload = jwt.decode(jwtoken, public_key, algorithms=["RS256"], 
-                         audience=settings.KEYCLOAK_CLIENT_ID)
-    return payload
\ No newline at end of file
+    kid = jwt.get_unverified_header(jwtoken).get("kid")
+    public_key = key_cache.get(kid)
+    try:
+        return _decode(jwtoken, public_key)
+    except jwt.InvalidSignatureError:
+        # The realm keys may have been rotated, retry once with fresh keys
+        refreshed_key = key_cache.get(kid, force=True)
+        if refreshed_key is public_key:
+            raise
+        return _decode(jwtoken, refreshed_key)
+
+
+# Keycloak is only reached from these threads, never from the event loop
+executor = ThreadPoolExecutor(max_workers=settings.KEYCLOAK_EXECUTOR_WORKERS, thread_name_prefix="keycloak")
+
+
+async def decode_token_async(jwtoken):
+    kid = jwt.get_unverified_header(jwtoken).get("kid")
+    if (public_key := key_cache.peek(kid)) is not None:
+        try:
+            return _decode(jwtoken, public_key)
+        except jwt.InvalidSignatureError:
+            pass
+    return await asyncio.get_running_loop().run_in_executor(executor, decode_token, jwtoken)
+
+
+class ServiceToken:
+    """
+    Token of the service account of this client (client credentials grant), for the work
+    done outside a request: the jobs of the workers, which can run (or run again) after the
+    token of the user who started them has expired. It is renewed when less than
+    min_validity seconds are left.
+    """
+
+    def __init__(self, token_url: str, client_id: str, client_secret: str, min_validity: int = 60, timeout: int = 5):
+        self.token_url = token_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.min_validity = min_validity
+        self.timeout = timeout
+
+        self._token: Optional[str] = None
+        self._expires_at: float = 0
+        self._lock = threading.Lock()
+
+    def get(self) -> str:
+        with self._lock:
+            if self._token is None or self._expires_at - time.monotonic() < self.min_validity:
+                response = requests.post(self.token_url, data={
+                    "grant_type": "client_credentials",
+                    "client_id": self.client_id,
+                    "client_secret": self.client_secret,
+                }, timeout=self.timeout)
+                response.raise_for_status()
+                data = response.json()
+                self._token = data["access_token"]
+                self._expires_at = time.monotonic() + data.get("expires_in", 0)
+            return self._token
+
+
+service_token = ServiceToken(token_url, settings.KEYCLOAK_CLIENT_ID, settings.KEYCLOAK_CLIENT_SECRET)
+
+
+async def get_service_token() -> str:
+    return await asyncio.get_running_loop().run_in_executor(executor, service_token.get)
+
+
+# The token of the request is stored in the context by the TokenPlugin, but it is only
+# decoded the first time the user is needed (see deps.get_current_user)
+
+def get_context_user() -> Optional[dict]:
+    if not context.exists():
+        return None
+    if "user" not in context.data:
+        token = context.data.get("token")
+        try:
+            context.data["user"] = decode_token(token) if token else None
+        except Exception as e:
+            logger.info(f"Could not decode the token of the request: {e}")
+            context.data["user"] = None
+    return context.data["user"]
+
+
+async def get_context_user_async() -> Optional[dict]:
+    if not context.exists():
+        return None
+    if "user" not in context.data:
+        token = context.data.get("token")
+        try:
+            context.data["user"] = await decode_token_async(token) if token else None
+        except Exception as e:
+            logger.info(f"Could not decode the token of the request: {e}")
+            context.data["user"] = None
+    return context.data["user"]
@@ -0,0 +1,111 @@
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+
+
+class PoolMetrics:
+    """
+    Counters of the connection pool of the engine: checkout wait times, saturation
+    and age of the open connections. Exposed by /api/v1/utils/metrics.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.checkout_timeouts = 0
+            self.checkout_wait_total = 0.0
+            self.checkout_wait_max = 0.0
+            self.connections_opened = 0
+            self.connections_closed = 0
+            self._connected_at = {}
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_wait_total += seconds
+            self.checkout_wait_max = max(self.checkout_wait_max, seconds)
+
+    def record_timeout(self):
+        with self._lock:
+            self.checkout_timeouts += 1
+
+    def on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connections_opened += 1
+            self._connected_at[id(dbapi_connection)] = time.monotonic()
+
+    def on_close(self, dbapi_connection, connection_record):
+        with self._lock:
+            if self._connected_at.pop(id(dbapi_connection), None) is not None:
+                self.connections_closed += 1
+
+    def listen(self, pool):
+        event.listen(pool, "connect", self.on_connect)
+        event.listen(pool, "close", self.on_close)
+        event.listen(pool, "close_detached", lambda dbapi_connection: self.on_close(dbapi_connection, None))
+
+    def snapshot(self, pool) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            ages = [now - connected_at for connected_at in self._connected_at.values()]
+            data = {
+                "pool_class": pool.__class__.__name__,
+                "checkouts": self.checkouts,
+                "checkout_timeouts": self.checkout_timeouts,
+                "checkout_wait_avg_ms": round(self.checkout_wait_total * 1000 / self.checkouts, 3) if self.checkouts else 0,
+                "checkout_wait_max_ms": round(self.checkout_wait_max * 1000, 3),
+                "connections_opened": self.connections_opened,
+                "connections_closed": self.connections_closed,
+                "connections_open": len(ages),
+                "connection_age_avg_s": round(sum(ages) / len(ages), 1) if ages else 0,
+                "connection_age_max_s": round(max(ages), 1) if ages else 0,
+            }
+        if isinstance(pool, QueuePool):
+            capacity = pool.size() + max(pool._max_overflow, 0)
+            data.update({
+                "size": pool.size(),
+                "max_overflow": pool._max_overflow,
+                "checked_in": pool.checkedin(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+                "saturation": round(pool.checkedout() / capacity, 3) if capacity else 0,
+            })
+        return data
+
+
+pool_metrics = PoolMetrics()
+async_pool_metrics = PoolMetrics()
+
+
+class InstrumentedPoolMixin:
+    metrics = pool_metrics
+
+    # _do_get is where the pool waits for a free connection (or opens a new one)
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.record_timeout()
+            raise
+        finally:
+            self.metrics.record_wait(time.perf_counter() - start)
+
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedNullPool(InstrumentedPoolMixin, NullPool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    metrics = async_pool_metrics
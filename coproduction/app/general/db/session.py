@@ -1,7 +1,48 @@
+import os
+
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import NullPool
 from app.config import settings
+from app.general.db.pool import (
+    InstrumentedAsyncQueuePool,
+    InstrumentedNullPool,
+    InstrumentedQueuePool,
+    async_pool_metrics,
+    pool_metrics,
+)
+
+pool_options = dict(
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+)
+
+if settings.DB_POOL_CLASS == "null":
+    engine = create_engine(settings.SQLALCHEMY_DATABASE_URI, poolclass=InstrumentedNullPool)
+    async_engine = create_async_engine(settings.SQLALCHEMY_ASYNC_DATABASE_URI, poolclass=NullPool)
+else:
+    engine = create_engine(settings.SQLALCHEMY_DATABASE_URI, poolclass=InstrumentedQueuePool, **pool_options)
+    async_engine = create_async_engine(settings.SQLALCHEMY_ASYNC_DATABASE_URI, poolclass=InstrumentedAsyncQueuePool, **pool_options)
+pool_metrics.listen(engine)
+async_pool_metrics.listen(async_engine.sync_engine)
 
-engine = create_engine(settings.SQLALCHEMY_DATABASE_URI, poolclass=NullPool )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# objects are used after the commit (responses, socket messages), so they are not expired:
+# with an AsyncSession an expired attribute can not be lazy loaded
+AsyncSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=async_engine, class_=AsyncSession)
+
+
+def dispose_engine_after_fork():
+    # gunicorn workers and celery prefork children must not share the sockets opened by
+    # the parent: drop the inherited pools without closing the parent connections
+    engine.dispose(close=False)
+    async_engine.sync_engine.dispose(close=False)
+    pool_metrics.reset()
+    async_pool_metrics.reset()
+
+
+os.register_at_fork(after_in_child=dispose_engine_after_fork)
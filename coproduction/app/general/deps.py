@@ -1,11 +1,11 @@
-from typing import Generator, Optional
+from typing import AsyncGenerator, Generator, Optional
 
 from fastapi import Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 
-from app.general.db.session import SessionLocal
+from app.general.db.session import AsyncSessionLocal, SessionLocal
+from app.general.authentication import get_context_user, get_context_user_async
 from app import crud, models
-from starlette_context import context
 
 
 def get_token_in_cookie(request):
@@ -30,6 +30,13 @@ def get_db() -> Generator:
         db.close()
 
 
+async def get_async_db() -> AsyncGenerator:
+    # Non blocking alternative to get_db, for the endpoints that only use the methods of
+    # CRUDBase that accept an AsyncSession (get, get_multi, create, update and remove)
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 def get_current_token(
     request: Request
 ) -> dict:
@@ -50,7 +57,7 @@ async def get_current_user(
     # current_token: str = Depends(get_current_token)
 ) -> Optional[models.User]:
     try:
-        if user := context.data.get("user", None):
+        if user := await get_context_user_async():
             return await crud.user.get(db=db, id=user["sub"])
         return None
     except Exception as e:
@@ -79,12 +86,11 @@ def get_current_user_from_context(
     db: Session
 ):
     try:
-        if user := context.data.get("user", None):
+        if user := get_context_user():
+            # get() looks in the identity map first: the user is usually already loaded
             return db.query(
                 models.User
-            ).filter(
-                models.User.id == user["sub"]
-            ).first()
+            ).get(user["sub"])
         return
 
     except Exception as e:
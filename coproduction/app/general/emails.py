@@ -1,38 +1,193 @@
+import atexit
 import json
 import os
 import logging
+import queue
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 import threading
+import time
 import emails
 from emails import Message
 import uuid
+from emails.backend import SMTPBackend
 from emails.template import JinjaTemplate
 
 from app.models import Team
 from app.config import settings
 
-semaphore = threading.Semaphore(4)
+logger = logging.getLogger(__name__)
 
 
-def thread_send_email(message, email_to, environment, smtp_options):
-    with semaphore:
+class TemplateCache:
+    """
+    Compiled templates of EMAIL_TEMPLATES_DIR, by type. load() compiles all of them at startup,
+    the ones added later are compiled the first time they are used.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._templates: Dict[str, JinjaTemplate] = {}
+        self._lock = threading.Lock()
+
+    def _compile(self, path: Path) -> JinjaTemplate:
+        with open(path) as f:
+            template = JinjaTemplate(f.read())
+        # compiled now, not by the first email
+        template.template
+        return template
+
+    def load(self) -> None:
+        try:
+            templates = {path.stem: self._compile(path) for path in Path(self.directory).glob("*.html")}
+        except Exception as e:
+            logger.warning(f"Could not load the email templates: {e}")
+            return
+        with self._lock:
+            self._templates.update(templates)
+
+    def get(self, type: str) -> JinjaTemplate:
+        if (template := self._templates.get(type)) is None:
+            template = self._compile(Path(self.directory) / "{type}.html".format(type=type))
+            with self._lock:
+                self._templates[type] = template
+        return template
+
+
+class EmailDispatcher:
+    """
+    Sends the emails from a few long lived threads, each one with its own SMTP connection,
+    which is reused for all the messages it sends and closed after idle_timeout seconds
+    without any. A job is a message and its recipients (all the members of a team go in one
+    job, over the same connection). At most queue_size jobs wait: the rest are dropped.
+    """
+
+    def __init__(self, workers: int, queue_size: int, idle_timeout: float):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.idle_timeout = idle_timeout
+
+        self._pid = None
+        self._lock = threading.Lock()
+        self._counters_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._counters_lock:
+            self.enqueued = 0
+            self.sent = 0
+            self.failed = 0
+            self.dropped = 0
+            self.connections = 0
+
+    def _count(self, **increments):
+        with self._counters_lock:
+            for name, value in increments.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def smtp_options(self) -> dict:
+        smtp_options = {"host": settings.SMTP_HOST, "port": settings.SMTP_PORT}
+        if settings.SMTP_TLS:
+            smtp_options["tls"] = True
+        if settings.SMTP_USER:
+            smtp_options["user"] = settings.SMTP_USER
+        if settings.SMTP_PASSWORD:
+            smtp_options["password"] = settings.SMTP_PASSWORD
+        return smtp_options
+
+    # the threads are started by the first email of every process (uvicorn and celery workers fork)
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._stop = threading.Event()
+            self._threads = [
+                threading.Thread(target=self._run, name=f"email-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            self._pid = os.getpid()
+            for thread in self._threads:
+                thread.start()
+            atexit.register(self.close)
+
+    def send(self, message: Message, recipients: List[str], environment: Dict[str, Any]) -> None:
+        recipients = [recipient for recipient in recipients if recipient]
+        if not recipients:
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((message, recipients, environment))
+            self._count(enqueued=len(recipients))
+        except queue.Full:
+            logger.error(f"Email queue full, dropping {message.subject!r} to {len(recipients)} recipients")
+            self._count(dropped=len(recipients))
+
+    def close(self, timeout: float = 10) -> None:
+        if self._pid != os.getpid() or self._stop.is_set():
+            return
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout / len(self._threads))
+
+    def _run(self):
+        smtp = None
+        last_used = time.monotonic()
+        while True:
+            try:
+                message, recipients, environment = self._queue.get(timeout=1)
+            except queue.Empty:
+                if smtp is not None and (self._stop.is_set() or time.monotonic() - last_used > self.idle_timeout):
+                    smtp.close()
+                    smtp = None
+                if self._stop.is_set():
+                    return
+                continue
+            if smtp is None:
+                smtp = SMTPBackend(**self.smtp_options())
+                self._count(connections=1)
+            for recipient in recipients:
+                self._send(smtp, message, recipient, environment)
+            last_used = time.monotonic()
+
+    def _send(self, smtp: SMTPBackend, message: Message, email_to: str, environment: Dict[str, Any]) -> None:
         try:
-            logging.info(f"--------------------------------------")
-            logging.info(smtp_options)
-            response = message.send(
-                to=email_to, render=environment, smtp=smtp_options)
+            response = message.send(to=email_to, render=environment, smtp=smtp)
             if response.status_code not in [250, '250']:
-                logging.error(
+                logger.error(
                     f"Failed to send email: {response.status_code} {response.status_text}")
+                self._count(failed=1)
             else:
-                logging.info(
+                logger.info(
                     f"Email successfully sent: {response.status_code} {response.status_text}")
-        except Exception as e:
-            logging.exception("An error occurred while sending email.")
-        finally:
-            logging.info(f"send email result: {response}")
+                self._count(sent=1)
+        except Exception:
+            logger.exception("An error occurred while sending email.")
+            self._count(failed=1)
+
+    def snapshot(self) -> dict:
+        with self._counters_lock:
+            return {
+                "queued": self._queue.qsize() if self._pid == os.getpid() else 0,
+                "enqueued": self.enqueued,
+                "sent": self.sent,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "connections": self.connections,
+            }
+
+
+email_templates = TemplateCache(settings.EMAIL_TEMPLATES_DIR)
+email_dispatcher = EmailDispatcher(
+    workers=settings.EMAIL_WORKERS,
+    queue_size=settings.EMAIL_QUEUE_SIZE,
+    idle_timeout=settings.EMAIL_SMTP_IDLE_TIMEOUT,
+)
+
+
 # Create a new class that inherits from the emails.Message class
 
 
@@ -89,11 +244,7 @@ def send_email(
             processId=environment['processId'],
             asset_id=environment['asset_id'])
 
-    # Load HTML template
-    with open(Path(settings.EMAIL_TEMPLATES_DIR) / "{type}.html".format(type=type)) as f:
-        template_str = f.read()
-
-    template = JinjaTemplate(template_str)
+    template = email_templates.get(type)
 
     # Create EmailMessage instance
     message = CustomMessage(
@@ -102,24 +253,21 @@ def send_email(
         mail_from=(settings.EMAILS_FROM_NAME, settings.EMAILS_FROM_EMAIL),
     )
 
-    # SMTP settings
-    smtp_options = {"host": settings.SMTP_HOST, "port": settings.SMTP_PORT}
-    if settings.SMTP_TLS:
-        smtp_options["tls"] = True
-    if settings.SMTP_USER:
-        smtp_options["user"] = settings.SMTP_USER
-    if settings.SMTP_PASSWORD:
-        smtp_options["password"] = settings.SMTP_PASSWORD
-
-    t = threading.Thread(target=thread_send_email, args=(
-        message, email_to, environment, smtp_options))
-    t.start()
+    email_dispatcher.send(message, [email_to], environment)
 
 
 def send_team_email(
     team: Team,
     type: str = "",
     environment: Optional[Dict[str, Any]] = None,
+) -> None:
+    send_emails([user.email for user in team.users], type, environment)
+
+
+def send_emails(
+    emails_to: List[str],
+    type: str = "",
+    environment: Optional[Dict[str, Any]] = None,
 ) -> None:
     environment = environment or {}
     assert settings.EMAILS_ENABLED, "no provided configuration for email variables"
@@ -167,9 +315,7 @@ def send_team_email(
             processId=environment['processId'],
             asset_id=environment['asset_id'])
         
-    with open(Path(settings.EMAIL_TEMPLATES_DIR) / "{type}.html".format(type=type)) as f:
-        template_str = f.read()
-    template = JinjaTemplate(template_str)
+    template = email_templates.get(type)
 
     message = emails.Message(
         subject=subject,
@@ -177,19 +323,8 @@ def send_team_email(
         mail_from=(settings.EMAILS_FROM_NAME, settings.EMAILS_FROM_EMAIL),
     )
 
-    # SMTP settings
-    smtp_options = {"host": settings.SMTP_HOST, "port": settings.SMTP_PORT}
-    if settings.SMTP_TLS:
-        smtp_options["tls"] = True
-    if settings.SMTP_USER:
-        smtp_options["user"] = settings.SMTP_USER
-    if settings.SMTP_PASSWORD:
-        smtp_options["password"] = settings.SMTP_PASSWORD
-
-    for user in team.users:
-        t = threading.Thread(target=thread_send_email, args=(
-            message, user.email, environment, smtp_options))
-        t.start()
+    # one job for the whole team, sent over the same connection
+    email_dispatcher.send(message, list(emails_to), environment)
 
 
 def send_test_email(email_to: str) -> None:
@@ -0,0 +1,336 @@
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from app.config import settings
+
+# only these are sent again after a connection error or a 502/503/504 (some PUTs of the
+# gamification engine add points, so they are not retried unless the caller says so)
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+RETRY_STATUS_CODES = {502, 503, 504}
+
+
+class CircuitOpenError(httpx.TransportError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Opens after threshold consecutive failures (connection errors or 5xx): the calls fail
+    right away for reset_timeout seconds, then a single call is let through, which closes
+    the circuit again if it succeeds.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+    def release(self) -> None:
+        # the trial call was cancelled, without an answer of the upstream
+        with self._lock:
+            self._trial = False
+
+
+class UpstreamMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.errors = 0
+            self.retries = 0
+            self.short_circuited = 0
+            self.statuses: Dict[str, int] = {}
+            self.latencies = deque(maxlen=1000)
+
+    def record(self, seconds: float, response: Optional[httpx.Response]):
+        with self._lock:
+            self.requests += 1
+            self.latencies.append(seconds)
+            if response is None:
+                self.errors += 1
+                return
+            status = f"{response.status_code // 100}xx"
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if response.status_code >= 500:
+                self.errors += 1
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def record_short_circuit(self):
+        with self._lock:
+            self.short_circuited += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latencies = sorted(self.latencies)
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "retries": self.retries,
+                "short_circuited": self.short_circuited,
+                "statuses": dict(self.statuses),
+                "latency_avg_ms": round(sum(latencies) * 1000 / len(latencies), 3) if latencies else 0,
+                "latency_p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 3) if latencies else 0,
+                "latency_max_ms": round(latencies[-1] * 1000, 3) if latencies else 0,
+            }
+
+
+class Upstream:
+    """
+    Connection pools (one per event loop and a sync one for the code that can not await),
+    circuit breaker and metrics of one service, identified by the host of its urls.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.breaker = CircuitBreaker(settings.HTTP_BREAKER_THRESHOLD, settings.HTTP_BREAKER_RESET_TIMEOUT)
+        self.metrics = UpstreamMetrics()
+        self._pid = None
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._sync_client: Optional[httpx.Client] = None
+        self._lock = threading.Lock()
+
+    def _options(self) -> dict:
+        return dict(
+            timeout=httpx.Timeout(settings.HTTP_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=settings.HTTP_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.HTTP_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=settings.HTTP_POOL_KEEPALIVE_EXPIRY,
+            ),
+            # same as requests
+            follow_redirects=True,
+        )
+
+    def _check_pid(self):
+        # the connections of the parent process are not shared with forked workers
+        if self._pid != os.getpid():
+            self._async_clients = weakref.WeakKeyDictionary()
+            self._sync_client = None
+            self._pid = os.getpid()
+
+    def async_client(self) -> httpx.AsyncClient:
+        self._check_pid()
+        loop = asyncio.get_running_loop()
+        if (client := self._async_clients.get(loop)) is None:
+            client = self._async_clients[loop] = httpx.AsyncClient(**self._options())
+        return client
+
+    def sync_client(self) -> httpx.Client:
+        with self._lock:
+            self._check_pid()
+            if self._sync_client is None:
+                self._sync_client = httpx.Client(**self._options())
+            return self._sync_client
+
+    def record(self, start: float, response: Optional[httpx.Response]):
+        self.metrics.record(time.perf_counter() - start, response)
+        if response is None or response.status_code >= 500:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+
+    def check_breaker(self):
+        if not self.breaker.allow():
+            self.metrics.record_short_circuit()
+            raise CircuitOpenError(f"Circuit open for {self.name}")
+
+    async def aclose(self):
+        self._check_pid()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None and (client := self._async_clients.pop(loop, None)) is not None:
+            await client.aclose()
+        with self._lock:
+            if self._sync_client is not None:
+                self._sync_client.close()
+                self._sync_client = None
+
+    def snapshot(self) -> dict:
+        return {"circuit": self.breaker.state, **self.metrics.snapshot()}
+
+
+def backoff(attempt: int) -> float:
+    # exponential backoff with full jitter
+    return random.uniform(0, settings.HTTP_RETRY_BACKOFF * 2 ** (attempt - 1))
+
+
+class HTTPClient:
+    """
+    Entry point of every call to the other services of the platform: the requests are sent
+    through the pool of their upstream, with the default timeouts, retried (idempotent methods
+    only, unless retries is given) and rejected while the circuit of the upstream is open.
+    The keyword arguments are the ones of httpx.
+    """
+
+    def __init__(self):
+        self._upstreams: Dict[str, Upstream] = {}
+        self._lock = threading.Lock()
+
+    def upstream(self, url: str) -> Upstream:
+        name = urlsplit(url).netloc
+        if (upstream := self._upstreams.get(name)) is None:
+            with self._lock:
+                upstream = self._upstreams.setdefault(name, Upstream(name))
+        return upstream
+
+    def _retries(self, method: str, retries: Optional[int]) -> int:
+        if retries is not None:
+            return retries
+        return settings.HTTP_RETRIES if method in IDEMPOTENT_METHODS else 0
+
+    async def request(self, method: str, url: str, *, retries: Optional[int] = None, **kwargs) -> httpx.Response:
+        method = method.upper()
+        upstream = self.upstream(url)
+        client = upstream.async_client()
+        retries = self._retries(method, retries)
+        attempt = 0
+        while True:
+            upstream.check_breaker()
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+            except httpx.TransportError:
+                upstream.record(start, None)
+                if attempt >= retries:
+                    raise
+            except BaseException:
+                upstream.breaker.release()
+                raise
+            else:
+                upstream.record(start, response)
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= retries:
+                    return response
+                await response.aclose()
+            attempt += 1
+            upstream.metrics.record_retry()
+            await asyncio.sleep(backoff(attempt))
+
+    def request_sync(self, method: str, url: str, *, retries: Optional[int] = None, **kwargs) -> httpx.Response:
+        method = method.upper()
+        upstream = self.upstream(url)
+        client = upstream.sync_client()
+        retries = self._retries(method, retries)
+        attempt = 0
+        while True:
+            upstream.check_breaker()
+            start = time.perf_counter()
+            try:
+                response = client.request(method, url, **kwargs)
+            except httpx.TransportError:
+                upstream.record(start, None)
+                if attempt >= retries:
+                    raise
+            except BaseException:
+                upstream.breaker.release()
+                raise
+            else:
+                upstream.record(start, response)
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= retries:
+                    return response
+                response.close()
+            attempt += 1
+            upstream.metrics.record_retry()
+            time.sleep(backoff(attempt))
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        """
+        Response whose body is read by the caller (aiter_bytes). It is not retried.
+        """
+        upstream = self.upstream(url)
+        client = upstream.async_client()
+        upstream.check_breaker()
+        start = time.perf_counter()
+        recorded = False
+        try:
+            async with client.stream(method.upper(), url, **kwargs) as response:
+                upstream.record(start, response)
+                recorded = True
+                yield response
+        except httpx.TransportError:
+            if not recorded:
+                upstream.record(start, None)
+            raise
+        except BaseException:
+            if not recorded:
+                upstream.breaker.release()
+            raise
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def put(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("PUT", url, **kwargs)
+
+    async def delete(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("DELETE", url, **kwargs)
+
+    def get_sync(self, url: str, **kwargs) -> httpx.Response:
+        return self.request_sync("GET", url, **kwargs)
+
+    def delete_sync(self, url: str, **kwargs) -> httpx.Response:
+        return self.request_sync("DELETE", url, **kwargs)
+
+    async def aclose(self):
+        for upstream in list(self._upstreams.values()):
+            await upstream.aclose()
+
+    def snapshot(self) -> dict:
+        return {name: upstream.snapshot() for name, upstream in list(self._upstreams.items())}
+
+
+http_client = HTTPClient()
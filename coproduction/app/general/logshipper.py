@@ -0,0 +1,250 @@
+import atexit
+import glob
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import List, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class LogShipper:
+    """
+    Sends the messages of app.messages.log to the logging service from a background thread,
+    in batches of batch_size messages or every flush_interval seconds. At most queue_size
+    messages wait to be sent: the ones that do not fit (handed to the thread, the request
+    never touches the disk), and the batches that can not be delivered, are appended to a
+    spool file and sent again once the service is back.
+    """
+
+    def __init__(self, url: str, batch_url: Optional[str], batch_size: int, flush_interval: float,
+                 queue_size: int, spool_dir: str, spool_max_bytes: int, timeout: int, max_backoff: int = 60):
+        self.url = url
+        self.batch_url = batch_url
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.spool_dir = spool_dir
+        self.spool_max_bytes = spool_max_bytes
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+
+        self._pid = None
+        self._lock = threading.Lock()
+        self._spool_lock = threading.Lock()
+        self._counters_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._counters_lock:
+            self.enqueued = 0
+            self.sent = 0
+            self.rejected = 0
+            self.failed_batches = 0
+            self.spooled = 0
+            self.replayed = 0
+            self.dropped = 0
+            self.flush_lag_last = 0.0
+            self.flush_lag_max = 0.0
+            self.last_flush_at = None
+
+    def _count(self, **increments):
+        with self._counters_lock:
+            for name, value in increments.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    # the thread is started by the first message of every process (uvicorn and celery workers fork)
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            # the messages that did not fit in the queue, spooled by the thread (as many as the
+            # queue: while the thread is stuck, the ones after them are dropped)
+            self._overflow = deque(maxlen=self.queue_size)
+            self._stop = threading.Event()
+            self._session = requests.Session()
+            self._retry_after = 0.0
+            self._backoff = 0
+            self._thread = threading.Thread(target=self._run, name="log-shipper", daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+            atexit.register(self.close)
+
+    def ship(self, payload: str) -> None:
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((time.monotonic(), payload))
+            self._count(enqueued=1)
+        except queue.Full:
+            # backpressure: the request does not wait for the logging service, the message goes to disk
+            if len(self._overflow) >= self._overflow.maxlen:
+                self._count(dropped=1)
+                return
+            self._overflow.append(payload)
+
+    def close(self, timeout: float = 5) -> None:
+        if self._pid != os.getpid() or self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            stopping = self._stop.is_set()
+            self._spool_overflow()
+            batch = self._collect(wait=not stopping)
+            if batch:
+                self._flush(batch)
+            elif stopping:
+                return
+            else:
+                self._replay()
+
+    def _collect(self, wait: bool) -> list:
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if wait and remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _available(self) -> bool:
+        return time.monotonic() >= self._retry_after
+
+    def _post(self, url: str, data: str) -> None:
+        response = self._session.post(url, data=data, headers={"Content-Type": "application/json"}, timeout=self.timeout)
+        if response.status_code >= 500:
+            response.raise_for_status()
+        if response.status_code >= 400:
+            # sending it again would not help
+            logger.error(f"Log message rejected by the logging service ({response.status_code}): {response.text[:200]}")
+            self._count(rejected=1)
+
+    def _deliver(self, payloads: List[str]) -> int:
+        """
+        Returns how many payloads were delivered before the logging service failed.
+        """
+        if not self._available():
+            return 0
+        delivered = 0
+        try:
+            if self.batch_url:
+                self._post(self.batch_url, "[" + ",".join(payloads) + "]")
+                delivered = len(payloads)
+            else:
+                for payload in payloads:
+                    self._post(self.url, payload)
+                    delivered += 1
+            self._backoff = 0
+        except Exception as e:
+            self._backoff = min(max(self._backoff * 2, 1), self.max_backoff)
+            self._retry_after = time.monotonic() + self._backoff
+            self._count(failed_batches=1)
+            logger.warning(f"Logging service unavailable, retrying in {self._backoff}s: {e}")
+        return delivered
+
+    def _flush(self, batch: list) -> None:
+        payloads = [payload for _, payload in batch]
+        delivered = self._deliver(payloads)
+        if delivered < len(payloads):
+            self._spool(payloads[delivered:])
+        if delivered:
+            lag = time.monotonic() - batch[0][0]
+            with self._counters_lock:
+                self.sent += delivered
+                self.flush_lag_last = lag
+                self.flush_lag_max = max(self.flush_lag_max, lag)
+                self.last_flush_at = time.time()
+
+    def _spool_overflow(self) -> None:
+        payloads = []
+        while self._overflow:
+            payloads.append(self._overflow.popleft())
+        if payloads:
+            self._spool(payloads)
+
+    def _spool_path(self) -> str:
+        return os.path.join(self.spool_dir, f"{os.getpid()}.jsonl")
+
+    def _spool(self, payloads: List[str], replayed: bool = False) -> None:
+        data = "".join(payload + "\n" for payload in payloads)
+        with self._spool_lock:
+            try:
+                os.makedirs(self.spool_dir, exist_ok=True)
+                if self.spool_size() + len(data) > self.spool_max_bytes:
+                    raise OSError("spool is full")
+                with open(self._spool_path(), "a") as spool:
+                    spool.write(data)
+                if not replayed:
+                    self._count(spooled=len(payloads))
+            except OSError as e:
+                logger.error(f"Dropping {len(payloads)} log messages: {e}")
+                self._count(dropped=len(payloads))
+
+    def spool_size(self) -> int:
+        size = 0
+        for path in glob.glob(os.path.join(self.spool_dir, "*.jsonl")):
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return size
+
+    def _replay(self) -> None:
+        # also sends the spool files left by processes that are gone
+        if not self._available():
+            return
+        for path in glob.glob(os.path.join(self.spool_dir, "*.jsonl")):
+            claimed = f"{path}.{os.getpid()}.sending"
+            with self._spool_lock:
+                try:
+                    os.rename(path, claimed)
+                except OSError:
+                    # claimed by another process
+                    continue
+            with open(claimed) as spool:
+                payloads = [line.rstrip("\n") for line in spool if line.strip()]
+            os.remove(claimed)
+            for start in range(0, len(payloads), self.batch_size):
+                batch = payloads[start:start + self.batch_size]
+                delivered = self._deliver(batch)
+                self._count(sent=delivered, replayed=delivered)
+                if delivered < len(batch):
+                    self._spool(payloads[start + delivered:], replayed=True)
+                    return
+                if not self._queue.empty():
+                    # new messages go first, the rest of the spool waits for the next idle moment
+                    self._spool(payloads[start + len(batch):], replayed=True)
+                    return
+
+    def snapshot(self) -> dict:
+        spool_bytes = self.spool_size()
+        with self._counters_lock:
+            return {
+                "enqueued": self.enqueued,
+                "sent": self.sent,
+                "rejected": self.rejected,
+                "failed_batches": self.failed_batches,
+                "spooled": self.spooled,
+                "replayed": self.replayed,
+                "dropped": self.dropped,
+                "queue_size": self._queue.qsize() if self._pid == os.getpid() else 0,
+                "spool_bytes": spool_bytes,
+                "flush_lag_last_ms": round(self.flush_lag_last * 1000, 3),
+                "flush_lag_max_ms": round(self.flush_lag_max * 1000, 3),
+                "last_flush_age_s": round(time.time() - self.last_flush_at, 1) if self.last_flush_at else None,
+            }
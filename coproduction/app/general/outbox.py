@@ -0,0 +1,212 @@
+import asyncio
+import functools
+import itertools
+import json
+import logging
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.messages import log_message, log_shipper
+from app.sockets import socket_manager, tree_events
+
+logger = logging.getLogger(__name__)
+
+
+class Outbox:
+    """
+    Side effects (socket messages, celery tasks, calls to the interlinkers...) recorded while
+    the session is writing, and dispatched once the transaction is committed. They are dropped
+    if it is rolled back. Effects of the same kind are coalesced: the handler of the kind is
+    called once with the distinct payloads of all of them. Inside hold(), the effects of all
+    the transactions committed meanwhile are dispatched together at the end.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, Callable] = {}
+        self._tasks = set()
+        # loop of the application, for the sessions used from the threadpool
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def handler(self, kind: str):
+        def decorator(function):
+            self._handlers[kind] = function
+            return function
+        return decorator
+
+    def add(self, session: Optional[Session], kind: str, payload: Hashable) -> None:
+        if session is None:
+            self._dispatch({kind: {payload: None}})
+            return
+        if session.new or session.dirty or session.deleted or session.info.get("outbox_writing"):
+            effects = session.info.setdefault("outbox_pending", {})
+        else:
+            # nothing to commit, it happens right away (or when the hold ends)
+            effects = session.info.setdefault("outbox_committed", {})
+        effects.setdefault(kind, {})[payload] = None
+        if effects is session.info.get("outbox_committed"):
+            self.dispatch(session)
+
+    @contextmanager
+    def hold(self, session: Session):
+        session.info["outbox_holds"] = session.info.get("outbox_holds", 0) + 1
+        try:
+            yield
+        finally:
+            session.info["outbox_holds"] -= 1
+            self.dispatch(session)
+
+    def dispatch(self, session: Session) -> None:
+        if session.info.get("outbox_holds"):
+            return
+        if effects := session.info.pop("outbox_committed", None):
+            self._dispatch(effects)
+
+    def _dispatch(self, effects: Dict[str, Dict[Hashable, Any]]) -> None:
+        for kind, payloads in effects.items():
+            try:
+                result = self._handlers[kind](list(payloads))
+                if asyncio.iscoroutine(result):
+                    self._schedule(result)
+            except Exception:
+                logger.exception(f"Could not dispatch {len(payloads)} {kind} effects")
+
+    def _schedule(self, coroutine) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop:
+            task = loop.create_task(coroutine)
+            self._tasks.add(task)
+            task.add_done_callback(self._done)
+        elif self.loop and self.loop.is_running():
+            asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        else:
+            # celery workers and scripts
+            asyncio.run(coroutine)
+
+    async def drain(self) -> None:
+        # before a loop ends (asyncio.run of the celery tasks), the effects still being sent
+        loop = asyncio.get_running_loop()
+        while tasks := [task for task in list(self._tasks) if task.get_loop() is loop and not task.done()]:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and (exception := task.exception()):
+            logger.error(f"Could not dispatch effects: {exception}")
+
+
+outbox = Outbox()
+
+
+@event.listens_for(Session, "before_flush")
+def outbox_before_flush(session, flush_context, instances):
+    session.info["outbox_writing"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def outbox_after_commit(session):
+    session.info.pop("outbox_writing", None)
+    committed = session.info.setdefault("outbox_committed", {})
+    for kind, payloads in session.info.pop("outbox_pending", {}).items():
+        committed.setdefault(kind, {}).update(payloads)
+    outbox.dispatch(session)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def outbox_after_rollback(session, previous_transaction):
+    session.info.pop("outbox_writing", None)
+    session.info.pop("outbox_pending", None)
+
+
+def hold_outbox(function):
+    # for the crud methods that commit many times: their side effects are dispatched at the end
+    @functools.wraps(function)
+    async def wrapper(self, db: Session, *args, **kwargs):
+        with outbox.hold(db):
+            return await function(self, db, *args, **kwargs)
+    return wrapper
+
+
+# the logs and the emails are never coalesced: each one gets its own number
+sequence = itertools.count()
+
+
+def send_to_id(session: Optional[Session], id, data: dict) -> None:
+    outbox.add(session, "socket", ("send_to_id", id, json.dumps(data, sort_keys=True, default=str)))
+
+
+def broadcast(session: Optional[Session], data: dict) -> None:
+    outbox.add(session, "socket", ("broadcast", None, json.dumps(data, sort_keys=True, default=str)))
+
+
+def subscribe(session: Optional[Session], id, topics: Iterable[str]) -> None:
+    # in the same kind as the messages, so the ones sent after it reach the new topics
+    outbox.add(session, "socket", ("subscribe", id, json.dumps(list(topics))))
+
+
+def unsubscribe(session: Optional[Session], id, topics: Iterable[str]) -> None:
+    outbox.add(session, "socket", ("unsubscribe", id, json.dumps(list(topics))))
+
+
+async def log(session: Optional[Session], data: dict) -> None:
+    # the user of the request is read now, the message is shipped after the commit
+    if (message := await log_message(data)) is not None:
+        outbox.add(session, "log", (next(sequence), message))
+
+
+def send_email(session: Optional[Session], email_to: str, type: str, environment: dict) -> None:
+    outbox.add(session, "email", (next(sequence), "send_email", email_to, type, json.dumps(environment, default=str)))
+
+
+def send_team_email(session: Optional[Session], team, type: str, environment: dict) -> None:
+    # the members of the team when it is sent
+    emails_to = tuple(user.email for user in team.users)
+    outbox.add(session, "email", (next(sequence), "send_emails", emails_to, type, json.dumps(environment, default=str)))
+
+
+def tree_changed(session: Optional[Session], coproductionprocess_id, treeitem_id=None, event: str = "tree_changed") -> None:
+    outbox.add(session, "tree", (str(coproductionprocess_id), str(treeitem_id) if treeitem_id else None, event))
+
+
+@outbox.handler("socket")
+async def send_socket_messages(payloads):
+    for method, id, data in payloads:
+        if method == "broadcast":
+            await socket_manager.broadcast(json.loads(data))
+        else:
+            await getattr(socket_manager, method)(id, json.loads(data))
+
+
+@outbox.handler("log")
+def ship_logs(payloads):
+    for _, message in payloads:
+        log_shipper.ship(message)
+
+
+@outbox.handler("email")
+def send_emails(payloads):
+    from app.general import emails
+
+    for _, function, email_to, type, environment in payloads:
+        try:
+            getattr(emails, function)(email_to, type, json.loads(environment))
+        except Exception:
+            logger.exception(f"Could not send the {type} email")
+
+
+@outbox.handler("tree")
+async def send_tree_changes(payloads):
+    changes = {}
+    for coproductionprocess_id, treeitem_id, event in payloads:
+        treeitem_ids, events = changes.setdefault(coproductionprocess_id, ([], []))
+        treeitem_ids.append(treeitem_id)
+        events.append(event)
+    await asyncio.gather(*[
+        tree_events.add(coproductionprocess_id, treeitem_ids, events)
+        for coproductionprocess_id, (treeitem_ids, events) in changes.items()
+    ])
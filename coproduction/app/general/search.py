@@ -0,0 +1,48 @@
+from typing import List, Tuple
+
+from sqlalchemy import and_, case, func, literal_column, not_, or_
+
+# text search configuration of postgres for every language of the platform, the
+# others use "simple". The indexes created in the migrations use the same list.
+TEXT_SEARCH_CONFIGURATIONS = {
+    "en": "english",
+    "es": "spanish",
+    "it": "italian",
+    "nl": "dutch",
+    "dk": "danish",
+    "lv": "simple",
+}
+
+
+def document(*columns):
+    # coalesce(a, '') || ' ' || coalesce(b, '') ... with literals, so it is the same
+    # expression as the one of the indexes whatever the driver does with parameters
+    expression = func.coalesce(columns[0], literal_column("''"))
+    for column in columns[1:]:
+        expression = expression.op("||")(literal_column("' '")).op("||")(func.coalesce(column, literal_column("''")))
+    return expression
+
+
+def jsonb_text(column, key: str):
+    return column.op("->>")(literal_column(f"'{key}'"))
+
+
+def full_text_search(language_column, doc, search: str) -> Tuple:
+    """
+    Returns the condition and the rank to search the document of every row with the
+    configuration of its own language. Every branch is served by the partial index of
+    its language.
+    """
+    conditions: List = []
+    ranks: List = []
+    for language, configuration in list(TEXT_SEARCH_CONFIGURATIONS.items()) + [(None, "simple")]:
+        regconfig = literal_column(f"'{configuration}'::regconfig")
+        vector = func.to_tsvector(regconfig, doc)
+        query = func.websearch_to_tsquery(regconfig, search)
+        if language:
+            in_language = language_column == literal_column(f"'{language}'")
+        else:
+            in_language = or_(language_column == None, not_(language_column.in_([literal_column(f"'{language}'") for language in TEXT_SEARCH_CONFIGURATIONS])))
+        conditions.append(and_(in_language, vector.op("@@")(query)))
+        ranks.append((in_language, func.ts_rank(vector, query)))
+    return or_(*conditions), case(*ranks, else_=0)
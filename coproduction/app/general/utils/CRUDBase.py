@@ -6,17 +6,18 @@ from uuid_by_string import generate_uuid
 
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session, make_transient
-from sqlalchemy import or_, and_
+from sqlalchemy import or_, and_, select
 from fastapi import HTTPException
 
 from app.general.db.base_class import Base
-from app.messages import log
+from app.general.outbox import log, send_email, send_to_id, subscribe
 from app.users.models import User
 from app.config import settings
-from app.sockets import socket_manager
+from app.sockets import organization_topic, team_topic, user_topic
 
-from app.general.emails import send_email
+from app.permissions.cache import permission_cache
 
 ModelType = TypeVar("ModelType", bound=Base)
 CreateSchemaType = TypeVar("CreateSchemaType", bound=BaseModel)
@@ -25,6 +26,24 @@ PatchSchemaType = TypeVar("PatchSchemaType", bound=BaseModel)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+AnySession = Union[Session, AsyncSession]
+
+
+async def load(db: AnySession, getter):
+    # lazy loads can not be emitted from the event loop with an AsyncSession
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(lambda _: getter())
+    return getter()
+
+
+async def commit_and_refresh(db: AnySession, db_obj) -> None:
+    if isinstance(db, AsyncSession):
+        await db.commit()
+        await db.refresh(db_obj)
+    else:
+        db.commit()
+        db.refresh(db_obj)
+
 
 class CRUDBase(Generic[ModelType, CreateSchemaType, PatchSchemaType]):
     def __init__(self, model: Type[ModelType], logByDefault=False):
@@ -40,8 +59,12 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, PatchSchemaType]):
         self.modelName = model.__name__.upper()
         self.model = model
 
-    async def get(self, db: Session, id: uuid.UUID) -> Optional[ModelType]:
-        if obj := db.query(self.model).filter(self.model.id == id).first():
+    async def get(self, db: AnySession, id: uuid.UUID) -> Optional[ModelType]:
+        if isinstance(db, AsyncSession):
+            obj = (await db.execute(select(self.model).filter(self.model.id == id))).scalars().first()
+        else:
+            obj = db.query(self.model).filter(self.model.id == id).first()
+        if obj:
             await self.log_on_get(obj)
             return obj
         return
@@ -93,38 +116,43 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, PatchSchemaType]):
         ).first()
 
     async def get_multi(
-        self, db: Session, *, skip: int = 0, limit: int = 100
+        self, db: AnySession, *, skip: int = 0, limit: int = 100
     ) -> List[ModelType]:
+        if isinstance(db, AsyncSession):
+            return (await db.execute(
+                select(self.model).order_by(self.model.created_at.asc()).offset(skip).limit(limit)
+            )).scalars().all()
         return db.query(self.model).order_by(self.model.created_at.asc()).offset(skip).limit(limit).all()
 
-    async def create(self, db: Session, *, obj_in: CreateSchemaType, creator: User = None, set_creator_admin: bool = False, extra: dict = {}, commit: bool = True) -> ModelType:
+    async def create(self, db: AnySession, *, obj_in: CreateSchemaType, creator: User = None, set_creator_admin: bool = False, extra: dict = {}, commit: bool = True) -> ModelType:
         obj_in_data = jsonable_encoder(obj_in)
         db_obj = self.model(**obj_in_data, **extra)  # type: ignore
 
         if creator:
             db_obj.creator_id = creator.id
             if set_creator_admin:
-                db_obj.administrators.append(creator)
+                await load(db, lambda: db_obj.administrators.append(creator))
 
         db.add(db_obj)
+        # without commit, the messages wait for the commit of the caller (and are dropped on rollback)
         if commit:
-            db.commit()
-            db.refresh(db_obj)
-            await self.log_on_create(db_obj)
+            await commit_and_refresh(db, db_obj)
+            await self.log_on_create(db_obj, db=db)
 
         if self.modelName == "COPRODUCTIONPROCESS":
-            await socket_manager.send_to_id(db_obj.id, {"event": self.modelName.lower() + "_created"})
+            send_to_id(db, db_obj.id, {"event": self.modelName.lower() + "_created"})
         elif hasattr(db_obj, "coproductionprocess_id"):
 
-            await socket_manager.send_to_id(db_obj.coproductionprocess_id, {"event": self.modelName.lower() + "_created"})
+            send_to_id(db, db_obj.coproductionprocess_id, {"event": self.modelName.lower() + "_created"})
 
         # Send info to private socket to update workspace page
         if hasattr(db_obj, "team") and self.modelName == "PERMISSION":
-            for user in db_obj.team.users:
-                await socket_manager.send_to_id(generate_uuid(user.id), {"event": self.modelName.lower() + "_created"})
+            for user in await load(db, lambda: db_obj.team.users):
+                send_to_id(db, generate_uuid(user.id), {"event": self.modelName.lower() + "_created"})
         # Send info when you create an organization
-        if self.modelName == "ORGANIZATION":
-            await socket_manager.broadcast({"event": self.modelName.lower() + "_created"})
+        if self.modelName == "ORGANIZATION" and creator:
+            subscribe(db, user_topic(creator.id), [organization_topic(db_obj.id)])
+            send_to_id(db, user_topic(creator.id), {"event": self.modelName.lower() + "_created"})
 
         return db_obj
 
@@ -134,6 +162,8 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, PatchSchemaType]):
         db.add(db_obj)
         db.commit()
         db.refresh(db_obj)
+        if self.modelName == "COPRODUCTIONPROCESS":
+            permission_cache.invalidate_coproductionprocess(db_obj.id)
 
         # Sincroniza los usuarios administradores con cada uno de los assets:
         if notifyAfterAdded:
@@ -142,21 +172,25 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, PatchSchemaType]):
                 "action": "ADD_ADMINISTRATOR",
                 "added_user_id": user.id
             })
-            await log(enriched)
+            await log(db, enriched)
 
             if self.modelName == "COPRODUCTIONPROCESS":
-                await socket_manager.send_to_id(db_obj.id, {"event": self.modelName.lower() + "_administrator_added"})
+                send_to_id(db, db_obj.id, {"event": self.modelName.lower() + "_administrator_added"})
             if hasattr(db_obj, "coproductionprocess_id"):
-                await socket_manager.send_to_id(db_obj.coproductionprocess_id, {"event": self.modelName.lower() + "_administrator_added"})
+                send_to_id(db, db_obj.coproductionprocess_id, {"event": self.modelName.lower() + "_administrator_added"})
 
             # Send info to private socket to update workspace page
-            await socket_manager.send_to_id(generate_uuid(user.id), {"event": self.modelName.lower() + "_administrator_added"})
+            if self.modelName == "TEAM":
+                subscribe(db, user_topic(user.id), [team_topic(db_obj.id), organization_topic(db_obj.organization_id)])
+            if self.modelName == "ORGANIZATION":
+                subscribe(db, user_topic(user.id), [organization_topic(db_obj.id)])
+            send_to_id(db, generate_uuid(user.id), {"event": self.modelName.lower() + "_administrator_added"})
 
             # Send mail to user to know is added to a team
-            _ = send_email(user.email,
-                           'add_admin_coprod',
-                           {"coprod_id": db_obj.id,
-                            "coprod_name": db_obj.name, })
+            send_email(db, user.email,
+                       'add_admin_coprod',
+                       {"coprod_id": db_obj.id,
+                        "coprod_name": db_obj.name, })
 
         return db_obj
 
@@ -170,26 +204,28 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, PatchSchemaType]):
         db.add(db_obj)
         db.commit()
         db.refresh(db_obj)
+        if self.modelName == "COPRODUCTIONPROCESS":
+            permission_cache.invalidate_coproductionprocess(db_obj.id)
         sync_asset_users([user.id])
         enriched: dict = self.enrich_log_data(db_obj, {
             "action": "REMOVE_ADMINISTRATOR",
             "removed_user_id": user.id
         })
-        await log(enriched)
+        await log(db, enriched)
 
         if self.modelName == "COPRODUCTIONPROCESS":
-            await socket_manager.send_to_id(db_obj.id, {"event": self.modelName.lower() + "_administrator_removed"})
+            send_to_id(db, db_obj.id, {"event": self.modelName.lower() + "_administrator_removed"})
         elif hasattr(db_obj, "coproductionprocess_id"):
-            await socket_manager.send_to_id(db_obj.coproductionprocess_id, {"event": self.modelName.lower() + "_administrator_removed"})
+            send_to_id(db, db_obj.coproductionprocess_id, {"event": self.modelName.lower() + "_administrator_removed"})
 
         # Send info to private socket to update workspace page
-        await socket_manager.send_to_id(generate_uuid(user.id), {"event": self.modelName.lower() + "_administrator_removed"})
+        send_to_id(db, generate_uuid(user.id), {"event": self.modelName.lower() + "_administrator_removed"})
 
         return db_obj
 
     async def update(
         self,
-        db: Session,
+        db: AnySession,
         *,
         db_obj: ModelType,
         obj_in: Union[PatchSchemaType, Dict[str, Any]]
@@ -205,57 +241,69 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, PatchSchemaType]):
                 #print("Updating", field)
                 setattr(db_obj, field, value)
         db.add(db_obj)
-        db.commit()
-        db.refresh(db_obj)
-        await self.log_on_update(db_obj)
+        await commit_and_refresh(db, db_obj)
+        await self.log_on_update(db_obj, db=db)
 
         if self.modelName == "COPRODUCTIONPROCESS":
-            await socket_manager.send_to_id(db_obj.id, {"event": self.modelName.lower() + "_updated"})
+            send_to_id(db, db_obj.id, {"event": self.modelName.lower() + "_updated"})
         elif hasattr(db_obj, "coproductionprocess_id"):
-            await socket_manager.send_to_id(db_obj.coproductionprocess_id, {"event": self.modelName.lower() + "_updated"})
+            send_to_id(db, db_obj.coproductionprocess_id, {"event": self.modelName.lower() + "_updated"})
 
-        # Send info when you create an team
+        # Send info to the members of the team and of its organization
         if self.modelName == "TEAM":
-            await socket_manager.broadcast({"event": self.modelName.lower() + "_updated"})
+            send_to_id(db, team_topic(db_obj.id), {"event": self.modelName.lower() + "_updated"})
+            send_to_id(db, organization_topic(db_obj.organization_id), {"event": self.modelName.lower() + "_updated"})
 
-        # Send info when you create an team
+        # Send info to the members of the organization
         if self.modelName == "ORGANIZATION":
-            await socket_manager.broadcast({"event": self.modelName.lower() + "_updated"})
+            send_to_id(db, organization_topic(db_obj.id), {"event": self.modelName.lower() + "_updated"})
 
         return db_obj
 
-    async def remove(self, db: Session, *, id: uuid.UUID) -> ModelType:
-        db_obj = db.query(self.model).get(id)
-        await self.log_on_remove(db_obj)
-
-        db.delete(db_obj)
-        db.commit()
+    async def remove(self, db: AnySession, *, id: uuid.UUID) -> ModelType:
+        if isinstance(db, AsyncSession):
+            db_obj = await db.get(self.model, id)
+        else:
+            db_obj = db.query(self.model).get(id)
+
+        if isinstance(db, AsyncSession):
+            # the users have to be loaded before the permission is deleted
+            users = await load(db, lambda: db_obj.team.users) if hasattr(db_obj, "team") and self.modelName == "PERMISSION" else []
+            await db.delete(db_obj)
+            # shipped with the commit of the deletion
+            await self.log_on_remove(db_obj, db=db)
+            await db.commit()
+        else:
+            db.delete(db_obj)
+            await self.log_on_remove(db_obj, db=db)
+            db.commit()
+            users = db_obj.team.users if hasattr(db_obj, "team") and self.modelName == "PERMISSION" else []
 
         # General case where a (coproductionprocess_removed)
         if self.modelName == "COPRODUCTIONPROCESS":
-            await socket_manager.send_to_id(db_obj.id, {"event": self.modelName.lower() + "_removed"})
+            send_to_id(db, db_obj.id, {"event": self.modelName.lower() + "_removed"})
 
         elif hasattr(db_obj, "coproductionprocess_id"):
 
             # The case of the asset is (asset_removed)
             if self.modelName == "ASSET":
-                await socket_manager.send_to_id(db_obj.coproductionprocess_id, {"event": self.modelName.lower() + "_removed", "extra": {"task_id": jsonable_encoder(db_obj.task_id)}})
+                send_to_id(db, db_obj.coproductionprocess_id, {"event": self.modelName.lower() + "_removed", "extra": {"task_id": jsonable_encoder(db_obj.task_id)}})
             else:
                 # Any other case:
-                await socket_manager.send_to_id(db_obj.coproductionprocess_id, {"event": self.modelName.lower() + "_removed"})
+                send_to_id(db, db_obj.coproductionprocess_id, {"event": self.modelName.lower() + "_removed"})
 
         # # Send info to private socket to update workspace page
-        if hasattr(db_obj, "team") and self.modelName == "PERMISSION":
-            for user in db_obj.team.users:
-                await socket_manager.send_to_id(generate_uuid(user.id), {"event": self.modelName.lower() + "_removed"})
+        for user in users:
+            send_to_id(db, generate_uuid(user.id), {"event": self.modelName.lower() + "_removed"})
 
-        # Send info when you create an organization
+        # Send info to the members of the organization
         if self.modelName == "ORGANIZATION":
-            await socket_manager.broadcast({"event": self.modelName.lower() + "_removed"})
+            send_to_id(db, organization_topic(db_obj.id), {"event": self.modelName.lower() + "_removed"})
 
-        # Send info when you create an team
+        # Send info to the members of the team and of its organization
         if self.modelName == "TEAM":
-            await socket_manager.broadcast({"event": self.modelName.lower() + "_removed"})
+            send_to_id(db, team_topic(db_obj.id), {"event": self.modelName.lower() + "_removed"})
+            send_to_id(db, organization_topic(db_obj.organization_id), {"event": self.modelName.lower() + "_removed"})
 
         return None
 
@@ -268,23 +316,25 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, PatchSchemaType]):
         # await log(enriched)
         pass
 
-    async def log_on_create(self, obj):
+    # with the session, shipped once its transaction is committed
+
+    async def log_on_create(self, obj, db: Optional[AnySession] = None):
         enriched: dict = self.enrich_log_data(obj, {
             "action": "CREATE"
         })
-        await log(enriched)
+        await log(db, enriched)
 
-    async def log_on_update(self, obj):
+    async def log_on_update(self, obj, db: Optional[AnySession] = None):
         enriched: dict = self.enrich_log_data(obj, {
             "action": "UPDATE"
         })
-        await log(enriched)
+        await log(db, enriched)
 
-    async def log_on_remove(self, obj):
+    async def log_on_remove(self, obj, db: Optional[AnySession] = None):
         enriched: dict = self.enrich_log_data(obj, {
             "action": "DELETE"
         })
-        await log(enriched)
+        await log(db, enriched)
 
     def enrich_log_data(self, obj, logData) -> dict:
         logData["model"] = self.modelName
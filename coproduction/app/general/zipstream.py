@@ -0,0 +1,64 @@
+import io
+import time
+import zipfile
+from typing import IO, Optional
+
+
+class _Sink(io.RawIOBase):
+    # not seekable: zipfile writes the sizes after the data (data descriptors)
+    def __init__(self):
+        self.chunks = []
+        self.pending = 0
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.pending += len(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+
+class ZipStream:
+    """
+    A zip archive built while it is sent: the members are written with open() or write(), and
+    read() returns the bytes produced since the last call, so only the compressor buffers and
+    the current chunk are kept in memory.
+    """
+
+    def __init__(self, compression: int = zipfile.ZIP_DEFLATED):
+        self._sink = _Sink()
+        self._zip = zipfile.ZipFile(self._sink, "w", compression=compression)
+
+    @property
+    def pending(self) -> int:
+        # bytes waiting for read()
+        return self._sink.pending
+
+    def open(self, name: str, size: Optional[int] = None) -> IO[bytes]:
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = self._zip.compression
+        # with the size known, zip64 is only used when needed
+        if size is not None:
+            info.file_size = size
+        return self._zip.open(info, "w", force_zip64=size is None)
+
+    def write(self, name: str, data: bytes) -> None:
+        with self.open(name, size=len(data)) as f:
+            f.write(data)
+
+    def read(self) -> bytes:
+        data = b"".join(self._sink.chunks)
+        self._sink.chunks = []
+        self._sink.pending = 0
+        return data
+
+    def close(self) -> bytes:
+        # the central directory
+        self._zip.close()
+        return self.read()
@@ -1,3 +1,5 @@
+import asyncio
+
 from fastapi import FastAPI
 from fastapi.responses import RedirectResponse
 from fastapi_pagination import add_pagination
@@ -5,11 +7,16 @@ from starlette.middleware.cors import CORSMiddleware
 
 from app.api.api_v1 import api_router
 from app.config import settings
+from app.messages import log_shipper
+from app.general.emails import email_dispatcher, email_templates
+from app.general.httpclient import http_client
+from app.general.outbox import outbox
+from app.sockets import socket_manager
 from starlette.middleware import Middleware
 
 from starlette_context import plugins, context
 from starlette_context.middleware import ContextMiddleware
-from app.middleware import UserPlugin, LanguagePlugin, TokenPlugin
+from app.middleware import LanguagePlugin, TokenPlugin
 from app.signals import *
 
 middleware = [
@@ -18,7 +25,6 @@ middleware = [
         plugins=(
             plugins.RequestIdPlugin(),
             plugins.CorrelationIdPlugin(),
-            UserPlugin(),
             LanguagePlugin(),
             TokenPlugin()
         )
@@ -33,6 +39,24 @@ def main():
     return RedirectResponse(url=f"{settings.BASE_PATH}/docs")
 
 
+@app.on_event("startup")
+async def startup():
+    # the side effects of the sessions used in the threadpool are sent from this loop
+    outbox.loop = asyncio.get_running_loop()
+    await socket_manager.start()
+    email_templates.load()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    # sends (or spools) the log messages that are still in memory
+    log_shipper.close()
+    # the emails already queued are sent
+    email_dispatcher.close()
+    await http_client.aclose()
+    await socket_manager.close()
+
+
 @app.get("/healthcheck")
 def healthcheck():
     return None
@@ -46,6 +70,7 @@ if settings.BACKEND_CORS_ORIGINS:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["X-Next-Cursor", "X-Total-Count"],
     )
 
 
@@ -1,9 +1,21 @@
 import json
-import json
+from typing import Optional
 from uuid import UUID
-import requests
-from starlette_context import context
 from contextvars import ContextVar
+from app.config import settings
+from app.general.authentication import get_context_user_async
+from app.general.logshipper import LogShipper
+
+log_shipper = LogShipper(
+    url=settings.LOGGING_URL,
+    batch_url=settings.LOGGING_BATCH_URL,
+    batch_size=settings.LOGGING_BATCH_SIZE,
+    flush_interval=settings.LOGGING_FLUSH_INTERVAL,
+    queue_size=settings.LOGGING_QUEUE_SIZE,
+    spool_dir=settings.LOGGING_SPOOL_DIR,
+    spool_max_bytes=settings.LOGGING_SPOOL_MAX_BYTES,
+    timeout=settings.LOGGING_TIMEOUT,
+)
 
 _disable_logging: ContextVar[str] = ContextVar("disable_logging", default=False)
 
@@ -24,14 +36,19 @@ class UUIDEncoder(json.JSONEncoder):
             return str(obj)
         return json.JSONEncoder.default(self, obj)
         
-async def log(data: dict):
+async def log_message(data: dict) -> Optional[str]:
     if is_logging_disabled():
         print("logging disabled")
         return
 
     if not "user_id" in data:
-        data["user_id"] = context.data.get("user", {}).get("sub", "anonymous")
+        data["user_id"] = (await get_context_user_async() or {}).get("sub", "anonymous")
             
     data["service"] = "coproduction"
-    res = requests.post("http://logging/api/v1/log", data=json.dumps(data,cls=UUIDEncoder), timeout=2)
-    # print("message sent", res.json())
+    return json.dumps(data, cls=UUIDEncoder)
+
+
+async def log(data: dict):
+    # sent in the background by the log shipper
+    if (message := await log_message(data)) is not None:
+        log_shipper.ship(message)
@@ -4,24 +4,12 @@ from starlette.requests import HTTPConnection, Request
 from starlette_context.plugins import Plugin
 
 from app.general import deps
-from app.general.authentication import decode_token
 from app.config import settings
 
-class UserPlugin(Plugin):
-    # The returned value will be inserted in the context with this key
-    key = "user"
-
-    async def process_request(
-        self, request: Union[Request, HTTPConnection]
-    ) -> Optional[Any]:
-        token = deps.get_current_token(request=request)
-        if token:
-            return decode_token(token)
-        return None
-
 
 class TokenPlugin(Plugin):
     # The returned value will be inserted in the context with this key
+    # The token is decoded lazily (the "user" key) by app.general.authentication.get_context_user
     key = "token"
 
     async def process_request(
@@ -17,4 +17,6 @@ from app.tags.models import *
 from app.ratings.models import *
 from app.keywords.models import *
 from app.claims.models import *
-from app.assignments.models import *
\ No newline at end of file
+from app.assignments.models import *
+from app.clonejobs.models import *
+from app.exportjobs.models import *
\ No newline at end of file
@@ -11,7 +11,6 @@ from app.users.crud import exportCrud as users_crud
 
 from sqlalchemy import or_, and_
 from fastapi.encoders import jsonable_encoder
-from app.sockets import socket_manager
 from uuid_by_string import generate_uuid
 from app import schemas
 
@@ -47,8 +46,6 @@ class CRUDNotification(CRUDBase[Notification, NotificationCreate, NotificationPa
         db.commit()
         db.refresh(db_obj)
 
-        await socket_manager.broadcast({"event": "notification_created"})
-
         await self.log_on_create(db_obj)
         return db_obj
 
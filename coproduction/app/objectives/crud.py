@@ -11,11 +11,10 @@ from app.treeitems.crud import exportCrud as treeitems_crud
 from app.tasks.crud import exportCrud as tasks_crud
 from app.notifications.crud import exportCrud as notification_crud
 from app.coproductionprocesses.crud import exportCrud as coproductionprocesses_crud
-from app.utils import recursive_check
+from app.treeitems.graph import check_prerequisite, prerequisite_graph
 from fastapi.encoders import jsonable_encoder
-from app.sockets import socket_manager
+from app.general.outbox import tree_changed
 from app import models
-from app.utils import check_prerequistes
 import html
 
 
@@ -106,7 +105,7 @@ class CRUDObjective(CRUDBase[Objective, ObjectiveCreate, ObjectivePatch]):
                         db.refresh(objective)
 
         if (withSocketMsn):
-            await socket_manager.send_to_id(db_obj.coproductionprocess_id, {"event": "objective_created"})
+            tree_changed(db, db_obj.coproductionprocess_id, db_obj.id, "objective_created")
 
         return db_obj
 
@@ -116,7 +115,7 @@ class CRUDObjective(CRUDBase[Objective, ObjectiveCreate, ObjectivePatch]):
             raise Exception("Same object")
         # TODO: if objective in prerequisite.prerequisites => block
 
-        recursive_check(objective.id, prerequisite)
+        check_prerequisite(db, objective, prerequisite)
         objective.prerequisites.clear()
         objective.prerequisites.append(prerequisite)
         if commit:
@@ -162,7 +161,8 @@ class CRUDObjective(CRUDBase[Objective, ObjectiveCreate, ObjectivePatch]):
         prereqs_ids = []
         if obj_in.prerequisites_ids:
             for p_id in obj_in.prerequisites_ids:
-                prereqs_ids.append(extra['Objective_'+str(p_id)])
+                if 'Objective_'+str(p_id) in extra:
+                    prereqs_ids.append(extra['Objective_'+str(p_id)])
 
         new_objective = ObjectiveCreate(
             id=uuid.uuid4(),
@@ -182,24 +182,8 @@ class CRUDObjective(CRUDBase[Objective, ObjectiveCreate, ObjectivePatch]):
 
         new_objective = await self.create(db=db, obj_in=new_objective, withNotifications=False)
 
-        tasks_temp = obj_in.children.copy()
-        tasks = []
-        indexes = []
-
-        for id, task in enumerate(tasks_temp):
-            if not len(task.prerequisites_ids):
-                # if not task.is_disabled:
-                tasks.append(task)
-                indexes.append(str(task.id))
-                tasks_temp.pop(id)
-
-        while tasks_temp:
-            for id, task in enumerate(tasks_temp):
-                if check_prerequistes(task.prerequisites_ids, indexes):
-                    tasks.append(task)
-                    indexes.append(str(task.id))
-                    tasks_temp.pop(id)
-                    #    if not task.is_disabled:
+        # the prerequisites of a task are copied before it
+        tasks = prerequisite_graph(db, obj_in.path_ids[0]).sort(obj_in.children)
 
         ids_dict = {}
         for child in tasks:
@@ -218,7 +202,7 @@ class CRUDObjective(CRUDBase[Objective, ObjectiveCreate, ObjectivePatch]):
     def enrich_log_data(self, obj, logData):
         logData["model"] = "OBJECTIVE"
         logData["object_id"] = obj.id
-        logData["coproductionprocess_id"] = obj.phase.coproductionprocess_id
+        logData["coproductionprocess_id"] = obj.coproductionprocess_id
         logData["phase_id"] = obj.phase_id
         logData["objective_id"] = obj.id
         logData["roles"] = obj.user_roles
@@ -13,7 +13,7 @@ from sqlalchemy.orm import backref, relationship
 from sqlalchemy_utils import aggregated
 
 from app.tasks.models import Task
-from app.treeitems.models import TreeItem
+from app.treeitems.models import TreeItem, get_stored_path
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.ext.associationproxy import association_proxy
 
@@ -53,6 +53,8 @@ class Objective(TreeItem):
     
     @hybrid_property
     def coproductionprocess_id(self):
+        if self.path:
+            return self.path[0]
         return self.coproductionprocess.id
         
     @hybrid_property
@@ -62,9 +64,11 @@ class Objective(TreeItem):
             lst += task.assets
         return lst
 
-    @hybrid_property
-    def path_ids(self):
+    def computed_path_ids(self):
         return [self.coproductionprocess.id, self.phase_id, self.id]
+
+    def parent_path(self, connection):
+        return get_stored_path(self, connection, self.phase_id)
     
     @hybrid_property
     def is_disabled(self):
@@ -0,0 +1,202 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBackend:
+    """
+    Per process LRU: bounded to maxsize entries, each one expiring after ttl seconds. Only
+    for a single worker: the invalidations are not seen by the other ones.
+    """
+
+    def __init__(self, maxsize: int, ttl: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # also bounded to maxsize, see _forget_generations
+        self._generations: Dict[str, int] = OrderedDict()
+        # generation of the keys that are not in _generations
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: List[str]) -> List[Any]:
+        now = time.monotonic()
+        values = []
+        with self._lock:
+            for key in keys:
+                value = None
+                if entry := self._entries.get(key):
+                    if entry[0] > now:
+                        self._entries.move_to_end(key)
+                        value = entry[1]
+                    else:
+                        del self._entries[key]
+                values.append(value)
+        return values
+
+    def set_many(self, values: Dict[str, Any]) -> None:
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for key, value in values.items():
+                self._entries[key] = (expires, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_generations(self, keys: List[str]) -> List[int]:
+        with self._lock:
+            return [self._generations.get(key, self._floor) for key in keys]
+
+    def incr(self, key: str) -> None:
+        with self._lock:
+            self._generations[key] = self._generations.pop(key, self._floor) + 1
+            if len(self._generations) > self.maxsize:
+                self._forget_generations()
+
+    def _forget_generations(self) -> None:
+        # the least recently bumped half is dropped. The keys not kept go on from a generation
+        # higher than any given so far, so no old entry can become valid again
+        self._floor = max(self._generations.values()) + 1
+        for _ in range(len(self._generations) // 2):
+            self._generations.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._floor = 0
+
+
+class RedisBackend:
+    """
+    Shared by all the workers. Entries expire after ttl seconds, the eviction of the
+    least recently used ones is left to the maxmemory-policy of redis (allkeys-lru).
+    """
+
+    def __init__(self, url: str, ttl: int, prefix: str = "coproduction:permissions:"):
+        import redis
+        self.client = redis.Redis.from_url(url, socket_timeout=1)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get_many(self, keys: List[str]) -> List[Any]:
+        return [json.loads(value) if value else None for value in self.client.mget([self.prefix + key for key in keys])]
+
+    def set_many(self, values: Dict[str, Any]) -> None:
+        pipe = self.client.pipeline(transaction=False)
+        for key, value in values.items():
+            pipe.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+        pipe.execute()
+
+    def get_generations(self, keys: List[str]) -> List[int]:
+        return [int(value or 0) for value in self.client.mget([self.prefix + "generation:" + key for key in keys])]
+
+    def incr(self, key: str) -> None:
+        self.client.incr(self.prefix + "generation:" + key)
+
+    def clear(self) -> None:
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+
+class PermissionCache:
+    """
+    Resolved permissions and roles of a user over all the treeitems of a coproductionprocess,
+    keyed by (coproductionprocess, user): read once to seed the matrix of a session. Invalidation does not delete entries: it increments the generation of the
+    coproductionprocess or of the user, which is part of the key, so old entries are not reached
+    anymore and expire.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+
+    def _prefix(self, coproductionprocess_id, user_id) -> str:
+        generations = self.backend.get_generations(["all", f"process:{coproductionprocess_id}", f"user:{user_id}"])
+        return f"{coproductionprocess_id}:{user_id}:" + ".".join(str(generation) for generation in generations)
+
+    def get(self, coproductionprocess_id: uuid.UUID, user_id: str) -> Optional[dict]:
+        if not self.backend:
+            return None
+        try:
+            return self.backend.get_many([self._prefix(coproductionprocess_id, user_id)])[0]
+        except Exception as e:
+            logger.warning(f"Permission cache unavailable: {e}")
+            return None
+
+    def set(self, coproductionprocess_id: uuid.UUID, user_id: str, value: dict) -> None:
+        if not self.backend:
+            return
+        try:
+            self.backend.set_many({self._prefix(coproductionprocess_id, user_id): value})
+        except Exception as e:
+            logger.warning(f"Permission cache unavailable: {e}")
+
+    def _incr(self, key: str) -> None:
+        if not self.backend:
+            return
+        try:
+            self.backend.incr(key)
+        except Exception as e:
+            logger.error(f"Could not invalidate the permission cache ({key}): {e}")
+
+    def invalidate_coproductionprocess(self, coproductionprocess_id: uuid.UUID) -> None:
+        self._incr(f"process:{coproductionprocess_id}")
+
+    def invalidate_user(self, user_id: str) -> None:
+        self._incr(f"user:{user_id}")
+
+    def invalidate_all(self) -> None:
+        self._incr("all")
+
+    def invalidate_on_commit(self, session: Session, coproductionprocess_ids: Iterable = (), user_ids: Iterable = (), all: bool = False) -> None:
+        # invalidates now and again once the transaction is committed, so a request that
+        # reads the permissions meanwhile can not leave the old ones in the cache
+        pending = session.info.setdefault("permission_cache_invalidations", set())
+        for coproductionprocess_id in coproductionprocess_ids:
+            self.invalidate_coproductionprocess(coproductionprocess_id)
+            pending.add(("process", coproductionprocess_id))
+        for user_id in user_ids:
+            self.invalidate_user(user_id)
+            pending.add(("user", user_id))
+        if all:
+            self.invalidate_all()
+            pending.add(("all", None))
+
+
+def get_backend():
+    if settings.PERMISSION_CACHE_BACKEND == "redis":
+        return RedisBackend(settings.REDIS_URL, ttl=settings.PERMISSION_CACHE_TTL)
+    if settings.PERMISSION_CACHE_BACKEND == "memory":
+        return MemoryBackend(settings.PERMISSION_CACHE_SIZE, ttl=settings.PERMISSION_CACHE_TTL)
+    return None
+
+
+permission_cache = PermissionCache(get_backend())
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_permission_cache_after_commit(session):
+    for kind, id in session.info.pop("permission_cache_invalidations", ()):
+        if kind == "process":
+            permission_cache.invalidate_coproductionprocess(id)
+        elif kind == "user":
+            permission_cache.invalidate_user(id)
+        else:
+            permission_cache.invalidate_all()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def invalidate_permission_cache_after_rollback(session, previous_transaction):
+    # the permissions read inside the transaction (and cached) were not committed either
+    invalidate_permission_cache_after_commit(session)
@@ -2,25 +2,83 @@ import copy
 import uuid
 from typing import List
 
-from sqlalchemy import or_, and_
+from sqlalchemy import event, func, or_, and_
 from sqlalchemy.orm import Session
 
 from app import models, schemas
 from app.general.utils.CRUDBase import CRUDBase
 from app.models import Permission, TreeItem, CoproductionProcessNotification, UserNotification
 from app.permissions.models import DENY_ALL, PERMS, GRANT_ALL, INDEXES
+from app.permissions.cache import permission_cache
 from app.coproductionprocesses.crud import exportCrud as coproductionprocesses_crud
 from app.notifications.crud import exportCrud as notifications_crud
 from app.treeitems.crud import exportCrud as treeitems_crud
 from app.teams.crud import exportCrud as teams_crud
 from app.schemas import PermissionCreate
 from fastapi.encoders import jsonable_encoder
-from app.sockets import socket_manager
+from app.general.outbox import send_to_id
 from uuid_by_string import generate_uuid
 from app.general.emails import send_email, send_team_email
 import html
 
 
+class PermissionMatrix:
+    """
+    Effective permissions and roles of a user for every treeitem of a coproductionprocess.
+    Built by CRUDPermission.get_matrix with two queries, whatever the size of the tree.
+    """
+
+    def __init__(self, coproductionprocess_id: uuid.UUID, administrator: bool):
+        self.coproductionprocess_id = coproductionprocess_id
+        self.administrator = administrator
+        self.permissions = {}
+        self.roles = {}
+
+    def get(self, treeitem_id: uuid.UUID):
+        if self.administrator:
+            return GRANT_ALL
+        return self.permissions.get(treeitem_id)
+
+    def get_roles(self, treeitem_id: uuid.UUID):
+        if treeitem_id not in self.roles:
+            return None
+        roles = list(self.roles[treeitem_id])
+        if self.administrator:
+            roles.append('administrator')
+        return roles
+
+    def to_dict(self) -> dict:
+        # for the permission cache (JSON in redis)
+        return {
+            "administrator": self.administrator,
+            "permissions": {str(treeitem_id): permissions for treeitem_id, permissions in self.permissions.items()},
+            "roles": {str(treeitem_id): roles for treeitem_id, roles in self.roles.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, coproductionprocess_id: uuid.UUID, data: dict) -> "PermissionMatrix":
+        matrix = cls(coproductionprocess_id, administrator=data["administrator"])
+        matrix.permissions = {uuid.UUID(treeitem_id): dict(permissions) for treeitem_id, permissions in data["permissions"].items()}
+        matrix.roles = {uuid.UUID(treeitem_id): list(roles) for treeitem_id, roles in data["roles"].items()}
+        return matrix
+
+
+def merge_permissions(start: dict, permissions: List[Permission]) -> dict:
+    # permissions of the same level are added
+    result = dict(start)
+    for permission in permissions:
+        for permission_key in PERMS:
+            if not result[permission_key] and getattr(permission, permission_key):
+                result[permission_key] = True
+    return result
+
+
+# the matrices are kept in the session (one per request) until something is flushed
+@event.listens_for(Session, "after_flush")
+def forget_permission_matrices(session, flush_context):
+    session.info.pop("permission_matrices", None)
+
+
 class CRUDPermission(CRUDBase[Permission, schemas.PermissionCreate, schemas.PermissionPatch]):
 
     async def remove(self, db: Session, *, id: uuid.UUID) -> Permission:
@@ -80,14 +138,14 @@ class CRUDPermission(CRUDBase[Permission, schemas.PermissionCreate, schemas.Perm
 
                     db.add(newUserNotification)
 
-                    await socket_manager.send_to_id(generate_uuid(user_id), {"event": self.modelName.lower() + "_created"})
+                    send_to_id(db, generate_uuid(user_id), {"event": self.modelName.lower() + "_created"})
 
         db.commit()
         db.refresh(newCoproNotification)
 
         return None
 
-    async def create(self, db: Session, obj_in: PermissionCreate, creator: models.User, notifyAfterAdded=True) -> Permission:
+    async def create(self, db: Session, obj_in: PermissionCreate, creator: models.User, notifyAfterAdded=True, commit: bool = True) -> Permission:
         #print("LlAMA AL METODO CREATE DE PERMISSIONS:")
 
         obj_in_data = jsonable_encoder(obj_in)
@@ -96,8 +154,12 @@ class CRUDPermission(CRUDBase[Permission, schemas.PermissionCreate, schemas.Perm
         db_obj.creator_id = creator.id
 
         db.add(db_obj)
-        db.commit()
-        db.refresh(db_obj)
+        if commit:
+            db.commit()
+            db.refresh(db_obj)
+        else:
+            # committed by the caller
+            db.flush()
 
         # verify if the permission is of a (team or coproductionprocess)
 
@@ -153,7 +215,7 @@ class CRUDPermission(CRUDBase[Permission, schemas.PermissionCreate, schemas.Perm
 
                         db.add(newUserNotification)
 
-                        await socket_manager.send_to_id(generate_uuid(user_id), {"event": self.modelName.lower() + "_created"})
+                        send_to_id(db, generate_uuid(user_id), {"event": self.modelName.lower() + "_created"})
 
             db.commit()
             db.refresh(newCoproNotification)
@@ -181,9 +243,9 @@ class CRUDPermission(CRUDBase[Permission, schemas.PermissionCreate, schemas.Perm
                                      "team_id": team.id
                                      })
 
-        await socket_manager.send_to_id(generate_uuid(creator.id), {"event": "permission" + "_created"})
+        send_to_id(db, generate_uuid(creator.id), {"event": "permission" + "_created"})
 
-        await self.log_on_create(db_obj)
+        await self.log_on_create(db_obj, db=db)
         return db_obj
 
     async def get_multi(
@@ -216,11 +278,11 @@ class CRUDPermission(CRUDBase[Permission, schemas.PermissionCreate, schemas.Perm
             or_(
                 and_(
                     Permission.treeitem_id.in_(treeitem.path_ids),
-                    Permission.coproductionprocess_id == treeitem.coproductionprocess.id
+                    Permission.coproductionprocess_id == treeitem.coproductionprocess_id
                 ),
                 and_(
                     Permission.treeitem_id == None,
-                    Permission.coproductionprocess_id == treeitem.coproductionprocess.id
+                    Permission.coproductionprocess_id == treeitem.coproductionprocess_id
                 ),
             ),
             Permission.team_id.in_(user.teams_ids)
@@ -237,17 +299,81 @@ class CRUDPermission(CRUDBase[Permission, schemas.PermissionCreate, schemas.Perm
             or_(
                 and_(
                     Permission.treeitem_id.in_(treeitem.path_ids),
-                    Permission.coproductionprocess_id == treeitem.coproductionprocess.id
+                    Permission.coproductionprocess_id == treeitem.coproductionprocess_id
                 ),
                 and_(
                     Permission.treeitem_id == None,
-                    Permission.coproductionprocess_id == treeitem.coproductionprocess.id
+                    Permission.coproductionprocess_id == treeitem.coproductionprocess_id
                 ),
             ),
             Permission.team_id.in_(user.teams_ids)
         ).all()
 
+    def get_matrix(self, db: Session, user: models.User, coproductionprocess_id: uuid.UUID) -> PermissionMatrix:
+        # the one of the session, else the shared cache is read once to seed it
+        matrices = db.info.setdefault("permission_matrices", {})
+        key = (coproductionprocess_id, user.id)
+        if key not in matrices:
+            if (cached := permission_cache.get(coproductionprocess_id, user.id)) is not None:
+                matrix = PermissionMatrix.from_dict(coproductionprocess_id, cached)
+            else:
+                matrix = self.build_matrix(db=db, user=user, coproductionprocess_id=coproductionprocess_id)
+                permission_cache.set(coproductionprocess_id, user.id, matrix.to_dict())
+            matrices[key] = matrix
+        return matrices[key]
+
+    def get_cached(self, db: Session, user: models.User, treeitem: models.TreeItem) -> dict:
+        # {"permissions": ..., "roles": ...} of the user over the treeitem, None if it is not in the tree
+        matrix = self.get_matrix(db=db, user=user, coproductionprocess_id=treeitem.coproductionprocess_id)
+        if (permissions := matrix.get(treeitem.id)) is not None:
+            return {"permissions": permissions, "roles": matrix.get_roles(treeitem.id)}
+        return None
+
+    def build_matrix(self, db: Session, user: models.User, coproductionprocess_id: uuid.UUID) -> PermissionMatrix:
+        coproductionprocess = db.query(models.CoproductionProcess).get(coproductionprocess_id)
+        matrix = PermissionMatrix(coproductionprocess_id, administrator=user in coproductionprocess.administrators)
+
+        permissions_of = {}
+        for permission in db.query(
+            Permission
+        ).filter(
+            Permission.coproductionprocess_id == coproductionprocess_id,
+            Permission.team_id.in_(user.teams_ids)
+        ).order_by(Permission.created_at.asc()).all():
+            permissions_of.setdefault(permission.treeitem_id or coproductionprocess_id, []).append(permission)
+
+        def roles_of(node_id, inherited):
+            roles = list(inherited)
+            for permission in permissions_of.get(node_id, []):
+                if (role := permission.team.type.value) not in roles:
+                    roles.append(role)
+            return roles
+
+        # permissions given over the whole process are added, the ones given over a treeitem
+        # replace the ones of its ancestors (same result as get_dict_for_user_and_treeitem)
+        matrix.permissions[coproductionprocess_id] = merge_permissions(DENY_ALL, permissions_of.get(coproductionprocess_id, []))
+        matrix.roles[coproductionprocess_id] = roles_of(coproductionprocess_id, [])
+
+        # parents always come before their children
+        paths = db.query(TreeItem.path).filter(
+            TreeItem.path.contains([coproductionprocess_id])
+        ).order_by(func.cardinality(TreeItem.path)).all()
+        for (path, ) in paths:
+            treeitem_id, parent_id = path[-1], path[-2]
+            if parent_id not in matrix.permissions:
+                continue
+            if own := permissions_of.get(treeitem_id):
+                first = {permission_key: getattr(own[0], permission_key) for permission_key in PERMS}
+                matrix.permissions[treeitem_id] = merge_permissions(first, own[1:])
+            else:
+                matrix.permissions[treeitem_id] = matrix.permissions[parent_id]
+            matrix.roles[treeitem_id] = roles_of(treeitem_id, matrix.roles[parent_id])
+        return matrix
+
     def get_user_roles(self, db: Session, treeitem: models.TreeItem, user: models.User):
+        if cached := self.get_cached(db=db, user=user, treeitem=treeitem):
+            return cached["roles"]
+
         roles = []
         for perm in self.get_for_user_and_treeitem(db=db, user=user, treeitem=treeitem):
             role = perm.team.type.value
@@ -259,6 +385,10 @@ class CRUDPermission(CRUDBase[Permission, schemas.PermissionCreate, schemas.Perm
         return roles
 
     def get_dict_for_user_and_treeitem(self, db: Session, treeitem: models.TreeItem, user: models.User):
+        if cached := self.get_cached(db=db, user=user, treeitem=treeitem):
+            return cached["permissions"]
+
+        # treeitems without a stored path
         if user in treeitem.coproductionprocess.administrators:
             return GRANT_ALL
         permissions = self.get_for_user_and_treeitem(
@@ -292,8 +422,6 @@ class CRUDPermission(CRUDBase[Permission, schemas.PermissionCreate, schemas.Perm
         return logData
 
     def user_can(self, db, user, task, permission):
-        if user in task.coproductionprocess.administrators:
-            return True
         if permission in PERMS:
             perms: dict = self.get_dict_for_user_and_treeitem(
                 db=db, treeitem=task, user=user)
@@ -5,6 +5,7 @@ from sqlalchemy import (
     Column,
     Enum,
     ForeignKey,
+    Index,
     String,
 )
 from sqlalchemy.dialects.postgresql import UUID
@@ -39,6 +40,12 @@ class Permission(BaseModel):
     def __repr__(self):
         return "<Permission>"
 
+
+# permissions of a user (or of the user's teams) in a process
+Index("ix_permission_team_id_coproductionprocess_id", Permission.team_id, Permission.coproductionprocess_id)
+Index("ix_permission_user_id_coproductionprocess_id", Permission.user_id, Permission.coproductionprocess_id)
+Index("ix_permission_coproductionprocess_id_team_id", Permission.coproductionprocess_id, Permission.team_id)
+
 # DO NOT REMOVE
 GRANT_ALL = {}
 DENY_ALL = {}
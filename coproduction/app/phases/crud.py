@@ -12,11 +12,10 @@ from app.treeitems.crud import exportCrud as treeitems_crud
 from app.objectives.crud import exportCrud as objectives_crud
 from app.notifications.crud import exportCrud as notification_crud
 from app.coproductionprocesses.crud import exportCrud as coproductionprocesses_crud
-from app.utils import recursive_check
+from app.treeitems.graph import check_prerequisite, prerequisite_graph
 from fastapi.encoders import jsonable_encoder
-from app.sockets import socket_manager
+from app.general.outbox import tree_changed
 from app import models
-from app.utils import check_prerequistes
 import html
 
 
@@ -109,7 +108,7 @@ class CRUDPhase(CRUDBase[Phase, PhaseCreate, PhasePatch]):
                 db.refresh(newCoproNotification)
 
         if (withSocketMsn):
-            await socket_manager.send_to_id(db_obj.coproductionprocess_id, {"event": "phase_created"})
+            tree_changed(db, db_obj.coproductionprocess_id, db_obj.id, "phase_created")
 
         return db_obj
 
@@ -118,7 +117,7 @@ class CRUDPhase(CRUDBase[Phase, PhaseCreate, PhasePatch]):
             #print(phase, prerequisite)
             raise Exception("Same object")
 
-        recursive_check(phase.id, prerequisite)
+        check_prerequisite(db, phase, prerequisite)
         phase.prerequisites.clear()
         phase.prerequisites.append(prerequisite)
         if commit:
@@ -163,7 +162,8 @@ class CRUDPhase(CRUDBase[Phase, PhaseCreate, PhasePatch]):
         prereqs_ids = []
         if obj_in.prerequisites_ids:
             for p_id in obj_in.prerequisites_ids:
-                prereqs_ids.append(extra['Phase_'+str(p_id)])
+                if 'Phase_'+str(p_id) in extra:
+                    prereqs_ids.append(extra['Phase_'+str(p_id)])
 
         new_phase = PhaseCreate(
             progress=obj_in.progress,
@@ -183,24 +183,8 @@ class CRUDPhase(CRUDBase[Phase, PhaseCreate, PhasePatch]):
 
         new_phase = await self.create(db=db, obj_in=new_phase, withNotifications=False)
 
-        objectives_temp = obj_in.children.copy()
-        objectives = []
-        indexes = []
-
-        for id, objective in enumerate(objectives_temp):
-            if not len(objective.prerequisites_ids):
-                # if not objective.is_disabled:
-                objectives.append(objective)
-                indexes.append(str(objective.id))
-                objectives_temp.pop(id)
-
-        while objectives_temp:
-            for id, objective in enumerate(objectives_temp):
-                if check_prerequistes(objective.prerequisites_ids, indexes):
-                    # if not objective.is_disabled:
-                    objectives.append(objective)
-                    indexes.append(str(objective.id))
-                    objectives_temp.pop(id)
+        # the prerequisites of an objective are copied before it
+        objectives = prerequisite_graph(db, obj_in.coproductionprocess_id).sort(obj_in.children)
 
         #  Create a dict with the old ids and the new ids
         ids_dict = {}
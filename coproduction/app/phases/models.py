@@ -61,9 +61,11 @@ class Phase(TreeItem):
     def is_disabled(self):
         return (self.disabled_on is not None)
 
-    @hybrid_property
-    def path_ids(self):
+    def computed_path_ids(self):
         return [self.coproductionprocess_id, self.id]
+
+    def parent_path(self, connection):
+        return [self.coproductionprocess_id]
     
     @hybrid_property
     def assets(self):
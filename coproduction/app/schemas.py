@@ -19,6 +19,8 @@ from app.ratings.schemas import *
 from app.keywords.schemas import *
 from app.claims.schemas import *
 from app.assignments.schemas import *
+from app.clonejobs.schemas import *
+from app.exportjobs.schemas import *
 
 # out
 
@@ -1,32 +1,77 @@
+import logging
 
-from sqlalchemy import event
-from app.models import Permission, InternalAsset, User
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import object_session
+from app.models import Permission, InternalAsset, User, Team
+from app.permissions.cache import permission_cache
+from app.assets.metadata import asset_metadata_cache
 from app.worker import sync_asset_users, sync_asset_treeitems
-import requests
 from app.config import settings
+from app.general.httpclient import http_client
+from app.general.outbox import outbox
+
+logger = logging.getLogger(__name__)
 
 @event.listens_for(User, "after_update")
 @event.listens_for(User, "after_delete")
 def after_user_update_or_delete(mapper, connection, target: User):
-    sync_asset_users.delay([target.id])
+    outbox.add(object_session(target), "sync_asset_users", target.id)
 
 @event.listens_for(Permission, "after_insert")
 @event.listens_for(Permission, "after_update")
 @event.listens_for(Permission, "after_delete")
 def after_permission_insert_update_or_delete(mapper, connection, target: Permission):
-    sync_asset_treeitems.delay([target.treeitem_id])
+    permission_cache.invalidate_on_commit(object_session(target), coproductionprocess_ids=[target.coproductionprocess_id])
+    outbox.add(object_session(target), "sync_asset_treeitems", target.treeitem_id)
+
+# the permissions of a removed team are deleted by the database (no Permission events)
+@event.listens_for(Team, "after_update")
+@event.listens_for(Team, "after_delete")
+def after_team_update_or_delete(mapper, connection, target: Team):
+    state = inspect(target)
+    if state.deleted or state.attrs.type.history.has_changes():
+        permission_cache.invalidate_on_commit(object_session(target), all=True)
 
 @event.listens_for(InternalAsset, "after_insert")
 @event.listens_for(InternalAsset, "after_update")
 def after_asset_insert_or_update(mapper, connection, target: InternalAsset):
     #print("Asset created", target)
-    sync_asset_treeitems.delay([target.task_id])
+    outbox.add(object_session(target), "sync_asset_treeitems", target.task_id)
+
+
+@event.listens_for(InternalAsset, "after_update")
+@event.listens_for(InternalAsset, "after_delete")
+def invalidate_asset_metadata(mapper, connection, target: InternalAsset):
+    asset_metadata_cache.invalidate(target.external_asset_id)
 
 
 @event.listens_for(InternalAsset, "after_delete")
-async def after_asset_delete(mapper, connection, target: InternalAsset):
+def after_asset_delete(mapper, connection, target: InternalAsset):
     #print("Asset deleted", target)
-    URL = target.internal_link
-    requests.delete(URL, headers={
-        "Authorization": settings.BACKEND_SECRET
-    })
\ No newline at end of file
+    # the resource is removed from the interlinker only if the deletion is committed
+    try:
+        outbox.add(object_session(target), "delete_interlinker_assets", target.internal_link)
+    except Exception as e:
+        logger.error(f"Could not get the link of asset {target.id}: {e}")
+
+
+@outbox.handler("sync_asset_users")
+def delay_sync_asset_users(user_ids):
+    sync_asset_users.delay(user_ids)
+
+
+@outbox.handler("sync_asset_treeitems")
+def delay_sync_asset_treeitems(treeitem_ids):
+    if treeitem_ids := [treeitem_id for treeitem_id in treeitem_ids if treeitem_id]:
+        sync_asset_treeitems.delay(treeitem_ids)
+
+
+@outbox.handler("delete_interlinker_assets")
+async def delete_interlinker_assets(urls):
+    for url in urls:
+        try:
+            await http_client.delete(url, headers={
+                "Authorization": settings.BACKEND_SECRET
+            })
+        except Exception as e:
+            logger.error(f"Could not delete {url}: {e}")
\ No newline at end of file
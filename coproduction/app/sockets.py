@@ -1,46 +1,366 @@
+import asyncio
 import json
+import logging
+import threading
 import uuid
-from typing import Dict, List
+from typing import Dict, Iterable, List, Optional, Union
 
 from fastapi import (
     WebSocket,
+    status,
 )
 
+from uuid_by_string import generate_uuid
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBroker:
+    """
+    Messages only reach the connections of this process (single worker, tests).
+    """
+
+    async def start(self) -> None:
+        pass
+
+    async def subscribe(self, id: str) -> None:
+        pass
+
+    async def unsubscribe(self, id: str) -> None:
+        pass
+
+    async def publish(self, id: Optional[str], text: str) -> None:
+        self.deliver(id, text)
+
+    async def close(self) -> None:
+        pass
+
+
+class RedisBroker:
+    """
+    Messages are published in redis, and every worker delivers them to its own connections:
+    a worker is subscribed to the channel of every id with a connection in it, and to the
+    broadcast channel.
+    """
+
+    def __init__(self, url: str, prefix: str = "coproduction:sockets:"):
+        import redis
+        import redis.asyncio
+        # publishing is sync (in the executor) so it works from any loop: celery tasks and
+        # the sessions of the threadpool dispatch their messages with their own loops
+        self.publisher = redis.Redis.from_url(url, socket_timeout=1)
+        self.redis = redis.asyncio.Redis.from_url(url)
+        self.prefix = prefix
+        self.broadcast_channel = prefix + "broadcast"
+        self.ids = set()
+        self.pubsub = None
+        self.listener: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self.pubsub = self.redis.pubsub()
+        await self.pubsub.subscribe(self.broadcast_channel)
+        self.listener = asyncio.create_task(self.listen())
+
+    async def listen(self) -> None:
+        while True:
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if not message:
+                    continue
+                channel = message["channel"].decode()
+                id = None if channel == self.broadcast_channel else channel[len(self.prefix):]
+                self.deliver(id, message["data"].decode())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Socket pubsub failed, resubscribing: {e}")
+                await asyncio.sleep(1)
+                try:
+                    await self.pubsub.reset()
+                    await self.pubsub.subscribe(self.broadcast_channel, *[self.prefix + id for id in self.ids])
+                except Exception as e:
+                    logger.error(f"Could not resubscribe: {e}")
+
+    async def subscribe(self, id: str) -> None:
+        self.ids.add(id)
+        await self.pubsub.subscribe(self.prefix + id)
+
+    async def unsubscribe(self, id: str) -> None:
+        self.ids.discard(id)
+        await self.pubsub.unsubscribe(self.prefix + id)
+
+    async def publish(self, id: Optional[str], text: str) -> None:
+        channel = self.broadcast_channel if id is None else self.prefix + id
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.publisher.publish, channel, text)
+        except Exception as e:
+            # at least the clients of this worker get it
+            logger.warning(f"Could not publish socket message, delivering it locally: {e}")
+            self.deliver(id, text)
+
+    async def close(self) -> None:
+        if self.listener:
+            self.listener.cancel()
+        if self.pubsub:
+            await self.pubsub.close()
+        await self.redis.close()
+        self.publisher.close()
+
+
+# messages between the workers (never sent to the clients), they change the topics of a connection
+CONTROL_PREFIX = "\x00control:"
+
+
+def user_topic(user_id: str) -> str:
+    # the id of the personal socket of the user
+    return generate_uuid(user_id)
+
+
+def team_topic(team_id: Union[str, uuid.UUID]) -> str:
+    return f"team:{team_id}"
+
+
+def organization_topic(organization_id: Union[str, uuid.UUID]) -> str:
+    return f"organization:{organization_id}"
+
+
+def get_broker():
+    if settings.SOCKETS_BACKEND == "redis":
+        return RedisBroker(settings.REDIS_URL)
+    return MemoryBroker()
+
+
+class Connection:
+    """
+    A websocket with its queue of outgoing messages, written by its own task. A message is not
+    queued again while it is still pending, and the socket is closed when its queue is full or
+    a send takes longer than SOCKETS_SEND_TIMEOUT (the client refetches when it reconnects).
+    """
+
+    def __init__(self, manager: "ConnectionManager", websocket: WebSocket, id: str):
+        self.manager = manager
+        self.websocket = websocket
+        self.id = id
+        # every key (the id and the topics) the connection is registered with
+        self.topics = set()
+        self.queue = asyncio.Queue(maxsize=settings.SOCKETS_SEND_QUEUE_SIZE)
+        self.pending = set()
+        self.writer = asyncio.create_task(self.write())
+
+    def send(self, text: str) -> None:
+        if text in self.pending:
+            self.manager.coalesced += 1
+            return
+        try:
+            self.queue.put_nowait(text)
+        except asyncio.QueueFull:
+            logger.info(f"Socket of {self.id} is too slow, closing it")
+            self.manager.dropped += 1
+            self.manager.drop(self, code=status.WS_1013_TRY_AGAIN_LATER)
+            return
+        self.pending.add(text)
+
+    async def write(self) -> None:
+        try:
+            while True:
+                text = await self.queue.get()
+                self.pending.discard(text)
+                await asyncio.wait_for(self.websocket.send_text(text), settings.SOCKETS_SEND_TIMEOUT)
+                self.manager.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info(f"Dropping socket of {self.id}: {e!r}")
+            self.manager.dropped += 1
+            self.manager.drop(self)
+
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[uuid.UUID, List[WebSocket]] = {}
+    def __init__(self, broker=None):
+        # ids are strings: the users connect with strings and the processes with uuids
+        self.active_connections: Dict[str, List[Connection]] = {}
+        self.broker = broker or MemoryBroker()
+        self.broker.deliver = self._deliver
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._started: Optional[asyncio.Future] = None
+        self._tasks = set()
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    async def start(self):
+        # the subscriptions live in the loop of the server, the first connection starts them
+        if self._started is None:
+            self.loop = asyncio.get_running_loop()
+            self._started = asyncio.ensure_future(self.broker.start())
+        await self._started
+
+    async def close(self):
+        for connections in list(self.active_connections.values()):
+            for connection in connections:
+                connection.writer.cancel()
+        if self._started is not None:
+            self._started = None
+            await self.broker.close()
+
+    def _create_task(self, coroutine):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
 
-    async def connect(self, websocket: WebSocket, id: uuid.UUID):
+    async def connect(self, websocket: WebSocket, id: Union[str, uuid.UUID], topics: Iterable[str] = ()):
         #print("Connecting", id)
+        await self.start()
+        id = str(id)
         await websocket.accept()
-        if id in self.active_connections and len(self.active_connections[id]) > 0:
-            self.active_connections[id] = self.active_connections[id] + [websocket]
+        connection = Connection(self, websocket, id)
+        for topic in [id, *topics]:
+            await self._add(connection, topic)
+
+    async def _add(self, connection: Connection, topic: str):
+        if topic in connection.topics:
+            return
+        connection.topics.add(topic)
+        if topic in self.active_connections and len(self.active_connections[topic]) > 0:
+            self.active_connections[topic] = self.active_connections[topic] + [connection]
+        else:
+            self.active_connections[topic] = [connection]
+            await self.broker.subscribe(topic)
+
+    def _discard(self, connection: Connection, topic: str):
+        connection.topics.discard(topic)
+        filtered_active_connections = [conn for conn in self.active_connections.get(topic, []) if conn is not connection]
+        if len(filtered_active_connections) == 0:
+            self.active_connections.pop(topic, None)
+            self._create_task(self._unsubscribe(topic))
         else:
-            self.active_connections[id] = [websocket]
+            self.active_connections[topic] = filtered_active_connections
 
-    def disconnect(self, websocket: WebSocket, id: uuid.UUID):
+    def disconnect(self, websocket: WebSocket, id: Union[str, uuid.UUID]):
         #print("Disconnecting", id)
-        if id in self.active_connections:
-            filtered_active_connections = [conn for conn in self.active_connections[id] if conn != websocket]
-            if len(filtered_active_connections) == 0:
-                del self.active_connections[id]
-            else:
-                self.active_connections[id] = filtered_active_connections
-
-    async def send_to_id(self, id: uuid.UUID, data: dict):
+        id = str(id)
+        for connection in [conn for conn in self.active_connections.get(id, []) if conn.websocket == websocket]:
+            connection.writer.cancel()
+            for topic in list(connection.topics):
+                self._discard(connection, topic)
+
+    def drop(self, connection: Connection, code: int = status.WS_1011_INTERNAL_ERROR):
+        self.disconnect(connection.websocket, connection.id)
+        self._create_task(self._close(connection.websocket, code))
+
+    async def _close(self, websocket: WebSocket, code: int):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            # already closed by the client
+            pass
+
+    async def _unsubscribe(self, id: str):
+        # unless somebody connected again meanwhile
+        if id not in self.active_connections:
+            try:
+                await self.broker.unsubscribe(id)
+            except Exception as e:
+                logger.warning(f"Could not unsubscribe from {id}: {e}")
+
+    async def subscribe(self, id: Union[str, uuid.UUID], topics: Iterable[str]):
+        """
+        Adds topics to the connections of id, in whatever worker they are.
+        """
+        await self.broker.publish(str(id), CONTROL_PREFIX + json.dumps({"subscribe": list(topics)}))
+
+    async def unsubscribe(self, id: Union[str, uuid.UUID], topics: Iterable[str]):
+        await self.broker.publish(str(id), CONTROL_PREFIX + json.dumps({"unsubscribe": list(topics)}))
+
+    def _control(self, id: str, text: str):
+        message = json.loads(text[len(CONTROL_PREFIX):])
+        for connection in list(self.active_connections.get(id, [])):
+            for topic in message.get("subscribe", []):
+                self._create_task(self._add(connection, topic))
+            for topic in message.get("unsubscribe", []):
+                if topic != connection.id and topic in connection.topics:
+                    self._discard(connection, topic)
+
+    def _deliver(self, id: Optional[str], text: str):
+        # the queues belong to the loop of the server
+        if self.loop is not None and self.loop is not _running_loop():
+            self.loop.call_soon_threadsafe(self._deliver, id, text)
+            return
+        if id is None:
+            # a connection registered with several topics gets it once
+            connections = {connection for connections in self.active_connections.values() for connection in connections}
+        elif text.startswith(CONTROL_PREFIX):
+            self._control(id, text)
+            return
+        else:
+            connections = self.active_connections.get(id, [])
+        for connection in list(connections):
+            connection.send(text)
+
+    async def send_to_id(self, id: Union[str, uuid.UUID], data: dict):
         #print(self.active_connections)
-        if id in self.active_connections:
-            for connection in self.active_connections[id]:
-                #print("Sending", data, "to", connection, "in", id)
-                await connection.send_text(json.dumps(data))
-                
+        await self.broker.publish(str(id), json.dumps(data))
+
     #Method to send events to everybody connected to personal socket:
     async def broadcast(self, data: dict):
-        #print(self.active_connections)
         #print(data)
-        for key in self.active_connections:
-            for connection in self.active_connections[key]:
-                #print("Sending", data, "to", connection, "in", key)
-                await connection.send_text(json.dumps(data))
+        await self.broker.publish(None, json.dumps(data))
+
+    def snapshot(self) -> dict:
+        connections = {connection for connections in list(self.active_connections.values()) for connection in connections}
+        return {
+            "backend": type(self.broker).__name__,
+            "topics": len(self.active_connections),
+            "connections": len(connections),
+            "queued": sum(connection.queue.qsize() for connection in connections),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+        }
+
+
+class EventCoalescer:
+    """
+    Changes of the tree of a process, sent as a single tree_changed event with the ids of the
+    tree items changed (and the original events) during window seconds, so the clients refresh
+    the tree once instead of once per node.
+    """
+
+    def __init__(self, manager: ConnectionManager, window: float):
+        self.manager = manager
+        self.window = window
+        self._pending: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    async def add(self, id: Union[str, uuid.UUID], treeitem_ids: Iterable[str], events: Iterable[str]):
+        id = str(id)
+        with self._lock:
+            first = id not in self._pending
+            # dicts as ordered sets
+            changed, names = self._pending.setdefault(id, ({}, {}))
+            changed.update(dict.fromkeys(treeitem_id for treeitem_id in treeitem_ids if treeitem_id))
+            names.update(dict.fromkeys(events))
+        if not first:
+            # the first one of the window sends them all
+            return
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            # also when the wait is cancelled: a key left behind would drop the next changes.
+            # It is gone before the send, so a failed send does not leave it either
+            with self._lock:
+                changed, names = self._pending.pop(id, ({}, {}))
+        await self.manager.send_to_id(id, {"event": "tree_changed", "extra": {"treeitem_ids": list(changed), "events": list(names)}})
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
 
-socket_manager = ConnectionManager()
+socket_manager = ConnectionManager(get_broker())
+tree_events = EventCoalescer(socket_manager, window=settings.SOCKETS_TREE_DEBOUNCE)
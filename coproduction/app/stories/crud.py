@@ -3,7 +3,8 @@ from typing import Any, Dict, Optional, List
 
 from sqlalchemy.orm import Session
 from app.general.utils.CRUDBase import CRUDBase
-from app.models import Notification, Story, User, Organization, Keyword
+from app.models import CoproductionProcess, Notification, Story, User, Organization, Keyword
+from app.general.search import document, full_text_search, jsonb_text
 from app.schemas import NotificationCreate, NotificationPatch, StoryCreate, StoryPatch
 import uuid
 from app import models,crud
@@ -40,16 +41,19 @@ class CRUDStory(CRUDBase[Story, StoryCreate, StoryPatch]):
         if rating:
             queries.append(Story.rating >= rating)
             
+        rank = None
         if search:
-            search = search.lower()
-            queries.append(or_(
-                    # func.lower(Story.keywords_translations[language]).contains(
-                    #     search),
-                    func.lower(Story.data_story['title'].astext).contains(func.lower(
-                        search)),
-                    func.lower(
-                        Story.data_story['description'].astext).contains(func.lower(search))
-                ))
+            # served by the full text search indexes of every language
+            condition, rank = full_text_search(
+                Story.language,
+                document(
+                    jsonb_text(Story.data_story, "title"),
+                    jsonb_text(Story.data_story, "description"),
+                    jsonb_text(Story.data_story, "keywords"),
+                ),
+                search
+            )
+            queries.append(condition)
         
         if keyword:
             queries.append(
@@ -62,7 +66,10 @@ class CRUDStory(CRUDBase[Story, StoryCreate, StoryPatch]):
         #     queries.append(
         #         Interlinker.creator_id != None
         #     )
-        return paginate(db.query(Story).filter(*queries, Story.id.not_in(exclude)))
+        query = db.query(Story).filter(*queries, Story.id.not_in(exclude))
+        if rank is not None:
+            query = query.order_by(rank.desc(), Story.created_at.desc())
+        return paginate(query)
         #return paginate(db.query(Story).all())
 
 
@@ -102,6 +109,8 @@ class CRUDStory(CRUDBase[Story, StoryCreate, StoryPatch]):
             
         # Add the keywords to the story:
         db_obj = Story(**obj_in_data)
+        # language of the process, so the story is searched with the same configuration
+        db_obj.language = db.query(CoproductionProcess.language).filter(CoproductionProcess.id == db_obj.coproductionprocess_id).scalar()
         for keywordObj in listObjKeywords:
             db_obj.keywords.append(keywordObj)
 
@@ -109,7 +118,7 @@ class CRUDStory(CRUDBase[Story, StoryCreate, StoryPatch]):
         db.commit()
         db.refresh(db_obj)
 
-        await socket_manager.broadcast({"event": "story_created"})
+        await socket_manager.send_to_id(db_obj.coproductionprocess_id, {"event": "story_created"})
 
         await self.log_on_create(db_obj)
         return db_obj
@@ -31,6 +31,8 @@ class Story(BaseModel):
 
     #Json object with information relevant to a story:
     data_story = Column(JSONB, nullable=True)
+    # language of the process, used by the full text search
+    language = Column(String, nullable=True)
 
     # 1 digit for decimals
     rating= Column(Numeric(2, 1), default=0)
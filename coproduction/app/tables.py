@@ -1,4 +1,4 @@
-from sqlalchemy import ARRAY, Column, ForeignKey, String, Table, func, Boolean, DateTime
+from sqlalchemy import ARRAY, Column, ForeignKey, Index, String, Table, func, Boolean, DateTime
 
 from app.general.db.base_class import Base as BaseModel
 from app.utils import ChannelTypes
@@ -11,6 +11,7 @@ team_administrators_association_table = Table('team_administrators', BaseModel.m
 coproductionprocess_administrators_association_table = Table('coproductionprocess_administrators', BaseModel.metadata,
                                     Column('coproductionprocess_id', ForeignKey('coproductionprocess.id', ondelete="CASCADE"), primary_key=True),
                                     Column('user_id', ForeignKey('user.id', ondelete="CASCADE"), primary_key=True))
+Index('ix_coproductionprocess_administrators_user_id', coproductionprocess_administrators_association_table.c.user_id, coproductionprocess_administrators_association_table.c.coproductionprocess_id)
 
 organization_administrators_association_table = Table('organization_administrators', BaseModel.metadata,
                                     Column('organization_id', ForeignKey('organization.id', ondelete="CASCADE"), primary_key=True),
@@ -8,11 +8,13 @@ from app.general.utils.CRUDBase import CRUDBase
 from app.models import Task, Phase, Objective, User, CoproductionProcessNotification
 from app.schemas import TaskCreate, TaskPatch
 from fastapi.encoders import jsonable_encoder
-from app.utils import recursive_check, update_status_and_progress
+from app.utils import update_status_and_progress
+from app.treeitems.graph import check_prerequisite
 from app.messages import log
 from app.treeitems.crud import exportCrud as treeitems_crud
 from app.notifications.crud import exportCrud as notification_crud
 from app.coproductionprocesses.crud import exportCrud as coproductionprocesses_crud
+from app.general.outbox import tree_changed
 from app.sockets import socket_manager
 from app import models
 import html
@@ -147,9 +149,7 @@ class CRUDTask(CRUDBase[Task, TaskCreate, TaskPatch]):
 
         # Update its id to my
         if withSocketMsn:
-            await socket_manager.send_to_id(
-                db_obj.coproductionprocess_id, {"event": "task_created"}
-            )
+            tree_changed(db, db_obj.coproductionprocess_id, db_obj.id, "task_created")
         return db_obj
 
     async def add_prerequisite(
@@ -158,7 +158,7 @@ class CRUDTask(CRUDBase[Task, TaskCreate, TaskPatch]):
         if task == prerequisite:
             raise Exception("Same object")
 
-        recursive_check(task.id, prerequisite)
+        check_prerequisite(db, task, prerequisite)
         task.prerequisites.clear()
         task.prerequisites.append(prerequisite)
         if commit:
@@ -276,7 +276,8 @@ class CRUDTask(CRUDBase[Task, TaskCreate, TaskPatch]):
         prereqs_ids = []
         if obj_in.prerequisites_ids:
             for p_id in obj_in.prerequisites_ids:
-                prereqs_ids.append(extra["Task_" + str(p_id)])
+                if "Task_" + str(p_id) in extra:
+                    prereqs_ids.append(extra["Task_" + str(p_id)])
 
         new_task = TaskCreate(
             id=uuid.uuid4(),
@@ -312,8 +313,8 @@ class CRUDTask(CRUDBase[Task, TaskCreate, TaskPatch]):
     def enrich_log_data(self, obj, logData):
         logData["model"] = "TASK"
         logData["object_id"] = obj.id
-        logData["coproductionprocess_id"] = obj.objective.phase.coproductionprocess_id
-        logData["phase_id"] = obj.objective.phase_id
+        logData["coproductionprocess_id"] = obj.coproductionprocess_id
+        logData["phase_id"] = obj.phase_id
         logData["objective_id"] = obj.objective_id
         logData["task_id"] = obj.id
         logData["roles"] = obj.user_roles
@@ -11,7 +11,7 @@ from sqlalchemy import (
 from sqlalchemy.dialects.postgresql import ARRAY, UUID
 from sqlalchemy.orm import backref, relationship
 
-from app.treeitems.models import TreeItem
+from app.treeitems.models import TreeItem, get_stored_path
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.ext.associationproxy import association_proxy
 # from app.tables import task_notification_association_table
@@ -57,15 +57,21 @@ class Task(TreeItem):
 
     @hybrid_property
     def coproductionprocess_id(self):
+        if self.path:
+            return self.path[0]
         return self.coproductionprocess.id
 
     @hybrid_property
     def phase_id(self):
+        if self.path:
+            return self.path[1]
         return self.objective.phase_id
 
-    @hybrid_property
-    def path_ids(self):
+    def computed_path_ids(self):
         return [self.coproductionprocess.id, self.objective.phase_id, self.objective_id, self.id]
+
+    def parent_path(self, connection):
+        return get_stored_path(self, connection, self.objective_id)
     
     @hybrid_property
     def is_disabled(self):
@@ -1,4 +1,3 @@
-from app.messages import log
 from typing import Any, Dict, Optional, List
 
 from sqlalchemy.orm import Session
@@ -13,10 +12,11 @@ from app.usernotifications.crud import exportCrud as usernotification_crud
 from app.notifications.crud import exportCrud as notification_crud
 from sqlalchemy import or_, and_
 from fastapi.encoders import jsonable_encoder
-from app.sockets import socket_manager
+from app.sockets import organization_topic, team_topic, user_topic
 from uuid_by_string import generate_uuid
-from app.general.emails import send_email, send_team_email
+from app.general.outbox import hold_outbox, log, outbox, send_email, send_team_email, send_to_id, subscribe, unsubscribe
 from app.locales import get_language
+from app.permissions.cache import permission_cache
 from fastapi import HTTPException
 import html
 
@@ -40,21 +40,21 @@ class CRUDTeam(CRUDBase[Team, TeamCreate, TeamPatch]):
     
     
 
+    @hold_outbox
     async def add_user(self, db: Session, team: Team, user: models.User) -> Team:
-        from app.worker import sync_asset_treeitems
-
-        sync_asset_treeitems.delay(
-            [permission.treeitem_id for permission in team.permissions]
-        )
         team.users.append(user)
-        db.commit()
-        db.refresh(team)
+        for permission in team.permissions:
+            outbox.add(db, "sync_asset_treeitems", permission.treeitem_id)
         await log(
-            self.enrich_log_data(team, {"action": "ADD_USER", "added_user_id": user.id})
+            db, self.enrich_log_data(team, {"action": "ADD_USER", "added_user_id": user.id})
         )
+        db.commit()
+        db.refresh(team)
+        permission_cache.invalidate_user(user.id)
 
         # Send mail to user to know is added to a team
-        _ = send_email(
+        send_email(
+            db,
             user.email,
             "add_member_team",
             environment={
@@ -89,26 +89,29 @@ class CRUDTeam(CRUDBase[Team, TeamCreate, TeamPatch]):
             db.refresh(newUserNotification)
 
         # Send a msn to the user to know is added to a team
-        await socket_manager.send_to_id(
-            generate_uuid(user.id), {"event": "team" + "_created"}
+        subscribe(
+            db, user_topic(user.id), [team_topic(team.id), organization_topic(team.organization_id)]
+        )
+        send_to_id(
+            db, generate_uuid(user.id), {"event": "team" + "_created"}
         )
 
         return team
 
+    @hold_outbox
     async def remove_user(self, db: Session, team: Team, user: models.User) -> Team:
-        from app.worker import sync_asset_treeitems
-
         team.users.remove(user)
-        db.commit()
-        db.refresh(team)
-        sync_asset_treeitems.delay(
-            [permission.treeitem_id for permission in team.permissions]
-        )
+        for permission in team.permissions:
+            outbox.add(db, "sync_asset_treeitems", permission.treeitem_id)
         await log(
+            db,
             self.enrich_log_data(
                 team, {"action": "REMOVE_USER", "removed_user_id": user.id}
             )
         )
+        db.commit()
+        db.refresh(team)
+        permission_cache.invalidate_user(user.id)
 
         # Agrego la notificacion cuando un usuario es removido de un equipo:
         newUserNotification = UserNotification()
@@ -135,12 +138,14 @@ class CRUDTeam(CRUDBase[Team, TeamCreate, TeamPatch]):
             db.refresh(newUserNotification)
 
         # Send a msn to the user to know is removed to a team
-        await socket_manager.send_to_id(
-            generate_uuid(user.id), {"event": "team" + "_created"}
+        unsubscribe(db, user_topic(user.id), [team_topic(team.id)])
+        send_to_id(
+            db, generate_uuid(user.id), {"event": "team" + "_created"}
         )
 
         return team
 
+    @hold_outbox
     async def create(
         self, db: Session, obj_in: TeamCreate, creator: models.User
     ) -> Team:
@@ -159,7 +164,8 @@ class CRUDTeam(CRUDBase[Team, TeamCreate, TeamPatch]):
         db.refresh(db_obj)
 
         # Send mail to user to know is added to a team
-        _ = send_team_email(
+        send_team_email(
+            db,
             team=db_obj,
             type='add_member_team',
             environment={
@@ -203,11 +209,17 @@ class CRUDTeam(CRUDBase[Team, TeamCreate, TeamPatch]):
                 db.commit()
                 db.refresh(newUserNotification)
 
-            await socket_manager.send_to_id(
-                generate_uuid(user_id), {"event": "team" + "_created"}
+            subscribe(
+                db, user_topic(user_id), [team_topic(db_obj.id), organization_topic(db_obj.organization_id)]
+            )
+            send_to_id(
+                db, generate_uuid(user_id), {"event": "team" + "_created"}
             )
 
-        await self.log_on_create(db_obj)
+        subscribe(
+            db, user_topic(creator.id), [team_topic(db_obj.id), organization_topic(db_obj.organization_id)]
+        )
+        await self.log_on_create(db_obj, db=db)
         return db_obj
 
     async def add_application(self, db: Session, db_obj: Team, user: models.User):
@@ -231,7 +243,8 @@ class CRUDTeam(CRUDBase[Team, TeamCreate, TeamPatch]):
         #print(db_obj.id)
         # Send mail to administrators to know there is an application to the team
         for admin in db_obj.administrators:
-            _ = send_email(
+            send_email(
+                db,
                 admin.email,
                 'user_apply_team',
                 {"org_id": db_obj.organization_id,
@@ -240,7 +253,7 @@ class CRUDTeam(CRUDBase[Team, TeamCreate, TeamPatch]):
                  "user_email": user.email,
                  "user_name": user.full_name})
 
-        await self.log_on_create(db_obj)
+        await self.log_on_create(db_obj, db=db)
         return db_obj.applies
 
     # Override log methods
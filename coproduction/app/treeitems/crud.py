@@ -4,11 +4,26 @@ from typing import List, Optional
 from sqlalchemy.orm import Session
 from app.models import TreeItem, Task, Objective, Phase
 from app.schemas import PhaseCreate, ObjectiveCreate, TaskCreate
-from app.utils import update_status_and_progress
+from app.utils import Status, status_and_progress, update_status_and_progress
 from datetime import datetime
 from app import models
 from sqlalchemy import or_
-from app.sockets import socket_manager
+from app.general.outbox import tree_changed
+from app.treeitems.models import prerequisites
+from app.treeitems.graph import PrerequisiteGraph, bump_tree_versions
+from fastapi import HTTPException
+from pydantic import ValidationError
+
+
+def invalid_schema(detail) -> HTTPException:
+    return HTTPException(status_code=400, detail=f"Invalid schema: {detail}")
+
+
+def date_range(items: List[dict]):
+    starts = [item["start_date"] for item in items if item["start_date"]]
+    ends = [item["end_date"] for item in items if item["end_date"]]
+    return (min(starts) if starts else None), (max(ends) if ends else None)
+
 
 class CRUDTreeItem:
     async def get(self, db: Session, id: uuid.UUID) -> Optional[TreeItem]:
@@ -49,6 +64,12 @@ class CRUDTreeItem:
                 )
             ).all()
 
+    def get_tasks_under(self, db: Session, ids: List[uuid.UUID]) -> List[Task]:
+        # tasks whose path goes through any of the ids (coproductionprocesses or treeitems)
+        if not ids:
+            return []
+        return db.query(Task).filter(Task.path.overlap(list(ids))).all()
+
     async def remove(self, db: Session, obj, model, user_id: str = None, remove_definitely: bool = False) -> TreeItem:
         parent = None
         if model == Task:
@@ -74,7 +95,111 @@ class CRUDTreeItem:
             db.add(parent)
         db.commit()
         if hasattr(obj, "coproductionprocess_id"):
-            await socket_manager.send_to_id(obj.coproductionprocess_id, {"event": "treeitem_removed","name":obj.name})
+            tree_changed(db, obj.coproductionprocess_id, obj.id, "treeitem_removed")
         return obj
 
+    def insert_schema(self, db: Session, coproductionprocess_id: uuid.UUID, coproductionschema: dict) -> List[dict]:
+        """
+        Creates the tree of a schema with a multi-row insert per table. The ids, paths, dates,
+        status and progress are computed in memory, and nothing is written if the schema (or the
+        graph of its prerequisites) is not valid. Nothing is committed. Returns the rows of the
+        phases (the dates of the process are not aggregated by these inserts).
+        """
+        schema_id = coproductionschema.get("id")
+        treeitems, phases, objectives, tasks = [], [], [], []
+        # id in the schema => (new id, ids in the schema of its prerequisites)
+        nodes = {}
+
+        def add(metadata: dict, schema, type: str, path: list, **extra) -> dict:
+            try:
+                data = schema(**{**metadata, "from_schema": schema_id, "from_item": metadata.get("id"), **extra})
+            except ValidationError as e:
+                raise invalid_schema(e)
+            if data.from_item is None or str(data.from_item) in nodes:
+                raise invalid_schema(f"missing or repeated id {data.from_item}")
+            id = uuid.uuid4()
+            nodes[str(data.from_item)] = (id, [str(prerequisite_id) for prerequisite_id in data.prerequisites_ids or []])
+            try:
+                status = Status(data.status) if getattr(data, "status", None) else Status.awaiting
+            except ValueError:
+                raise invalid_schema(f"unknown status {data.status}")
+            treeitems.append({
+                "id": id,
+                "type": type,
+                "name": data.name,
+                "description": data.description,
+                "status": status,
+                "disabler_id": data.disabler_id,
+                "disabled_on": data.disabled_on,
+                "from_item": data.from_item,
+                "from_schema": data.from_schema,
+                "path": path + [id],
+            })
+            return {"id": id, "data": data, "treeitem": treeitems[-1]}
+
+        def aggregate(row: dict, treeitem: dict, children: List[dict]) -> None:
+            # what the aggregated columns and update_status_and_progress would store
+            row["start_date"], row["end_date"] = date_range(children)
+            treeitem["status"], row["progress"] = status_and_progress(
+                [child["treeitem"]["status"] for child in children if not child["treeitem"]["disabled_on"]]
+            )
+
+        for phasemetadata in coproductionschema.get("children", []):
+            phase = add(phasemetadata, PhaseCreate, "phase", [coproductionprocess_id])
+            phase_objectives = []
+            for objectivemetadata in phasemetadata.get("children", []):
+                objective = add(objectivemetadata, ObjectiveCreate, "objective", phase["treeitem"]["path"])
+                objective_tasks = []
+                for taskmetadata in objectivemetadata.get("children", []):
+                    task = add(
+                        taskmetadata, TaskCreate, "task", objective["treeitem"]["path"],
+                        problemprofiles=[pp["id"] for pp in taskmetadata.get("problemprofiles") or []],
+                    )
+                    data: TaskCreate = task["data"]
+                    tasks.append({
+                        "id": task["id"],
+                        "objective_id": objective["id"],
+                        "problemprofiles": data.problemprofiles,
+                        "management": data.management or 0,
+                        "development": data.development or 0,
+                        "exploitation": data.exploitation or 0,
+                        "start_date": data.start_date,
+                        "end_date": data.end_date,
+                    })
+                    objective_tasks.append({**tasks[-1], "treeitem": task["treeitem"]})
+                objectives.append({"id": objective["id"], "phase_id": phase["id"]})
+                aggregate(objectives[-1], objective["treeitem"], objective_tasks)
+                phase_objectives.append({**objectives[-1], "treeitem": objective["treeitem"]})
+            phases.append({
+                "id": phase["id"],
+                "coproductionprocess_id": coproductionprocess_id,
+                "is_part_of_codelivery": phase["data"].is_part_of_codelivery,
+            })
+            aggregate(phases[-1], phase["treeitem"], phase_objectives)
+
+        edges = []
+        # by the ids in the schema, for the error
+        graph = PrerequisiteGraph(nodes, [])
+        for key, (id, prerequisites_ids) in nodes.items():
+            for prerequisite_id in dict.fromkeys(prerequisites_ids):
+                if prerequisite_id == key or prerequisite_id not in nodes:
+                    raise invalid_schema(f"wrong prerequisite {prerequisite_id} of {key}")
+                edges.append({"treeitem_a_id": id, "treeitem_b_id": nodes[prerequisite_id][0]})
+                graph.prerequisites[key].append(prerequisite_id)
+        if cycle := graph.find_cycle():
+            raise invalid_schema(f"circular prerequisites between {', '.join(cycle)}")
+
+        for table, rows in (
+            (TreeItem.__table__, treeitems),
+            (Phase.__table__, phases),
+            (Objective.__table__, objectives),
+            (Task.__table__, tasks),
+            (prerequisites, edges),
+        ):
+            if rows:
+                db.execute(table.insert(), rows)
+        bump_tree_versions(db, [coproductionprocess_id])
+        return phases
+
+
 exportCrud = CRUDTreeItem()
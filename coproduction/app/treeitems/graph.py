@@ -0,0 +1,215 @@
+import logging
+import uuid
+from collections import deque
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, inspect, select, update
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.coproductionprocesses.models import CoproductionProcess
+from app.permissions.cache import MemoryBackend
+from app.treeitems.models import TreeItem, prerequisites
+
+logger = logging.getLogger(__name__)
+
+
+class CircularPrerequisites(Exception):
+    def __init__(self, cycle: List):
+        self.cycle = cycle
+        super().__init__("Circular prerequisite", *cycle)
+
+
+class PrerequisiteGraph:
+    """
+    The treeitems of a process and their prerequisites (edges to treeitems that are not nodes
+    are dropped). Ordering and cycle detection are O(V+E), on all the nodes or on a part of
+    them (the children of a treeitem), ignoring the edges that leave that part.
+    """
+
+    def __init__(self, nodes: Iterable[Hashable], edges: Iterable[Tuple[Hashable, Hashable]]):
+        # node => its prerequisites
+        self.prerequisites: Dict[Hashable, List[Hashable]] = {node: [] for node in nodes}
+        for node, prerequisite in edges:
+            if node in self.prerequisites and prerequisite in self.prerequisites and prerequisite not in self.prerequisites[node]:
+                self.prerequisites[node].append(prerequisite)
+        self._order: Optional[List[Hashable]] = None
+
+    def _kahn(self, nodes: List[Hashable]) -> Tuple[List[Hashable], Dict[Hashable, int]]:
+        # the nodes in order, and the prerequisites left of the ones that could not be ordered
+        pending = {node: 0 for node in nodes}
+        dependents: Dict[Hashable, List[Hashable]] = {}
+        for node in nodes:
+            for prerequisite in self.prerequisites.get(node, ()):
+                if prerequisite in pending:
+                    pending[node] += 1
+                    dependents.setdefault(prerequisite, []).append(node)
+        ready = deque(node for node in nodes if not pending[node])
+        order = []
+        while ready:
+            node = ready.popleft()
+            order.append(node)
+            for dependent in dependents.get(node, ()):
+                pending[dependent] -= 1
+                if not pending[dependent]:
+                    ready.append(dependent)
+        return order, {node: count for node, count in pending.items() if count}
+
+    def find_cycle(self, nodes: Optional[Iterable[Hashable]] = None) -> Optional[List[Hashable]]:
+        nodes = list(self.prerequisites if nodes is None else dict.fromkeys(nodes))
+        left = self._kahn(nodes)[1]
+        if not left:
+            return None
+        # every node left has a prerequisite left: following them ends in a cycle
+        node, seen = next(iter(left)), {}
+        while node not in seen:
+            seen[node] = len(seen)
+            node = next(prerequisite for prerequisite in self.prerequisites[node] if prerequisite in left)
+        return list(seen)[seen[node]:]
+
+    def order(self, nodes: Optional[Iterable[Hashable]] = None) -> List[Hashable]:
+        """
+        The nodes (all of them by default) with the prerequisites before the nodes that need them.
+        """
+        if nodes is None and self._order is not None:
+            return self._order
+        order, left = self._kahn(list(self.prerequisites if nodes is None else dict.fromkeys(nodes)))
+        if left:
+            raise CircularPrerequisites(self.find_cycle(left))
+        if nodes is None:
+            self._order = order
+        return order
+
+    def sort(self, treeitems: list, strict: bool = True) -> list:
+        """
+        The treeitems in the order of their prerequisites. If not strict, the ones in a cycle go
+        at the end, as they were given, instead of raising CircularPrerequisites.
+        """
+        by_id = {treeitem.id: treeitem for treeitem in treeitems}
+        try:
+            return [by_id[id] for id in self.order(by_id)]
+        except CircularPrerequisites:
+            if strict:
+                raise
+            order = self._kahn(list(by_id))[0]
+            ordered = set(order)
+            return [by_id[id] for id in order] + [treeitem for treeitem in treeitems if treeitem.id not in ordered]
+
+    def reaches(self, node: Hashable, target: Hashable) -> bool:
+        # whether target is a prerequisite of node, directly or not
+        seen, stack = {node}, [node]
+        while stack:
+            for prerequisite in self.prerequisites.get(stack.pop(), ()):
+                if prerequisite == target:
+                    return True
+                if prerequisite not in seen:
+                    seen.add(prerequisite)
+                    stack.append(prerequisite)
+        return False
+
+    def check_prerequisite(self, node: Hashable, prerequisite: Hashable) -> None:
+        # before making prerequisite a prerequisite of node
+        if node == prerequisite:
+            raise CircularPrerequisites([node])
+        if self.reaches(prerequisite, node):
+            raise CircularPrerequisites([node, prerequisite])
+
+
+# graphs by (process, tree_version); the version is read every time, so they are never stale
+graph_cache = MemoryBackend(settings.PREREQUISITE_GRAPH_CACHE_SIZE, ttl=settings.PREREQUISITE_GRAPH_CACHE_TTL)
+
+
+def load_prerequisite_graph(db: Session, coproductionprocess_id: uuid.UUID) -> PrerequisiteGraph:
+    # the treeitems of the process and their prerequisites, in one query
+    rows = db.execute(
+        select(TreeItem.id, prerequisites.c.treeitem_b_id)
+        .outerjoin(prerequisites, prerequisites.c.treeitem_a_id == TreeItem.id)
+        .where(TreeItem.path.contains([coproductionprocess_id]))
+        .order_by(TreeItem.created_at)
+    ).all()
+    return PrerequisiteGraph(
+        (id for id, _ in rows),
+        ((id, prerequisite_id) for id, prerequisite_id in rows if prerequisite_id is not None),
+    )
+
+
+def tree_version(db: Session, coproductionprocess_id: uuid.UUID) -> Optional[int]:
+    return db.execute(
+        select(CoproductionProcess.tree_version).where(CoproductionProcess.id == coproductionprocess_id)
+    ).scalar()
+
+
+def prerequisite_graph(db: Session, coproductionprocess_id: uuid.UUID) -> PrerequisiteGraph:
+    version = tree_version(db, coproductionprocess_id)
+    # a transaction that changed the tree could still be rolled back, and its version reused
+    if version is None or db.info.get("tree_versions_changed"):
+        return load_prerequisite_graph(db, coproductionprocess_id)
+    key = f"{coproductionprocess_id}:{version}"
+    if (graph := graph_cache.get_many([key])[0]) is None:
+        graph = load_prerequisite_graph(db, coproductionprocess_id)
+        # not cached if the tree changed while it was read
+        if tree_version(db, coproductionprocess_id) == version:
+            graph_cache.set_many({key: graph})
+    return graph
+
+
+def check_prerequisite(db: Session, treeitem: TreeItem, prerequisite: TreeItem) -> None:
+    """
+    Raises CircularPrerequisites if prerequisite is treeitem, or needs it (directly or not).
+    """
+    if treeitem is prerequisite or (treeitem.id is not None and treeitem.id == prerequisite.id):
+        raise CircularPrerequisites([treeitem.id])
+    # the new treeitems get their ids and paths
+    db.flush()
+    graph = prerequisite_graph(db, prerequisite.path_ids[0])
+    graph.check_prerequisite(treeitem.id, prerequisite.id)
+
+
+def increment_tree_versions(coproductionprocess_ids: Iterable[uuid.UUID]):
+    table = CoproductionProcess.__table__
+    # not an update of the process for updated_at
+    return update(table).where(table.c.id.in_(list(coproductionprocess_ids))).values(
+        tree_version=table.c.tree_version + 1,
+        updated_at=table.c.updated_at,
+    )
+
+
+def bump_tree_versions(db: Session, coproductionprocess_ids: Iterable[uuid.UUID]) -> None:
+    # for the changes made without the ORM (multi-row inserts)
+    if coproductionprocess_ids := set(coproductionprocess_ids):
+        db.info["tree_versions_changed"] = True
+        db.execute(increment_tree_versions(coproductionprocess_ids))
+
+
+@event.listens_for(Session, "before_flush")
+def collect_changed_trees(session, flush_context, instances):
+    # the removed treeitems and the ones whose prerequisites change (the new ones have no path yet)
+    changed = session.info.setdefault("changed_trees", set())
+    for obj in session.deleted:
+        if isinstance(obj, TreeItem):
+            changed.add(obj.path_ids[0])
+    for obj in session.dirty:
+        if isinstance(obj, TreeItem) and inspect(obj).attrs.prerequisites.history.has_changes():
+            changed.add(obj.path_ids[0])
+
+
+@event.listens_for(Session, "after_flush")
+def bump_changed_trees(session, flush_context):
+    changed = session.info.pop("changed_trees", set())
+    for obj in session.new:
+        if isinstance(obj, TreeItem) and obj.path:
+            changed.add(obj.path[0])
+    if changed := {id for id in changed if id is not None}:
+        session.info["tree_versions_changed"] = True
+        session.connection().execute(increment_tree_versions(changed))
+
+
+@event.listens_for(Session, "after_commit")
+def forget_changed_trees(session):
+    session.info.pop("tree_versions_changed", None)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def forget_changed_trees_on_rollback(session, previous_transaction):
+    session.info.pop("tree_versions_changed", None)
+    session.info.pop("changed_trees", None)
@@ -1,10 +1,12 @@
 import copy
 import uuid
 
-from sqlalchemy import Column, DateTime, Enum, ForeignKey, String, Table, or_, and_, ARRAY
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column, DateTime, Enum, ForeignKey, Index, String, Table, or_, and_, event, select
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
 from sqlalchemy.ext.associationproxy import association_proxy
-from sqlalchemy.orm import Session, relationship
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import Session, object_session, relationship
+from sqlalchemy.orm.util import identity_key
 
 from app.general.db.base_class import Base as BaseModel
 from app.permissions.models import Permission
@@ -55,6 +57,10 @@ class TreeItem(BaseModel):
     from_item = Column(UUID(as_uuid=True))
     from_schema = Column(UUID(as_uuid=True))
 
+    # ids of the coproductionprocess and of the treeitems from the phase down to this one,
+    # stored on insert (see set_path_before_insert)
+    path = Column(ARRAY(UUID(as_uuid=True)))
+
     # teams = association_proxy('_permissions', 'team')
 
     __mapper_args__ = {
@@ -62,21 +68,34 @@ class TreeItem(BaseModel):
         "polymorphic_on": type,
     }
 
+    # Phase, Objective and Task define computed_path_ids (the path from the relationships,
+    # while the stored one is not set) and parent_path (used on insert, see set_path_before_insert)
+    @hybrid_property
+    def path_ids(self):
+        if self.path:
+            return list(self.path)
+        return self.computed_path_ids()
+
+    @path_ids.expression
+    def path_ids(cls):
+        return cls.path
+
     @cached_hybrid_property
     def permissions(self):
         db = Session.object_session(self)
+        path_ids = self.path_ids
         # Get permissions of the treeitem teams of the user
         return db.query(
             Permission
         ).filter(
             or_(
                 and_(
-                    Permission.coproductionprocess_id == self.coproductionprocess.id,
+                    Permission.coproductionprocess_id == path_ids[0],
                     Permission.treeitem_id == None
                 ),
                 and_(
-                    Permission.treeitem_id.in_(self.path_ids),
-                    Permission.coproductionprocess_id == self.coproductionprocess.id
+                    Permission.treeitem_id.in_(path_ids),
+                    Permission.coproductionprocess_id == path_ids[0]
                 ),
             )
         ).all()
@@ -113,4 +132,33 @@ class TreeItem(BaseModel):
             'from_item': str(self.from_item) if self.from_item else None,
             'from_schema': str(self.from_schema) if self.from_schema else None,
             'prerequisites_ids': [str(prereq.id) for prereq in self.prerequisites]
-        }
\ No newline at end of file
+        }
+
+
+# "all the treeitems under X" is TreeItem.path.contains([X])
+Index("ix_treeitem_path", TreeItem.path, postgresql_using="gin")
+
+
+def get_stored_path(target, connection, treeitem_id):
+    # the parent is usually created in the same flush or already in the session
+    if session := object_session(target):
+        if path := session.info.get("new_treeitem_paths", {}).get(treeitem_id):
+            return list(path)
+        parent = session.identity_map.get(identity_key(TreeItem, treeitem_id))
+        if parent is not None and parent.path:
+            return list(parent.path)
+    return list(connection.execute(select(TreeItem.path).where(TreeItem.id == treeitem_id)).scalar() or [])
+
+
+@event.listens_for(TreeItem, "before_insert", propagate=True)
+def set_path_before_insert(mapper, connection, target):
+    if target.id is None:
+        target.id = uuid.uuid4()
+    target.path = target.parent_path(connection) + [target.id]
+    if session := object_session(target):
+        session.info.setdefault("new_treeitem_paths", {})[target.id] = target.path
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def forget_new_treeitem_paths(session, flush_context):
+    session.info.pop("new_treeitem_paths", None)
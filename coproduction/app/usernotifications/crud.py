@@ -11,7 +11,7 @@ from app.users.crud import exportCrud as users_crud
 
 from sqlalchemy import or_, and_
 from fastapi.encoders import jsonable_encoder
-from app.sockets import socket_manager
+from app.sockets import socket_manager, user_topic
 from uuid_by_string import generate_uuid
 from app import schemas
 
@@ -75,7 +75,7 @@ class CRUDUserNotification(CRUDBase[UserNotification, UserNotificationCreate, Us
         db.commit()
         db.refresh(db_obj)
 
-        await socket_manager.broadcast({"event": "usernotification_created"})
+        await socket_manager.send_to_id(user_topic(db_obj.user_id), {"event": "usernotification_created"})
 
         await self.log_on_create(db_obj)
         return db_obj
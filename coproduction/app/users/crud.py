@@ -7,6 +7,7 @@ from app.schemas import UserCreate, UserPatch
 import uuid
 from sqlalchemy import and_, func, or_
 from app.treeitems.crud import exportCrud as treeitemsCrud
+from app.sockets import organization_topic, team_topic
 
 
 class CRUDUser(CRUDBase[models.User, UserCreate, UserPatch]):
@@ -86,6 +87,19 @@ class CRUDUser(CRUDBase[models.User, UserCreate, UserPatch]):
             return obj
         return
 
+    def get_socket_topics(self, db: Session, id: str) -> List[str]:
+        # teams of the user, and their organizations plus the ones the user administers
+        teams = db.query(models.Team.id, models.Team.organization_id).filter(
+            or_(models.Team.users.any(models.User.id == id), models.Team.administrators.any(models.User.id == id))
+        ).all()
+        organizations = db.query(models.Organization.id).filter(
+            models.Organization.administrators.any(models.User.id == id)
+        ).all()
+        return [team_topic(team_id) for team_id, _ in teams] + [
+            organization_topic(organization_id)
+            for organization_id in {organization_id for _, organization_id in teams if organization_id} | {organization_id for organization_id, in organizations}
+        ]
+
     async def update_or_create(self, db: Session, data: dict) -> Optional[models.User]:
         from app.worker import sync_asset_users
 
@@ -106,7 +120,7 @@ class CRUDUser(CRUDBase[models.User, UserCreate, UserPatch]):
         logData["object_id"] = obj.id
         return logData
 
-    async def log_on_update(self, obj):
+    async def log_on_update(self, obj, db=None):
         # user updated frequently => do not log
         return
 
@@ -1,22 +1,8 @@
 from sqlalchemy.ext.hybrid import hybrid_property
 import enum
 
-def recursive_check(id, obj):
-    if hasattr(obj, "prerequisites"):
-        for pre in obj.prerequisites:
-            if id == pre.id:
-                raise Exception("Circular prerequisite", id, obj.id)
-            return recursive_check(id, pre)
-    return
-
 # https://stackoverflow.com/questions/34057756/how-to-combine-sqlalchemys-hybrid-property-decorator-with-werkzeugs-cached-pr
 
-def check_prerequistes(prereqs, list_indexes):
-            for prereq in prereqs:
-                if not str(prereq) in list_indexes:
-                    return False
-            return True
-
 _missing = object()   # sentinel object for missing values
 
 class cached_hybrid_property(hybrid_property):
@@ -72,6 +58,13 @@ class ClaimTypes(str, enum.Enum):
 
 def update_status_and_progress(treeitem):
     statuses = [child.status for child in getattr(treeitem, "children") if not getattr(child, "disabled_on")]
+    status, progress = status_and_progress(statuses)
+    setattr(treeitem, "status", status)
+    setattr(treeitem, "progress", progress)
+    return treeitem
+
+def status_and_progress(statuses):
+    # of a treeitem, from the statuses of its enabled children
     status = Status.awaiting
     if all([x == Status.finished for x in statuses]):
         status = Status.finished
@@ -83,6 +76,4 @@ def update_status_and_progress(treeitem):
     countFinished = statuses.count(Status.finished)
     length = len(statuses)
     progress = int((countInProgress + countFinished) * 100 / length) if length > 0 else 0
-    setattr(treeitem, "status", status)
-    setattr(treeitem, "progress", progress)
-    return treeitem
\ No newline at end of file
+    return status, progress
\ No newline at end of file
@@ -25,6 +25,7 @@ def wait_for_database() -> None:
         db = SessionLocal()
         # Try to create session to check if DB is awake
         db.execute("SELECT 1")
+        db.close()
     except Exception as e:
         logger.error(e)
         raise e
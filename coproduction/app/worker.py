@@ -1,7 +1,11 @@
-from typing import List
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from typing import List, Optional
 from uuid import UUID
 import requests
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, func, or_
 from app.celery_app import celery_app
 from app.general.db.session import SessionLocal
 from app.models import (
@@ -12,10 +16,18 @@ from app.models import (
     Team,
     CoproductionProcess,
     InternalAsset,
+    CloneJob,
+    ExportJob,
     user_team_association_table,
     coproductionprocess_administrators_association_table
 )
 from app import crud
+from app.config import settings
+from app.general.authentication import get_service_token
+from app.general.httpclient import http_client
+from app.general.outbox import outbox
+
+logger = logging.getLogger(__name__)
 
 
 @celery_app.task(acks_late=True)
@@ -25,22 +37,8 @@ def test_celery(word: str) -> str:
 
 def iterate(db, treeitems: List[TreeItem] = [], coproductionprocesses: List[CoproductionProcess] = []):
     # get all the tasks behind the treeitems or the coproductionprocess
-    tasks = {}
-    for treeitem in treeitems:
-        if treeitem.type == "objective":
-            for task in treeitem.children:
-                tasks[task.id] = task
-        elif treeitem.type == "phase":
-            for task in treeitem.tasks:
-                tasks[task.id] = task
-        else:
-            tasks[treeitem.id] = treeitem
-
-    for coproductionprocess in coproductionprocesses:
-        for phase in coproductionprocess.children:
-            for objective in phase.children:
-                for task in objective.children:
-                    tasks[task.id] = task
+    ids = [treeitem.id for treeitem in treeitems] + [coproductionprocess.id for coproductionprocess in coproductionprocesses]
+    tasks = {task.id: task for task in crud.treeitem.get_tasks_under(db=db, ids=ids)}
 
     # get users and their permissions for every task and call /sync_users of the software interlinkers used by the assets of the task
     # task: Task
@@ -134,10 +132,9 @@ def sync_asset_users(user_ids: List[str]) -> str:
 
     try:
         iterate(db, treeitems=treeitems, coproductionprocesses=coproductionprocesses)
-
-    except Exception as e:
+    finally:
+        # give the connection back to the pool
         db.close()
-        raise e
 
 
 @celery_app.task
@@ -150,7 +147,100 @@ def sync_asset_treeitems(treeitem_ids: List[UUID]) -> str:
 
     try:
         iterate(db, treeitems)
+    finally:
+        db.close()
+
+
+def renew_lease(model, job_id) -> None:
+    db = SessionLocal()
+    try:
+        db.query(model).filter(model.id == job_id, model.status == "running").update(
+            {model.lease_until: func.now() + timedelta(seconds=settings.JOB_LEASE)}, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+async def keep_leased(model, job_id) -> None:
+    while True:
+        await asyncio.sleep(settings.JOB_LEASE / 3)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, renew_lease, model, job_id)
+        except Exception as e:
+            logger.warning(f"Could not renew the lease of {model.__name__} {job_id}: {e}")
+
+
+def fail_pending(db, job, error: str):
+    # a job that could not be started (unless another worker has it), so it can be asked again
+    db.query(type(job)).filter(type(job).id == job.id, type(job).status == "pending").update(
+        {type(job).status: "failed", type(job).error: error}, synchronize_session=False
+    )
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+@asynccontextmanager
+async def leased(job):
+    # the job is not taken over by a redelivered task while this worker is alive
+    heartbeat = asyncio.ensure_future(keep_leased(type(job), job.id))
+    try:
+        yield
+    finally:
+        heartbeat.cancel()
 
-    except Exception as e:
+
+async def run_clone_job(db, job: CloneJob) -> CloneJob:
+    try:
+        # the token of the user could expire before the job is run (or run again)
+        try:
+            token = await get_service_token()
+        except Exception as e:
+            logger.exception(f"Could not get the service token for clone job {job.id}")
+            return fail_pending(db, job, f"Could not authenticate the job: {e}")
+        async with leased(job):
+            return await crud.coproductionprocess.run_clone_job(db=db, job=job, token=token)
+    finally:
+        await outbox.drain()
+        # the connections of this loop
+        await http_client.aclose()
+
+
+@celery_app.task(acks_late=True)
+def clone_coproductionprocess(job_id: str, token: Optional[str] = None) -> str:
+    # token: only in the messages queued before the jobs used the service account
+    db = SessionLocal()
+    try:
+        if not (job := db.query(CloneJob).get(job_id)):
+            return "not found"
+        return asyncio.run(run_clone_job(db, job)).status.value
+    finally:
+        db.close()
+
+
+async def run_export_job(db, job: ExportJob) -> ExportJob:
+    try:
+        # the token of the user could expire before the job is run (or run again)
+        try:
+            token = await get_service_token()
+        except Exception as e:
+            logger.exception(f"Could not get the service token for export job {job.id}")
+            return fail_pending(db, job, f"Could not authenticate the job: {e}")
+        async with leased(job):
+            return await crud.exportjob.run(db=db, job=job, token=token)
+    finally:
+        await outbox.drain()
+        await http_client.aclose()
+
+
+@celery_app.task(acks_late=True)
+def export_coproductionprocess(job_id: str, token: Optional[str] = None) -> str:
+    # token: only in the messages queued before the jobs used the service account
+    db = SessionLocal()
+    try:
+        if not (job := db.query(ExportJob).get(job_id)):
+            return "not found"
+        return asyncio.run(run_export_job(db, job)).status.value
+    finally:
         db.close()
-        raise e
@@ -0,0 +1,193 @@
+import asyncio
+import json
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import ARRAY, Date, DateTime, Float, Numeric, String
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.sql import Delete
+
+from app import models
+from app.config import settings
+from app.coproductionprocesses import bulk
+from app.coproductionprocesses.bulk import FORMAT, VERSION, decode, encode, import_lines
+from app.utils import Status
+
+# users and notifications of this instance
+USERS = {"importer", "member"}
+NOTIFICATION = uuid.uuid4()
+
+
+class ImportSession:
+    # the inserts and deletes of an import, and the answers of this instance to its selects
+    def __init__(self):
+        self.inserts = []
+        self.deletes = 0
+        self.committed = False
+
+    def execute(self, statement, rows=None):
+        if rows is not None:
+            self.inserts.append((statement.table.name, rows))
+            return None
+        if isinstance(statement, Delete):
+            self.deletes += 1
+            return None
+        columns = list(statement.selected_columns)
+        if columns[0].table.name == "notification":
+            return [("add_task_coproductionprocess", "en", NOTIFICATION)]
+        return [(value,) for value in (USERS if columns[0].table.name == "user" else ())]
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        pass
+
+    def rows(self, table: str) -> list:
+        return [row for name, rows in self.inserts if name == table for row in rows]
+
+
+@pytest.mark.unit
+def test_encode_and_decode() -> None:
+    id, now, today = uuid.uuid4(), datetime.now(), date.today()
+    values = [
+        (UUID(as_uuid=True), id),
+        (DateTime(), now),
+        (Date(), today),
+        (Numeric(2, 1), Decimal("4.5")),
+        (ARRAY(UUID(as_uuid=True)), [id, id]),
+        (String(), Status.finished),
+    ]
+    for type_, value in values:
+        assert decode(type_, json.loads(json.dumps(value, default=encode))) == value
+    assert decode(Float(), 0.5) == 0.5
+    assert decode(UUID(as_uuid=True), None) is None
+    with pytest.raises(TypeError):
+        encode(object())
+
+
+def export(process: uuid.UUID) -> list:
+    phase, objective, task, asset, broken_asset = (uuid.uuid4() for _ in range(5))
+    lines = [{"format": FORMAT, "version": VERSION, "coproductionprocess_id": str(process)}]
+
+    def row(table: str, **values) -> None:
+        lines.append({"table": table, "row": values})
+
+    row("coproductionprocess", id=process, name="process", creator_id="importer", rating=Decimal("4.5"), created_at=datetime(2023, 1, 1, 12))
+    row("coproductionprocess_administrators", coproductionprocess_id=process, user_id="importer")
+    row("coproductionprocess_administrators", coproductionprocess_id=process, user_id="member")
+    for id, type_, path in [(phase, "phase", [process, phase]), (objective, "objective", [process, phase, objective]), (task, "task", [process, phase, objective, task])]:
+        row("treeitem", id=id, type=type_, name=type_, path=path, status=Status.awaiting)
+    row("phase", id=phase, coproductionprocess_id=process)
+    row("objective", id=objective, phase_id=phase)
+    row("task", id=task, objective_id=objective)
+    row("permission", id=uuid.uuid4(), user_id="importer", coproductionprocess_id=process, treeitem_id=phase)
+    row("permission", id=uuid.uuid4(), user_id="member", coproductionprocess_id=process, treeitem_id=phase)
+    row("permission", id=uuid.uuid4(), user_id="stranger", coproductionprocess_id=process)
+    row("asset", id=asset, type="internalasset", task_id=task, coproductionprocess_id=process)
+    row("asset", id=broken_asset, type="internalasset", task_id=task, coproductionprocess_id=process)
+    row("internalasset", id=asset, external_asset_id="resource", softwareinterlinker_id=uuid.uuid4())
+    row("internalasset", id=broken_asset, external_asset_id="broken", softwareinterlinker_id=uuid.uuid4())
+    row("assignment", id=uuid.uuid4(), asset_id=asset, user_id="importer")
+    row("assignment", id=uuid.uuid4(), asset_id=broken_asset, user_id="importer")
+    row("notification", id=uuid.uuid4(), event="add_task_coproductionprocess", language="en", title="", text="")
+    row("notification", id=uuid.uuid4(), event="new_event", language="en", title="", text="")
+    row("coproductionprocessnotification", id=uuid.uuid4(), coproductionprocess_id=process, notification_id=lines[-2]["row"]["id"], asset_id=str(asset))
+    return lines
+
+
+def run_import(monkeypatch, lines: list, keep_members: bool = False):
+    clones = []
+
+    async def post(url, **kwargs):
+        clones.append(kwargs["headers"]["Idempotency-Key"])
+        request = httpx.Request("POST", url)
+        if "broken" in url:
+            return httpx.Response(404, json={"detail": "Not found"}, request=request)
+        return httpx.Response(200, json={"_id": "copy-of-" + url.split("/")[-2]}, request=request)
+
+    async def prefetch(ids):
+        list(ids)
+
+    monkeypatch.setattr(bulk.http_client, "post", post)
+    monkeypatch.setattr(bulk.interlinker_cache, "prefetch", prefetch)
+    monkeypatch.setattr(models.InternalAsset, "software_response", property(lambda self: {"service_name": "interlinker", "api_path": "/api", "backend": "http://interlinker"}))
+    # more than a batch per table
+    monkeypatch.setattr(settings, "BULK_BATCH_SIZE", 2)
+
+    body = "".join(json.dumps(line, default=encode) + "\n" for line in lines).encode()
+
+    async def chunks():
+        # split in the middle of the lines
+        for start in range(0, len(body), 100):
+            yield body[start:start + 100]
+
+    db = ImportSession()
+    user = models.User(id="importer")
+    process = asyncio.run(import_lines(db, chunks(), user=user, token="token", keep_members=keep_members))
+    return db, process, clones
+
+
+@pytest.mark.unit
+def test_export_round_trip(monkeypatch) -> None:
+    old_process = uuid.uuid4()
+    lines = export(old_process)
+    old = {line["row"]["id"]: line["row"] for line in lines[1:] if "id" in line["row"]}
+    db, process, clones = run_import(monkeypatch, lines)
+    assert db.committed
+
+    [coproductionprocess] = db.rows("coproductionprocess")
+    assert coproductionprocess["id"] == process != old_process
+    assert coproductionprocess["rating"] == Decimal("4.5")
+    assert coproductionprocess["created_at"] == datetime(2023, 1, 1, 12)
+
+    # new ids everywhere, and the references point to them
+    treeitems = db.rows("treeitem")
+    assert not {treeitem["id"] for treeitem in treeitems} & set(old)
+    phase, objective, task = treeitems
+    assert task["path"] == [process, phase["id"], objective["id"], task["id"]]
+    assert task["status"] == Status.awaiting
+    assert db.rows("phase") == [{"id": phase["id"], "coproductionprocess_id": process}]
+    assert db.rows("objective") == [{"id": objective["id"], "phase_id": phase["id"]}]
+    assert db.rows("task") == [{"id": task["id"], "objective_id": objective["id"]}]
+
+    # only the importer is kept
+    assert db.rows("coproductionprocess_administrators") == [{"coproductionprocess_id": process, "user_id": "importer"}]
+    [permission] = db.rows("permission")
+    assert (permission["user_id"], permission["treeitem_id"]) == ("importer", phase["id"])
+
+    # the resource that could not be cloned loses its asset and its assignment
+    assert len(clones) == 3
+    [internalasset] = db.rows("internalasset")
+    assert internalasset["external_asset_id"] == "copy-of-resource"
+    assert db.deletes == 1
+    [assignment] = db.rows("assignment")
+    assert assignment["asset_id"] == internalasset["id"]
+
+    # the notifications of this instance are reused
+    [notification] = db.rows("notification")
+    assert notification["event"] == "new_event"
+    [coproductionprocessnotification] = db.rows("coproductionprocessnotification")
+    assert coproductionprocessnotification["notification_id"] == NOTIFICATION
+    assert coproductionprocessnotification["asset_id"] == str(internalasset["id"])
+
+
+@pytest.mark.unit
+def test_export_round_trip_keeping_the_members(monkeypatch) -> None:
+    db, process, _ = run_import(monkeypatch, export(uuid.uuid4()), keep_members=True)
+    assert [row["user_id"] for row in db.rows("coproductionprocess_administrators")] == ["importer", "member"]
+    # the users that do not exist are still dropped
+    assert [row["user_id"] for row in db.rows("permission")] == ["importer", "member"]
+
+
+@pytest.mark.unit
+def test_import_of_an_unknown_format(monkeypatch) -> None:
+    lines = export(uuid.uuid4())
+    lines[0]["version"] = VERSION + 1
+    with pytest.raises(HTTPException) as e:
+        run_import(monkeypatch, lines)
+    assert e.value.status_code == 400
@@ -0,0 +1,68 @@
+import pytest
+
+from app.general import httpclient
+from app.general.httpclient import CircuitBreaker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(httpclient.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.mark.unit
+def test_opens_after_threshold_failures(clock) -> None:
+    breaker = CircuitBreaker(threshold=3, reset_timeout=10)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.failure()
+    assert breaker.state == "closed"
+    # a success resets the count
+    breaker.success()
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+@pytest.mark.unit
+def test_half_open_lets_a_single_trial_through(clock) -> None:
+    breaker = CircuitBreaker(threshold=1, reset_timeout=10)
+    breaker.failure()
+    clock[0] += 9
+    assert not breaker.allow()
+    clock[0] += 1
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+    assert breaker.allow()
+
+
+@pytest.mark.unit
+def test_failed_trial_opens_again(clock) -> None:
+    breaker = CircuitBreaker(threshold=5, reset_timeout=10)
+    for _ in range(5):
+        breaker.failure()
+    clock[0] += 10
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    clock[0] += 10
+    assert breaker.allow()
+
+
+@pytest.mark.unit
+def test_released_trial(clock) -> None:
+    breaker = CircuitBreaker(threshold=1, reset_timeout=10)
+    breaker.failure()
+    clock[0] += 10
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == "half_open"
+    assert breaker.allow()
@@ -0,0 +1,96 @@
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+from app.treeitems.crud import CRUDTreeItem
+from app.utils import Status
+
+
+class RecordingSession:
+    # the inserts of insert_schema, by table
+    def __init__(self):
+        self.info = {}
+        self.inserts = {}
+        self.updates = []
+
+    def execute(self, statement, rows=None):
+        if rows is None:
+            # the version of the tree
+            self.updates.append(statement.table.name)
+        else:
+            self.inserts[statement.table.name] = rows
+
+
+def item(id, *children, **fields) -> dict:
+    return {"id": str(id), "name": f"item {id}", "description": "", "children": list(children), **fields}
+
+
+def schema(*phases) -> dict:
+    return {"id": str(uuid.uuid4()), "children": list(phases)}
+
+
+def insert(coproductionschema: dict):
+    db = RecordingSession()
+    CRUDTreeItem().insert_schema(db, uuid.uuid4(), coproductionschema)
+    assert db.updates == ["coproductionprocess"]
+    return db.inserts
+
+
+def error(coproductionschema: dict) -> str:
+    db = RecordingSession()
+    with pytest.raises(HTTPException) as e:
+        CRUDTreeItem().insert_schema(db, uuid.uuid4(), coproductionschema)
+    assert e.value.status_code == 400
+    assert db.inserts == {} and db.updates == []
+    return e.value.detail
+
+
+@pytest.mark.unit
+def test_insert_schema() -> None:
+    phase, objective, task_a, task_b = (uuid.uuid4() for _ in range(4))
+    inserts = insert(schema(
+        item(phase, item(
+            objective,
+            item(task_a, status="finished", start_date="2023-01-01", end_date="2023-01-10"),
+            item(task_b, prerequisites_ids=[str(task_a)], start_date="2023-01-05", end_date="2023-02-01"),
+        ), is_part_of_codelivery=False),
+    ))
+    treeitems = {row["from_item"]: row for row in inserts["treeitem"]}
+    assert [row["type"] for row in inserts["treeitem"]] == ["phase", "objective", "task", "task"]
+    assert treeitems[task_b]["path"] == [
+        treeitems[phase]["path"][0], treeitems[phase]["id"], treeitems[objective]["id"], treeitems[task_b]["id"]
+    ]
+    assert inserts["treeitem_prerequisites"] == [{"treeitem_a_id": treeitems[task_b]["id"], "treeitem_b_id": treeitems[task_a]["id"]}]
+    assert treeitems[objective]["status"] == Status.in_progress
+    [objective_row] = inserts["objective"]
+    assert (str(objective_row["start_date"]), str(objective_row["end_date"])) == ("2023-01-01", "2023-02-01")
+
+
+@pytest.mark.unit
+def test_insert_schema_with_invalid_items() -> None:
+    phase, objective = uuid.uuid4(), uuid.uuid4()
+    assert "Invalid schema" in error(schema({"id": str(phase), "name": "no description", "is_part_of_codelivery": False}))
+    assert "repeated id" in error(schema(item(phase, item(phase), is_part_of_codelivery=False)))
+    assert "missing" in error(schema({"name": "phase", "description": "", "is_part_of_codelivery": False}))
+    assert "unknown status" in error(schema(item(phase, item(objective, item(uuid.uuid4(), status="lost")), is_part_of_codelivery=False)))
+
+
+@pytest.mark.unit
+def test_insert_schema_with_wrong_prerequisites() -> None:
+    phase, other = uuid.uuid4(), uuid.uuid4()
+    assert "wrong prerequisite" in error(schema(item(phase, prerequisites_ids=[str(phase)], is_part_of_codelivery=False)))
+    # dangling
+    assert "wrong prerequisite" in error(schema(item(phase, prerequisites_ids=[str(other)], is_part_of_codelivery=False)))
+
+
+@pytest.mark.unit
+def test_insert_schema_with_circular_prerequisites() -> None:
+    a, b, c = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    detail = error(schema(
+        item(a, prerequisites_ids=[str(c)], is_part_of_codelivery=False),
+        item(b, prerequisites_ids=[str(a)], is_part_of_codelivery=False),
+        item(c, prerequisites_ids=[str(b)], is_part_of_codelivery=False),
+    ))
+    assert "circular prerequisites" in detail
+    assert all(str(id) in detail for id in (a, b, c))
@@ -0,0 +1,93 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.treeitems.graph import CircularPrerequisites, PrerequisiteGraph
+
+
+def items(*ids) -> list:
+    return [SimpleNamespace(id=id) for id in ids]
+
+
+@pytest.mark.unit
+def test_order_puts_prerequisites_first() -> None:
+    graph = PrerequisiteGraph("abcd", [("b", "a"), ("c", "b"), ("d", "a")])
+    order = graph.order()
+    assert sorted(order) == list("abcd")
+    assert order.index("a") < order.index("b") < order.index("c")
+    assert order.index("a") < order.index("d")
+
+
+@pytest.mark.unit
+def test_order_of_a_part_ignores_the_edges_that_leave_it() -> None:
+    graph = PrerequisiteGraph("abc", [("c", "b"), ("b", "a")])
+    assert graph.order(["c", "b"]) == ["b", "c"]
+    assert graph.order(["c"]) == ["c"]
+
+
+@pytest.mark.unit
+def test_dangling_prerequisites_are_dropped() -> None:
+    graph = PrerequisiteGraph("ab", [("a", "x"), ("y", "a"), ("b", "a"), ("b", "a")])
+    assert graph.prerequisites == {"a": [], "b": ["a"]}
+    assert graph.order() == ["a", "b"]
+    assert not graph.reaches("a", "x")
+
+
+@pytest.mark.unit
+def test_find_cycle() -> None:
+    graph = PrerequisiteGraph("abcd", [("a", "d"), ("b", "a"), ("c", "b"), ("a", "c")])
+    cycle = graph.find_cycle()
+    assert sorted(cycle) == ["a", "b", "c"]
+    # every node of the cycle needs the next one
+    for node, prerequisite in zip(cycle, cycle[1:] + cycle[:1]):
+        assert prerequisite in graph.prerequisites[node]
+    assert graph.find_cycle(["a", "b", "d"]) is None
+
+
+@pytest.mark.unit
+def test_find_cycle_of_a_node_on_itself() -> None:
+    graph = PrerequisiteGraph("ab", [("a", "a"), ("b", "a")])
+    assert graph.find_cycle() == ["a"]
+
+
+@pytest.mark.unit
+def test_order_raises_on_cycles() -> None:
+    graph = PrerequisiteGraph("abc", [("a", "b"), ("b", "a"), ("c", "a")])
+    with pytest.raises(CircularPrerequisites) as e:
+        graph.order()
+    assert sorted(e.value.cycle) == ["a", "b"]
+    assert graph.order(["c", "a"]) == ["a", "c"]
+
+
+@pytest.mark.unit
+def test_sort() -> None:
+    graph = PrerequisiteGraph("abc", [("a", "c"), ("c", "b")])
+    assert [treeitem.id for treeitem in graph.sort(items("a", "b", "c"))] == ["b", "c", "a"]
+
+
+@pytest.mark.unit
+def test_sort_not_strict_puts_the_cycles_at_the_end() -> None:
+    graph = PrerequisiteGraph("abcd", [("a", "b"), ("b", "a"), ("d", "c")])
+    treeitems = items("d", "b", "a", "c")
+    with pytest.raises(CircularPrerequisites):
+        graph.sort(treeitems)
+    assert [treeitem.id for treeitem in graph.sort(treeitems, strict=False)] == ["c", "d", "b", "a"]
+
+
+@pytest.mark.unit
+def test_reaches() -> None:
+    graph = PrerequisiteGraph("abcd", [("a", "b"), ("b", "c"), ("c", "a")])
+    assert graph.reaches("a", "c")
+    assert graph.reaches("a", "a")
+    assert not graph.reaches("c", "d")
+    assert not graph.reaches("d", "a")
+
+
+@pytest.mark.unit
+def test_check_prerequisite() -> None:
+    graph = PrerequisiteGraph("abc", [("b", "a"), ("c", "b")])
+    graph.check_prerequisite("c", "a")
+    with pytest.raises(CircularPrerequisites):
+        graph.check_prerequisite("a", "c")
+    with pytest.raises(CircularPrerequisites):
+        graph.check_prerequisite("a", "a")
@@ -0,0 +1,40 @@
+import io
+import zipfile
+
+import pytest
+
+from app.general.zipstream import ZipStream
+
+
+@pytest.mark.unit
+def test_zipstream() -> None:
+    archive = ZipStream()
+    content = bytes(range(256)) * 1000
+    chunks = []
+    archive.write("manifest.json", b"{}")
+    chunks.append(archive.read())
+    assert archive.pending == 0
+    # a member of unknown size, written in parts
+    with archive.open("assets/content") as member:
+        for start in range(0, len(content), 4096):
+            member.write(content[start:start + 4096])
+            chunks.append(archive.read())
+    chunks.append(archive.close())
+
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as result:
+        assert result.testzip() is None
+        assert result.namelist() == ["manifest.json", "assets/content"]
+        assert result.read("manifest.json") == b"{}"
+        assert result.read("assets/content") == content
+        assert result.getinfo("assets/content").compress_size < len(content)
+
+
+@pytest.mark.unit
+def test_zipstream_without_compression() -> None:
+    archive = ZipStream(compression=zipfile.ZIP_STORED)
+    archive.write("a.txt", b"a" * 100)
+    data = archive.read() + archive.close()
+    assert archive.pending == 0
+    with zipfile.ZipFile(io.BytesIO(data)) as result:
+        assert result.getinfo("a.txt").compress_size == 100
+        assert result.read("a.txt") == b"a" * 100